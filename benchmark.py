@@ -0,0 +1,299 @@
+"""
+Бенчмарк токенизатора, restore_cyrillic, is_known_word, load() и стадий PoeticSpellchecker.fix().
+
+Корпуса генерируются из встроенных фраз с фиксированным seed, так что запуски на разных машинах и версиях
+кода сравнимы между собой:
+    clean_prose  - чистая проза без ошибок
+    poetry       - стихи в тегах <verse>
+    homoglyphs   - текст "из интернета" с латинскими буквами и цифрами вместо похожих кириллических
+    censored     - текст с матом, замаскированным звездочками
+    long_line    - длинные документы в одну строку
+    errors       - примеры типичных ошибок, которые исправляет спеллчекер
+Свои корпуса (один текст на строку) добавляются через --input.
+
+Для каждой функции на каждом корпусе выводятся число вызовов в секунду, символов в секунду и перцентили
+задержки одного вызова. Стадии fix() (см. PoeticSpellchecker.fix_stages) замеряются по отдельности, каждая
+на тексте после предыдущих стадий; is_known_word замеряется пачками по 64 токена, задержка пересчитана на
+один вызов. fix_cold - fix() с пустым кэшем токенов: перед каждым повтором кэш очищается, так что все
+токены корпуса проходят через пословные правила, как при первой встрече в реальном корпусе. Остальные
+замеры fix() делаются после прогрева, когда в кэше уже есть все токены корпуса, и показывают установившийся
+режим на повторяющейся лексике.
+
+Только токенизатор и restore_cyrillic:
+    python benchmark.py --output bench.json
+
+Со словарями из ./data, сравнение с предыдущим запуском:
+    python benchmark.py --data_dir ./data --output bench.json --compare old_bench.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from tokenization_utils import tokenize_slowly, Tokenizer
+from restore_cyrillic import restore_cyrillic
+from latency_stats import percentiles_ms
+
+
+PROSE_SENTENCES = ['В лесу родилась ёлочка, в лесу она росла.',
+                   'Зимой и летом стройная, зелёная была.',
+                   'Утром мы вышли из дома и долго шли вдоль реки к старому мосту.',
+                   'Никто не знал, сколько времени осталось до начала грозы.',
+                   'Он открыл окно, и в комнату ворвался холодный осенний ветер.',
+                   'Мы договорились встретиться на вокзале в семь часов вечера.',
+                   'Книга лежала на столе, рядом с чашкой остывшего чая.',
+                   'Дети играли во дворе, пока взрослые готовили ужин.',
+                   'Поезд медленно тронулся, и перрон поплыл назад.',
+                   'Она всегда говорила, что лучшее ещё впереди.',
+                   'Вдалеке показались огни небольшого города.',
+                   'Соседи давно привыкли к шуму строительства за забором.',
+                   ]
+
+VERSE_LINES = ['Я помню чудное мгновенье:', 'Передо мной явилась ты,', 'Как мимолётное виденье,',
+               'Как гений чистой красоты.', 'Мороз и солнце; день чудесный!', 'Ещё ты дремлешь, друг прелестный,',
+               'Пора, красавица, проснись:', 'Открой сомкнуты негой взоры', 'Белеет парус одинокий',
+               'В тумане моря голубом!', 'Что ищет он в стране далёкой?', 'Что кинул он в краю родном?',
+               ]
+
+# Кириллица => латинская буква или цифра того же начертания.
+HOMOGLYPHS = {'а': 'a', 'о': 'o', 'е': 'e', 'с': 'c', 'р': 'p', 'х': 'x', 'у': 'y', 'к': 'k', 'б': '6',
+              'А': 'A', 'О': 'O', 'Е': 'E', 'С': 'C', 'Р': 'P', 'Х': 'X', 'К': 'K', 'Н': 'H', 'Т': 'T',
+              'М': 'M', 'В': 'B', 'З': '3'}
+
+CENSORED_WORDS = ['х*й', 'х**', 'б**дь', 'бл*', 'бл@', 'с*ка', 'п***ц', 'е*ать', 'ё*аный', 'г*вно', 'ж*па', 'н*х',
+                  'на***', '***']
+
+ERROR_SAMPLES = ['Вмести в себя все от кровенья мира', 'за скучаешь', 'Ты дождевик одень ка.', 'Кому - то повезло',
+                 'С деревьев ветки по-срывал!', 'Мы-же ни к кому не лезли.', 'Знаешь-ли, такая штука - жизнь',
+                 'Когда есть свет, к тому(ж) тепло', 'Но Любовью бе(з)конечной', 'Другой добычи поищу - ка!',
+                 'Ты поёшь немного по - французски.', 'Там поля стоят во-ржи', 'По мне, чудн’о названье это,',
+                 'Чак Hоррис никогда не спит. Он ждет.', 'и c тобой', 'Я-б поучаствовал', 'Мы , лишь, хотели',
+                 'Что такое блогер-это смелость', 'чорный шоколад', 'Ты заниматся спортом', 'пошол домой']
+
+
+def make_corpora(rnd, ntexts, long_chars, nlong):
+    corpora = dict()
+
+    corpora['clean_prose'] = [' '.join(rnd.choice(PROSE_SENTENCES) for _ in range(rnd.randint(2, 8))) for _ in range(ntexts)]
+
+    poems = []
+    for _ in range(ntexts):
+        stanzas = ['\n'.join(rnd.choice(VERSE_LINES) for _ in range(4)) for _ in range(rnd.randint(1, 3))]
+        poems.append('<verse>\n' + '\n\n'.join(stanzas) + '\n</verse>')
+    corpora['poetry'] = poems
+
+    def spoil(text, rate):
+        return ''.join(HOMOGLYPHS[c] if c in HOMOGLYPHS and rnd.random() < rate else c for c in text)
+    corpora['homoglyphs'] = [spoil(text, 0.15) for text in corpora['clean_prose']]
+
+    censored = []
+    for text in corpora['clean_prose']:
+        words = text.split(' ')
+        for _ in range(rnd.randint(1, 4)):
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(CENSORED_WORDS))
+        censored.append(' '.join(words))
+    corpora['censored'] = censored
+
+    long_texts = []
+    for _ in range(nlong):
+        sentences = []
+        size = 0
+        while size < long_chars:
+            sentence = rnd.choice(PROSE_SENTENCES)
+            sentences.append(sentence)
+            size += len(sentence) + 1
+        long_texts.append(' '.join(sentences)[:long_chars])
+    corpora['long_line'] = long_texts
+
+    corpora['errors'] = list(ERROR_SAMPLES)
+
+    return corpora
+
+
+def summarize(latencies, nchars, calls_per_item=1):
+    """latencies - секунды на элемент, calls_per_item - сколько вызовов функции в одном элементе."""
+    total = sum(latencies)
+    per_call = sorted(t / calls_per_item for t in latencies)
+    calls = len(latencies) * calls_per_item
+    return {'calls': calls,
+            'total_s': round(total, 6),
+            'calls_per_s': round(calls / total, 1) if total > 0 else None,
+            'chars_per_s': round(nchars / total, 1) if total > 0 and nchars else None,
+            'mean_ms': round(total / calls * 1000.0, 6) if calls else 0.0,
+            **percentiles_ms(per_call, [('p50_ms', 50), ('p99_ms', 99)], 6),
+            }
+
+
+def measure(func, items, repeats, sizes=None, calls_per_item=1):
+    latencies = []
+    for _ in range(repeats):
+        for item in items:
+            t0 = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - t0)
+    nchars = sum(sizes) * repeats if sizes else 0
+    return summarize(latencies, nchars, calls_per_item)
+
+
+def measure_fix_stages(schecker, texts, repeats):
+    """Замеры каждой стадии fix_uncached на тексте после предыдущих стадий, а также fix_uncached и fix целиком."""
+    stage_latencies = dict((stage, []) for stage, fix_stage in schecker.fix_stages())
+    stage_chars = dict((stage, 0) for stage in stage_latencies)
+    for _ in range(repeats):
+        for text in texts:
+            fixups = []
+            text2 = text
+            for stage, fix_stage in schecker.fix_stages():
+                stage_chars[stage] += len(text2)
+                t0 = time.perf_counter()
+                text2 = fix_stage(text2, fixups)
+                stage_latencies[stage].append(time.perf_counter() - t0)
+
+    results = dict(('fix.' + stage, summarize(latencies, stage_chars[stage])) for stage, latencies in stage_latencies.items())
+    sizes = [len(text) for text in texts]
+    results['fix_uncached'] = measure(schecker.fix_uncached, texts, repeats, sizes)
+    results['needs_fixing'] = measure(schecker.needs_fixing, texts, repeats, sizes)
+
+    checks, clean = schecker.prescreen_checks, schecker.prescreen_clean
+    results['fix'] = measure(schecker.fix, texts, repeats, sizes)
+    # Доля текстов корпуса, которые fix() вернул сразу после needs_fixing().
+    checks = schecker.prescreen_checks - checks
+    results['fix']['prescreen_hit_rate'] = round((schecker.prescreen_clean - clean) / checks, 4) if checks else 0.0
+    return results
+
+
+def measure_cold(schecker, texts, repeats):
+    """fix() с пустым кэшем токенов в начале каждого повтора."""
+    latencies = []
+    for _ in range(repeats):
+        schecker.token_cache.clear()
+        for text in texts:
+            t0 = time.perf_counter()
+            schecker.fix(text)
+            latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, sum(len(text) for text in texts) * repeats)
+
+
+def benchmark_corpus(texts, repeats, schecker, tokenizer, skip_slow_tokenizer):
+    sizes = [len(text) for text in texts]
+    results = dict()
+
+    if not skip_slow_tokenizer:
+        results['tokenize_slowly'] = measure(lambda text: list(tokenize_slowly(text)), texts, repeats, sizes)
+    results['tokenize'] = measure(lambda text: list(tokenizer.tokenize(text)), texts, repeats, sizes)
+    results['restore_cyrillic'] = measure(restore_cyrillic, texts, repeats, sizes)
+
+    if schecker is not None:
+        tokens = [token for text in texts for token in schecker.tokenize(text)]
+        blocks = [tokens[i: i + 64] for i in range(0, len(tokens) - 63, 64)]
+        if blocks:
+            is_known_word = schecker.is_known_word
+            results['is_known_word'] = measure(lambda block: [is_known_word(token) for token in block], blocks, repeats,
+                                               [sum(len(token) for token in block) for block in blocks], calls_per_item=64)
+
+        # Кэш токенов, оставшийся от предыдущих корпусов, не должен влиять на замер холодного прохода.
+        results['fix_cold'] = measure_cold(schecker, texts, repeats)
+
+        # Прогрев: кэш токенов заполняется так же, как при обработке корпуса.
+        schecker.token_cache.clear()
+        for text in texts:
+            schecker.fix(text)
+        results.update(measure_fix_stages(schecker, texts, repeats))
+
+    return results
+
+
+def benchmark_load(data_dir, repeats):
+    from spellcheck import PoeticSpellchecker
+
+    latencies = []
+    schecker = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        schecker = PoeticSpellchecker(None)
+        schecker.load(data_dir)
+        latencies.append(time.perf_counter() - t0)
+    return schecker, summarize(latencies, 0)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(old_report, new_report):
+    """Строки сравнения p50 и пропускной способности с предыдущим запуском."""
+    lines = []
+    for corpus, corpus_report in new_report['corpora'].items():
+        old_benchmarks = old_report.get('corpora', dict()).get(corpus, dict()).get('benchmarks', dict())
+        for name, result in corpus_report['benchmarks'].items():
+            old = old_benchmarks.get(name)
+            if not old or not old.get('p50_ms') or not old.get('calls_per_s') or not result.get('calls_per_s'):
+                continue
+            lines.append('{:<12} {:<18} p50 {:>10.4f} => {:>10.4f} ms   throughput x{:.2f}'.format(
+                corpus, name, old['p50_ms'], result['p50_ms'], result['calls_per_s'] / old['calls_per_s']))
+    return lines
+
+
+if __name__ == '__main__':
+    proggy = argparse.ArgumentParser(description='Benchmark of the tokenizer, restore_cyrillic and the fix() stages')
+    proggy.add_argument('--data_dir', type=str, default=None, help='directory with spellcheck.pkl; if omitted, the spellchecker is not benchmarked')
+    proggy.add_argument('--input', type=str, action='append', default=[], help='extra corpus, one text per line; can be repeated')
+    proggy.add_argument('--output', type=str, default='-', help='JSON report, "-" for stdout')
+    proggy.add_argument('--compare', type=str, default=None, help='previous JSON report to compare with')
+    proggy.add_argument('--ntexts', type=int, default=200, help='number of texts in each generated corpus')
+    proggy.add_argument('--long_chars', type=int, default=20000, help='length of texts in the long_line corpus')
+    proggy.add_argument('--nlong', type=int, default=5, help='number of texts in the long_line corpus')
+    proggy.add_argument('--repeats', type=int, default=3)
+    proggy.add_argument('--load_repeats', type=int, default=3)
+    proggy.add_argument('--skip_slow_tokenizer', action='store_true', help='do not benchmark tokenize_slowly')
+    proggy.add_argument('--seed', type=int, default=1)
+    args = proggy.parse_args()
+
+    corpora = make_corpora(random.Random(args.seed), args.ntexts, args.long_chars, args.nlong)
+    for path in args.input:
+        with open(path, encoding='utf-8') as rdr:
+            corpora[os.path.splitext(os.path.basename(path))[0]] = [line.rstrip('\n') for line in rdr if line.strip()]
+
+    report = {'meta': {'started': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'git_revision': git_revision(),
+                       'args': vars(args)},
+              'corpora': dict()}
+
+    schecker = None
+    tokenizer = Tokenizer()
+    if args.data_dir:
+        schecker, report['load'] = benchmark_load(args.data_dir, args.load_repeats)
+        tokenizer = schecker.tokenizer
+        print('load: p50 {:.1f} ms'.format(report['load']['p50_ms']), file=sys.stderr, flush=True)
+
+    for corpus, texts in corpora.items():
+        results = benchmark_corpus(texts, args.repeats, schecker, tokenizer, args.skip_slow_tokenizer)
+        report['corpora'][corpus] = {'texts': len(texts), 'chars': sum(len(text) for text in texts), 'benchmarks': results}
+        for name, result in results.items():
+            print('{:<12} {:<18} {:>12} calls/s  p50 {:>10.4f} ms  p99 {:>10.4f} ms'.format(corpus, name, result['calls_per_s'],
+                                                                                           result['p50_ms'], result['p99_ms']),
+                  file=sys.stderr, flush=True)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as rdr:
+            for line in compare(json.load(rdr), report):
+                print(line, file=sys.stderr)
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        with open(args.output, 'w', encoding='utf-8') as wrt:
+            json.dump(report, wrt, ensure_ascii=False, indent=2)
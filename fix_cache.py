@@ -0,0 +1,117 @@
+"""
+Дисковый кэш результатов PoeticSpellchecker.fix().
+
+При повторном прогоне корпуса после небольшой правки словарей почти все тексты дают тот же результат,
+что и в прошлый раз. Кэш хранит результаты fix() в sqlite-файле с ключом (отпечаток словарей, хэш текста).
+Отпечаток - это sha1 файлов словарей (spellcheck.pkl и known_words.sst) и исходников правил плюс настройки
+norvig (см. PoeticSpellchecker.open_fix_cache), поэтому после пересборки словарей или правки правил
+старые записи перестают находиться. Сами они остаются в файле, пока их явно не удалит purge():
+другой процесс может еще работать со старыми словарями.
+
+Файл открывается в режиме WAL, так что его могут одновременно читать и дописывать несколько процессов.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from text_edits import Fixup
+
+
+CACHE_FORMAT_VERSION = 1
+
+
+def file_fingerprint(*paths: str) -> str:
+    h = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class FixCache(object):
+    def __init__(self, path: str, fingerprint: str, timeout=60.0):
+        self.path = path
+        self.fingerprint = '{}:{}'.format(CACHE_FORMAT_VERSION, fingerprint)
+        self.hits = 0
+        self.misses = 0
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS fixes (fingerprint TEXT NOT NULL, text_hash TEXT NOT NULL,'
+                          ' new_text TEXT NOT NULL, fixups TEXT NOT NULL, PRIMARY KEY (fingerprint, text_hash))')
+
+    def get(self, text: str):
+        """Возвращает сохраненный результат fix(text) или None."""
+        row = self.conn.execute('SELECT new_text, fixups FROM fixes WHERE fingerprint = ? AND text_hash = ?',
+                                (self.fingerprint, text_hash(text))).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        new_text, fixups = row
+        return new_text, [Fixup(*fixup) for fixup in json.loads(fixups)]
+
+    def put(self, text: str, result):
+        new_text, fixups = result
+        data = json.dumps([(fixup[0], fixup[1], getattr(fixup, 'start', None), getattr(fixup, 'end', None), getattr(fixup, 'rule', None))
+                           for fixup in fixups], ensure_ascii=False)
+        self.conn.execute('INSERT OR REPLACE INTO fixes (fingerprint, text_hash, new_text, fixups) VALUES (?, ?, ?, ?)',
+                          (self.fingerprint, text_hash(text), new_text, data))
+
+    def purge(self) -> int:
+        """Удаляет записи, сделанные с другими словарями, и возвращает их число."""
+        return self.conn.execute('DELETE FROM fixes WHERE fingerprint != ?', (self.fingerprint,)).rowcount
+
+    def close(self):
+        self.conn.close()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'fix_cache.sqlite')
+
+        cache = FixCache(path, 'abc')
+        assert cache.get('Tы xочу') is None
+        cache.put('Tы xочу', ('Ты хочу', [Fixup('Tы', 'Ты', 0, 2, 'replaces'), ('xочу', 'хочу')]))
+
+        # Другой процесс с теми же словарями видит запись.
+        cache2 = FixCache(path, 'abc')
+        new_text, fixups = cache2.get('Tы xочу')
+        assert new_text == 'Ты хочу'
+        assert fixups == [('Tы', 'Ты'), ('xочу', 'хочу')]
+        assert (fixups[0].start, fixups[0].end, fixups[0].rule) == (0, 2, 'replaces')
+        assert fixups[1].start is None
+        cache2.close()
+
+        # После пересборки словарей старые записи не используются.
+        cache3 = FixCache(path, 'def')
+        assert cache3.get('Tы xочу') is None
+        assert cache3.stats()['misses'] == 1
+
+        # Старые записи удаляются только явным вызовом purge().
+        assert cache.get('Tы xочу') is not None
+        assert cache3.purge() == 1
+        assert cache.get('Tы xочу') is None
+        cache3.close()
+        cache.close()
+
+    print('All done =)')
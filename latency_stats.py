@@ -0,0 +1,28 @@
+"""
+Перцентили задержек для benchmark.py, spellcheck_server.py и spellcheck_client.py.
+"""
+
+
+LATENCY_POINTS = [('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)]
+
+
+def percentile(sorted_values, p):
+    """Значение p-го перцентиля (0..100) по отсортированному списку, 0.0 для пустого списка."""
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[i]
+
+
+def percentiles_ms(sorted_values, points=LATENCY_POINTS, ndigits=3):
+    """Словарь {название: перцентиль в миллисекундах} для отсортированных задержек в секундах."""
+    return dict((name, round(percentile(sorted_values, p) * 1000.0, ndigits)) for name, p in points)
+
+
+if __name__ == '__main__':
+    values = [i / 1000.0 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05 and percentile(values, 100) == 0.1 and percentile(values, 0) == 0.001
+    assert percentile([], 99) == 0.0
+    assert percentiles_ms(values) == {'p50': 50.0, 'p90': 90.0, 'p99': 99.0, 'max': 100.0}
+    assert percentiles_ms(values, [('p50_ms', 50)], 6) == {'p50_ms': 50.0}
+    print('All done =)')
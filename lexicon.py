@@ -0,0 +1,170 @@
+"""
+Словарь известных слов вместе с частями речи.
+
+Раньше части речи хранились в word2upos - defaultdict(set) с отдельным множеством строк для каждого
+слова из word2tags.dat, хотя is_verb() и is_verb_only() спрашивают только "есть ли среди частей речи глагол"
+и "глагол ли это и только глагол". Теперь для каждого слова хранится одно целое число:
+    бит KNOWN - слово входит в known_words,
+    бит FOLD_KNOWN - слово известно точно или после замены ё на е,
+    бит FOLD_VERB - форма слова с заменой ё на е - глагол,
+    биты начиная с POS_SHIFT - части речи, номер бита задается списком upos_names.
+Младшие биты до POS_SHIFT зарезервированы под флаги слова.
+
+Флаги FOLD_* вычисляются при сборке словаря, поэтому для слов из словаря is_known(..., strict_yofication)
+и is_verb() отвечают по одному поиску, без word.replace('ё', 'е') и второго обращения к таблице.
+Вторая проверка остается только для форм с ё, которых в словаре нет вообще.
+
+Числа лежат в массиве значений MappedStringTable (файл known_words.sst), а список upos_names - в spellcheck.pkl.
+"""
+
+from mmap_dict import MappedStringTable, write_string_table
+
+
+KNOWN = 1
+FOLD_KNOWN = 2
+FOLD_VERB = 4
+POS_SHIFT = 8
+VERB_UPOS = 'ГЛАГОЛ'
+MAX_UPOS = 32 - POS_SHIFT
+
+
+def build_masks(known_words, word2upos):
+    """Возвращает список частей речи и словарь {слово: битовая маска}."""
+    upos_names = sorted(set(upos for uposes in word2upos.values() for upos in uposes))
+    if len(upos_names) > MAX_UPOS:
+        raise ValueError('Too many parts of speech for the bitmask: {}'.format(len(upos_names)))
+
+    upos2bit = dict((upos, 1 << (POS_SHIFT + i)) for i, upos in enumerate(upos_names))
+    masks = dict((word, KNOWN) for word in known_words)
+    for word, uposes in word2upos.items():
+        mask = masks.get(word, 0)
+        for upos in uposes:
+            mask |= upos2bit[upos]
+        masks[word] = mask
+
+    verb_bit = upos2bit.get(VERB_UPOS, 0)
+    for word, mask in masks.items():
+        if mask & KNOWN:
+            mask |= FOLD_KNOWN
+        if 'ё' in word:
+            folded_mask = masks.get(word.replace('ё', 'е'), 0)
+            if folded_mask & KNOWN:
+                mask |= FOLD_KNOWN
+            if folded_mask & verb_bit:
+                mask |= FOLD_VERB
+        masks[word] = mask
+
+    return upos_names, masks
+
+
+class Lexicon(object):
+    def __init__(self, table, upos_names):
+        """table - MappedStringTable или dict {слово: маска}, upos_names - части речи в порядке битов."""
+        self.table = table
+        self.upos_names = list(upos_names)
+        self.upos2bit = dict((upos, 1 << (POS_SHIFT + i)) for i, upos in enumerate(self.upos_names))
+        self.verb_bit = self.upos_bit(VERB_UPOS)
+
+    @staticmethod
+    def write(path, known_words, word2upos):
+        """Сохраняет словарь в файл path и возвращает список частей речи для Lexicon(MappedStringTable(path), ...)."""
+        upos_names, masks = build_masks(known_words, word2upos)
+        write_string_table(path, masks.keys(), masks)
+        return upos_names
+
+    @staticmethod
+    def from_sets(known_words, word2upos):
+        """Словарь в памяти из множества known_words и word2upos в прежнем формате."""
+        upos_names, masks = build_masks(known_words, word2upos)
+        return Lexicon(masks, upos_names)
+
+    def upos_bit(self, upos):
+        """Бит части речи upos, 0 для части речи, которой нет в словаре."""
+        return self.upos2bit.get(upos, 0)
+
+    def upos_mask(self, word):
+        """Биты частей речи слова word, 0 для слов без частей речи."""
+        return self.table.get(word, 0) & ~((1 << POS_SHIFT) - 1)
+
+    def is_known(self, word, strict_yofication=False):
+        """Есть ли слово в known_words, а без strict_yofication - еще и после замены ё на е."""
+        mask = self.table.get(word)
+        if mask is not None:
+            return (mask & (KNOWN if strict_yofication else FOLD_KNOWN)) != 0
+
+        if strict_yofication or 'ё' not in word:
+            return False
+
+        return (self.table.get(word.replace('ё', 'е'), 0) & KNOWN) != 0
+
+    def is_verb(self, word):
+        """Может ли слово быть глаголом, в том числе после замены ё на е."""
+        mask = self.table.get(word)
+        if mask is not None:
+            return (mask & (self.verb_bit | FOLD_VERB)) != 0
+
+        if 'ё' not in word:
+            return False
+
+        return (self.table.get(word.replace('ё', 'е'), 0) & self.verb_bit) != 0
+
+    def uposes(self, word):
+        mask = self.upos_mask(word)
+        return set(upos for upos, bit in self.upos2bit.items() if mask & bit)
+
+    def __contains__(self, word):
+        return (self.table.get(word, 0) & KNOWN) != 0 if isinstance(word, str) else False
+
+    def __iter__(self):
+        for word, mask in self.table.items():
+            if mask & KNOWN:
+                yield word
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def close(self):
+        if isinstance(self.table, MappedStringTable):
+            self.table.close()
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    known_words = {'купи', 'мой', 'ёжик', 'кошка', 'все', 'всё', 'черный', 'чёрный', 'ещё', 'шел'}
+    word2upos = {'купи': {'ГЛАГОЛ'}, 'мой': {'ГЛАГОЛ', 'МЕСТОИМ_СУЩ'}, 'хочется': {'ГЛАГОЛ'}, 'ёжик': {'СУЩЕСТВИТЕЛЬНОЕ'},
+                 'шел': {'ГЛАГОЛ'}, 'шёл': {'СУЩЕСТВИТЕЛЬНОЕ'}}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'known_words.sst')
+        upos_names = Lexicon.write(path, known_words, word2upos)
+        mapped = Lexicon(MappedStringTable(path), upos_names)
+
+        for lexicon in [mapped, Lexicon.from_sets(known_words, word2upos)]:
+            verb = lexicon.upos_bit('ГЛАГОЛ')
+            assert verb != 0 and lexicon.upos_bit('ЧАСТИЦА') == 0
+            assert lexicon.upos_mask('купи') == verb
+            assert lexicon.upos_mask('мой') & verb and lexicon.upos_mask('мой') != verb
+            assert lexicon.upos_mask('кошка') == 0 and lexicon.upos_mask('нет') == 0
+            assert lexicon.uposes('мой') == {'ГЛАГОЛ', 'МЕСТОИМ_СУЩ'}
+
+            # Слово с частью речи, но не из known_words, не считается известным.
+            assert 'хочется' not in lexicon and lexicon.upos_mask('хочется') == verb
+            assert 'кошка' in lexicon and 'купи' in lexicon and None not in lexicon
+            assert set(lexicon) == known_words and len(lexicon) == len(known_words)
+
+            # Флаги ё-свертки: слово из словаря, слово только с частью речи, отсутствующая ё-форма.
+            assert lexicon.is_known('всё', strict_yofication=True) and lexicon.is_known('черный')
+            assert lexicon.is_known('шёл') and not lexicon.is_known('шёл', strict_yofication=True)
+            assert lexicon.is_known('кошкё') is False and lexicon.is_known('кошка', strict_yofication=True)
+            assert lexicon.is_known('мёй') is False and lexicon.is_known('купё') is False
+            assert lexicon.is_known('ёжик') and not lexicon.is_known('ежик') and not lexicon.is_known('ёжиков')
+            assert lexicon.is_known('ещё') and not lexicon.is_known('еще')
+            assert lexicon.is_known('ёщё') is False
+            assert lexicon.is_verb('купи') and lexicon.is_verb('шёл') and lexicon.is_verb('мой')
+            assert not lexicon.is_verb('ёжик') and not lexicon.is_verb('кошка') and not lexicon.is_verb('купё')
+
+        mapped.close()
+
+    print('All done =)')
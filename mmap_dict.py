@@ -0,0 +1,206 @@
+"""
+Словарь строк в файле, который отображается в память (mmap) только для чтения.
+
+Множество known_words содержит миллионы слов. Если распаковывать его из pickle в каждом процессе,
+каждый воркер держит собственную копию и тратит время на загрузку при старте. Таблица в этом формате
+проверяет принадлежность слова прямо по страницам файла, которые ОС держит в page cache в одном
+экземпляре для всех процессов, а открытие файла почти ничего не стоит.
+
+К каждой строке привязано 32-битное значение (например, битовая маска с частями речи слова).
+
+Формат файла (порядок байтов little-endian):
+    заголовок: magic b'SSTB', версия (uint32), число строк n (uint64), число слотов хэш-таблицы m (uint64),
+               размер блока строк (uint64)
+    offsets: uint64[n + 1] - начала строк в блоке, строки отсортированы по байтам UTF-8
+    slots: uint32[m] - открытая адресация по crc32 ключа, в слоте номер строки + 1 или 0 для пустого слота
+    values: uint32[n] - значения строк (только с версии 2, в файлах версии 1 все значения равны 0)
+    блок строк в UTF-8 подряд
+"""
+
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+
+
+MAGIC = b'SSTB'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sIQQQ')
+
+
+def encode_key(key: str) -> bytes:
+    return key.encode('utf-8', 'surrogatepass')
+
+
+def write_string_table(path: str, strings, values=None):
+    """
+    Сохраняет набор строк strings в файл path в формате MappedStringTable.
+    values - необязательный словарь {строка: значение uint32}, для остальных строк значение 0.
+    """
+    if sys.byteorder != 'little':
+        raise RuntimeError('String table files can only be written on little-endian machines')
+
+    strings = sorted(set(strings), key=encode_key)
+    keys = [encode_key(s) for s in strings]
+    n = len(keys)
+
+    offsets = array('Q', bytes(8 * (n + 1)))
+    pos = 0
+    for i, key in enumerate(keys):
+        offsets[i] = pos
+        pos += len(key)
+    offsets[n] = pos
+
+    # Заполненность хэш-таблицы не больше 1/2, размер - степень двойки.
+    nslots = 8
+    while nslots < 2 * n:
+        nslots *= 2
+    mask = nslots - 1
+
+    slots = array('I', bytes(4 * nslots))
+    for i, key in enumerate(keys):
+        h = zlib.crc32(key) & mask
+        while slots[h]:
+            h = (h + 1) & mask
+        slots[h] = i + 1
+
+    values_array = array('I', bytes(4 * n))
+    if values:
+        for i, s in enumerate(strings):
+            values_array[i] = values.get(s, 0)
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, n, nslots, pos))
+        f.write(offsets.tobytes())
+        f.write(slots.tobytes())
+        f.write(values_array.tobytes())
+        for key in keys:
+            f.write(key)
+
+
+class MappedStringTable(object):
+    """Множество строк только для чтения поверх mmap-файла, записанного write_string_table."""
+    def __init__(self, path: str):
+        if sys.byteorder != 'little':
+            raise RuntimeError('String table files can only be read on little-endian machines')
+
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, nslots, blob_size = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version not in (1, 2):
+            raise RuntimeError('Unsupported string table file "{}"'.format(path))
+
+        view = memoryview(self.mm)
+        pos = HEADER.size
+        self.offsets = view[pos: pos + 8 * (count + 1)].cast('Q')
+        pos += 8 * (count + 1)
+        self.slots = view[pos: pos + 4 * nslots].cast('I')
+        pos += 4 * nslots
+        self.values = None
+        if version >= 2:
+            self.values = view[pos: pos + 4 * count].cast('I')
+            pos += 4 * count
+        self.blob_start = pos
+        self.count = count
+        self.mask = nslots - 1
+
+    def find(self, key: str) -> int:
+        """Номер строки key в отсортированной таблице или -1."""
+        k = encode_key(key)
+        size = len(k)
+        mm = self.mm
+        offsets = self.offsets
+        slots = self.slots
+        blob_start = self.blob_start
+
+        h = zlib.crc32(k) & self.mask
+        while True:
+            i = slots[h]
+            if i == 0:
+                return -1
+
+            i -= 1
+            start = offsets[i]
+            if offsets[i + 1] - start == size and mm[blob_start + start: blob_start + start + size] == k:
+                return i
+
+            h = (h + 1) & self.mask
+
+    def get(self, key: str, default=None):
+        """Значение, привязанное к строке key, или default, если строки в таблице нет."""
+        i = self.find(key)
+        if i < 0:
+            return default
+        return self.values[i] if self.values is not None else 0
+
+    def key(self, i: int) -> str:
+        start = self.blob_start + self.offsets[i]
+        end = self.blob_start + self.offsets[i + 1]
+        return self.mm[start: end].decode('utf-8', 'surrogatepass')
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self.find(key) >= 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.key(i)
+
+    def items(self):
+        for i in range(self.count):
+            yield self.key(i), self.values[i] if self.values is not None else 0
+
+    def __reduce__(self):
+        # В другой процесс передаем только путь, файл там отобразится заново.
+        return MappedStringTable, (self.path,)
+
+    def close(self):
+        self.offsets.release()
+        self.slots.release()
+        if self.values is not None:
+            self.values.release()
+        self.mm.close()
+
+
+if __name__ == '__main__':
+    import os
+    import pickle
+    import tempfile
+
+    words = ['кошка', 'ёжик', 'ежик', 'мама', 'мыла', 'раму', 'a', '']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'known_words.sst')
+        write_string_table(path, words + ['кошка'])
+
+        table = MappedStringTable(path)
+        assert len(table) == len(words)
+        for word in words:
+            assert word in table, word
+        for word in ['кошки', 'мам', 'мамаа', 'Кошка', 'b', None, 42]:
+            assert word not in table, word
+        assert list(table) == sorted(words, key=encode_key)
+        assert table.key(table.find('мыла')) == 'мыла'
+        assert table.get('мыла') == 0 and table.get('мылo') is None
+        table.close()
+
+        write_string_table(path, words, values={'мама': 5, 'раму': 1 << 31})
+        table = MappedStringTable(path)
+        assert table.get('мама') == 5 and table.get('раму') == 1 << 31 and table.get('кошка') == 0
+        assert dict(table.items())['мама'] == 5
+
+        table2 = pickle.loads(pickle.dumps(table))
+        assert 'раму' in table2
+        table2.close()
+        table.close()
+
+        write_string_table(path, [])
+        empty = MappedStringTable(path)
+        assert len(empty) == 0 and 'a' not in empty
+        empty.close()
+
+    print('All done =)')
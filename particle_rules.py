@@ -0,0 +1,360 @@
+"""
+Правила с частицами и дефисами для PoeticSpellchecker.fix(): "-ка", "-ли", "-же", "-бы", "-это", " - то",
+"по-", "под-", "из-под-", "за ", "во-" и запятые вокруг "лишь", "уже", "почему-то".
+
+Раньше каждое правило делало свой re.search, потом re.finditer и применяло правки к тексту, так что
+время на текст росло с числом правил. Здесь у каждого правила есть триггер - фрагмент, без которого
+шаблон не совпадет (дефис, " ка", "за "), и текст просматривается один раз общей регуляркой триггеров.
+Правила пробуются только у найденных триггеров: с самого триггера и со слова перед ним, в порядке
+приоритета (прежний порядок проверок в fix()). Первая принятая правка забирает совпавший фрагмент,
+а если правило отказалось (например, слово не глагол), пробуются следующие правила.
+
+Правки собираются как (start, end, replacement, rule) относительно исходного текста и применяются
+одним проходом, см. text_edits.py. Прежде правила применялись по очереди, каждое к результату предыдущих,
+поэтому цепочки частиц ("где-б-же", "ЗА-бы-ли") разбирались целиком. Чтобы они и сейчас разбирались,
+проход повторяется, пока он что-то исправляет; позиции в fixups каждого прохода отсчитываются от его
+входного текста. Как и раньше, правило не применяется повторно к собственному результату
+("где-бы - бы" => "где бы - бы").
+
+Отличия от прежнего последовательного применения (apply_sequential ниже, самопроверка сравнивает с ним):
+- на следующем проходе правило может сработать на результате правила, стоящего ниже в таблице, и в цепочках
+  вроде "Ну-же-Это-это" совпадения делятся иначе; на случайных цепочках частиц это примерно 1 текст из 10000;
+- "из-под-" ищется по всему тексту, а не только в его начале (прежний re.match был ошибкой);
+- "во-" исправляется везде, а не только в первом совпадении;
+- запятые вокруг "лишь", "уже", "почему-то" и "во-" обрабатываются вместе с остальными частицами,
+  то есть после апострофов и скобок, а не перед ними.
+"""
+
+import re
+
+from text_edits import Fixup, apply_edits
+
+
+# Цепочки частиц короткие, обычно хватает двух-трех проходов.
+MAX_PASSES = 10
+
+# Сколько слов после "по-" может быть в замене из replaces.txt (самая длинная сейчас - "по-чуть-чуть").
+MAX_PO_WORDS = 4
+
+
+class ParticleRule(object):
+    def __init__(self, rule_id, pattern, apply, trigger=r'\-', flags=0, gate=None, squeeze_spaces=False):
+        """
+        apply(schecker, m) возвращает замену для фрагмента m.group(0) или None, если правило не подходит.
+        trigger - фрагмент, который есть в любом совпадении pattern; совпадение начинается либо с него,
+        либо со слова прямо перед ним.
+        gate - регулярка, без совпадения с которой где-либо в тексте правило не применяется (прежняя
+        проверка перед finditer, она бывает строже шаблона).
+        squeeze_spaces - после срабатывания правила повторяющиеся пробелы во всем тексте сжимаются в один.
+        """
+        self.rule_id = rule_id
+        self.rx = re.compile(pattern, flags)
+        self.apply = apply
+        self.trigger = trigger
+        self.gate = re.compile(gate) if gate else None
+        self.squeeze_spaces = squeeze_spaces
+
+
+class ParticleRules(object):
+    def __init__(self, rules):
+        self.rules = rules
+        triggers = []
+        for rule in rules:
+            if rule.trigger not in triggers:
+                triggers.append(rule.trigger)
+        self.rx_trigger = re.compile('|'.join(triggers))
+
+    def candidate_starts(self, text):
+        """Позиции, с которых может начинаться совпадение какого-то правила, по возрастанию."""
+        last = -1
+        for m in self.rx_trigger.finditer(text):
+            # Начало слова перед триггером (между ними могут быть пробелы).
+            i = m.start()
+            while i > 0 and text[i - 1].isspace():
+                i -= 1
+            j = i
+            while j > 0 and (text[j - 1].isalnum() or text[j - 1] == '_'):
+                j -= 1
+
+            for start in ((j, m.start()) if j < i else (m.start(),)):
+                if start > last:
+                    last = start
+                    yield start
+
+    def may_apply(self, text):
+        """False, если ни один шаблон не совпадает и apply() точно вернет text без изменений."""
+        for start in self.candidate_starts(text):
+            for rule in self.rules:
+                if rule.rx.match(text, start) is not None:
+                    return True
+        return False
+
+    def apply(self, schecker, text, fixups):
+        spans = []
+        for _ in range(MAX_PASSES):
+            text2, spans = self.apply_pass(schecker, text, fixups, spans)
+            if text2 == text:
+                break
+            text = text2
+        return text
+
+    def apply_pass(self, schecker, text, fixups, prev_spans):
+        """
+        Один проход по тексту. prev_spans - фрагменты, замененные предыдущим проходом: (start, end, правило)
+        в координатах text. Возвращает новый текст и такие же фрагменты для следующего прохода.
+        """
+        edits = []
+        spans = []
+        delta = 0
+        pos = 0
+        squeeze_spaces = False
+        gates = dict()
+        for start in self.candidate_starts(text):
+            if start < pos:
+                continue
+
+            for rule in self.rules:
+                m = rule.rx.match(text, start)
+                if m is None:
+                    continue
+
+                if rule.gate is not None:
+                    if rule not in gates:
+                        gates[rule] = rule.gate.search(text) is not None
+                    if not gates[rule]:
+                        continue
+
+                if any(rule is rule2 and start2 < m.end() and start < end2 for start2, end2, rule2 in prev_spans):
+                    continue
+
+                replacement = rule.apply(schecker, m)
+                if replacement is not None:
+                    edits.append((start, m.end(), replacement, rule.rule_id))
+                    fixups.append(Fixup(m.group(0), replacement, start, m.end(), rule.rule_id))
+                    spans.append((start + delta, start + delta + len(replacement), rule))
+                    delta += len(replacement) - (m.end() - start)
+                    squeeze_spaces = squeeze_spaces or rule.squeeze_spaces
+                    pos = m.end()
+                    break
+
+        text = apply_edits(text, edits)
+        if squeeze_spaces:
+            # От каждой последовательности пробелов остается первый, позиции фрагментов сдвигаются.
+            removed = [(m.start() + 1, m.end()) for m in re.finditer(r'[ ]{2,}', text)]
+            shift = lambda i: i - sum(min(i, end) - start for start, end in removed if start < i)
+            spans = [(shift(start), shift(end), rule) for start, end, rule in spans]
+            text = re.sub(r'[ ]{2,}', ' ', text)
+        return text, spans
+
+
+def apply_sequential(schecker, rules, text):
+    """
+    Эталон для самопроверки: каждое правило таблицы один раз, по порядку, ко всему результату предыдущих,
+    как в прежнем fix(). Медленнее apply(): число проходов по тексту равно числу правил.
+    """
+    for rule in rules:
+        if rule.gate is not None and rule.gate.search(text) is None:
+            continue
+
+        edits = []
+        for m in rule.rx.finditer(text):
+            replacement = rule.apply(schecker, m)
+            if replacement is not None:
+                edits.append((m.start(), m.end(), replacement, rule.rule_id))
+        if edits:
+            text = apply_edits(text, edits)
+            if rule.squeeze_spaces:
+                text = re.sub(r'[ ]{2,}', ' ', text)
+    return text
+
+
+def comma_rule(good):
+    # Запятые вокруг наречия заменяются пробелами, лишние пробелы потом сжимаются (squeeze_spaces).
+    return lambda schecker, m: good
+
+
+def fix_vo(schecker, m):
+    # Там поля стоят во-ржи
+    #                ^^^^^^
+    token12 = m.group(0)
+    token1 = m.group(1)
+    token2 = m.group(2)
+    if not schecker.is_known_word(token12) and schecker.is_known_word(token2) and not schecker.is_known_word((token1 + token2).lower()):
+        return token1 + ' ' + token2
+    return None
+
+
+def fix_ka(schecker, m):
+    # Ты дождевик одень ка.
+    #             ^^^^^^^^
+    word1 = m.group(1)
+    if schecker.is_verb(word1) or word1.lower() in ['ну', 'на']:
+        return f'{word1}-ка'
+    return None
+
+
+def fix_dash_ka(schecker, m):
+    # Другой добычи поищу - ка!
+    #               ^^^^^^^^^^
+    word1 = m.group(1)
+    if schecker.is_verb(word1):
+        return f'{word1}-ка'
+    return None
+
+
+def fix_za(schecker, m):
+    # за скучаешь ==> заскучаешь
+    prepos = m.group(1)
+    word2 = m.group(2)
+    if schecker.is_verb_only(word2):
+        verb12 = prepos + word2
+        if schecker.is_known_word(verb12) and schecker.is_verb(verb12):
+            return verb12
+    return None
+
+
+def split_particle(schecker, m):
+    # Знаешь-ли, такая штука - жизнь
+    # Мы-бы тоже пришли.
+    return f'{m.group(1)} {m.group(2)}'
+
+
+def fix_zhe(schecker, m):
+    # Мы-же ни к кому не лезли.
+    if m.group(1).lower() != 'да':  # да-же
+        return f'{m.group(1)} {m.group(2)}'
+    return None
+
+
+def fix_eto(schecker, m):
+    # Что такое блогер-это смелость
+    return f'{m.group(1)} - {m.group(2)}'
+
+
+def fix_to(schecker, m):
+    # Кому - то повезло
+    word12 = m.group(2) + '-' + m.group(3)
+    if schecker.is_known_word(word12):
+        return word12
+    return None
+
+
+def fix_po_verb(schecker, m):
+    # С деревьев ветки по-срывал!
+    word12 = m.group(1) + m.group(2)
+    if schecker.is_verb(word12):
+        return word12
+    return None
+
+
+def fix_po_replaces(schecker, m):
+    # Замены из replaces.txt вида "по-аллеям ==> по аллеям": сначала самая длинная цепочка через дефис.
+    words = m.group(0).split('-')
+    for n in range(len(words), 1, -1):
+        good = schecker.repl_rx__1_rules.get('-'.join(words[:n]))
+        if good is not None:
+            return good + m.group(0)[len('-'.join(words[:n])):]
+    return None
+
+
+def fix_po_dash(schecker, m):
+    # Ты поёшь немного по - французски.
+    word12 = m.group(1) + '-' + m.group(2)
+    if schecker.is_known_word(word12):
+        return word12
+    return None
+
+
+def fix_pod(schecker, m):
+    # под-держать ==> поддержать
+    word12 = m.group(1) + m.group(2)
+    if schecker.is_verb(word12):
+        return word12
+    return None
+
+
+def fix_iz_pod(schecker, m):
+    # из-под-палки
+    if schecker.is_known_word(m.group(3)):
+        return m.group(1) + '-' + m.group(2) + ' ' + m.group(3)
+    return None
+
+
+# Порядок правил - приоритет при совпадении шаблонов в одной позиции.
+PARTICLE_RULES = [
+    # Триггер без ведущих пробелов: [ ]* в начале делает поиск квадратичным на длинных пробельных
+    # последовательностях, а пробелы перед запятой все равно сжимаются.
+    ParticleRule(', лишь,', r', лишь,', comma_rule(' лишь '), trigger=r', лишь,', squeeze_spaces=True),
+    ParticleRule(', уже,', r', уже,', comma_rule(' уже '), trigger=r', уже,', squeeze_spaces=True),
+    ParticleRule(', почему-то,', r', почему-то,', comma_rule(' почему-то '), trigger=r', почему-то,', squeeze_spaces=True),
+    ParticleRule('во-', r'\b(во)\-(\w+)\b', fix_vo, flags=re.I),
+    ParticleRule('-ка', r'\b(\w+)\sка\b', fix_ka, trigger=r'\sка\b'),
+    ParticleRule('-ка', r'\b(\w+)\s\-\sка\b', fix_dash_ka),
+    ParticleRule('за ', r'\b(за)\s(\w+)\b', fix_za, trigger=r'\bза\s'),
+    ParticleRule('-ли', r'\b(\w+)\-(л[иь])\b', split_particle),
+    ParticleRule('-же', r'\b(\w+)\-(же|ж)\b', fix_zhe),
+    ParticleRule('-бы', r'\b(\w+)\s*\-\s*(бы|б)\b', split_particle),
+    # Я-б поучаствовал. Обычно это уже сделало правило выше, но в цепочке "тебе-б-б" второе "-б" - здесь.
+    ParticleRule('-б', r'\b(\w+)\-(б)\b', split_particle),
+    ParticleRule('-это', r'\b(\w+)\-(это)\b', fix_eto, flags=re.I, gate=r'\-это\b'),
+    ParticleRule(' - то', r'(\b|^)(\w+) \-\s?(то)(\b|$)', fix_to),
+    ParticleRule('по-', r'\b(по)\s?\-\s?(\w+)\b', fix_po_verb, flags=re.I),
+    # Длина цепочки ограничена: иначе на "по-по-по-..." шаблон от каждого "по" захватывает весь хвост.
+    ParticleRule('replaces', r'\bпо(?:\-\w+){1,%d}\b' % MAX_PO_WORDS, fix_po_replaces, flags=re.I),
+    ParticleRule('по - ', r'\b(по) \- (\w+)\b', fix_po_dash, flags=re.I),
+    ParticleRule('под-', r'\b(под)\s?\-\s?(\w+)\b', fix_pod, flags=re.I),
+    ParticleRule('из-под-', r'\b(из)\s?\-\s?(под)\s?\-\s?(\w+)\b', fix_iz_pod, flags=re.I),
+]
+
+
+if __name__ == '__main__':
+    class Checker(object):
+        known_words = {'заскучаешь', 'скучаешь', 'кому-то', 'поддержать', 'палки', 'ржи', 'одень', 'пошли'}
+        verbs = {'заскучаешь', 'скучаешь', 'поддержать', 'одень', 'посрывал', 'пошли'}
+        repl_rx__1_rules = {'по-аллеям': 'по аллеям', 'По-аллеям': 'По аллеям', 'по-чуть-чуть': 'чуть-чуть'}
+
+        def is_known_word(self, word):
+            return word.lower() in self.known_words
+
+        def is_verb(self, word):
+            return word.lower() in self.verbs
+
+        def is_verb_only(self, word):
+            return self.is_verb(word)
+
+    rules = ParticleRules(PARTICLE_RULES)
+    checker = Checker()
+    for text, expected in [('за скучаешь', 'заскучаешь'), ('одень ка', 'одень-ка'), ('стол ка', 'стол ка'),
+                           ('Мы-же пришли', 'Мы же пришли'), ('да-же', 'да-же'), ('Кому - то повезло', 'Кому-то повезло'),
+                           ('Мы-бы, где - б, я-б', 'Мы бы, где б, я б'), ('Блогер-это', 'Блогер - это'),
+                           ('ветки по-срывал', 'ветки посрывал'), ('По-аллеям и по-чуть-чуть', 'По аллеям и чуть-чуть'),
+                           ('под-держать', 'поддержать'), ('взял из-под-палки', 'взял из-под палки'),
+                           ('поля во-ржи', 'поля во ржи'), ('Я , лишь, он', 'Я лишь он'), ('Знаешь-ли', 'Знаешь ли'),
+                           ('пошли-ка ка', 'пошли-ка ка'), ('', ''),
+                           # Цепочки частиц разбираются целиком, как при последовательном применении правил.
+                           ('где-б-же', 'где б же'), ('ЗА-бы-ли', 'ЗА бы ли'), ('по-чуть-чуть-ж', 'чуть-чуть ж'),
+                           ('где-бы - бы', 'где бы - бы'), ('тебе-б-б', 'тебе б б'), ('ж-бы - бы  , лишь,', 'ж бы - бы лишь '),
+                           # Запятые вокруг наречия сжимают все повторяющиеся пробелы в тексте.
+                           ('Мы  , лишь, хотели бы,  -', 'Мы лишь хотели бы, -'), ('бы' + ' ' * 5000 + ', уже,', 'бы уже ')]:
+        fixups = []
+        assert rules.apply(checker, text, fixups) == expected, text
+        assert rules.may_apply(text) or text == expected, text
+        # Позиции отсчитываются от текста на входе своего прохода, первый исправленный фрагмент - из первого.
+        for fixup in fixups[:1]:
+            assert text[fixup.start: fixup.end] == fixup[0]
+        assert apply_sequential(checker, PARTICLE_RULES, text) == expected, text
+
+    # Сравнение с последовательным применением правил на случайных цепочках частиц.
+    import random
+    rnd = random.Random(1)
+    words = ['одень', 'ка', '-', 'за', 'скучаешь', 'мы', 'же', 'ж', 'ли', 'бы', 'б', 'это', 'то', 'кому', 'по', 'срывал',
+             'под', 'держать', 'из', 'палки', 'ну', 'Мы', 'тебе', ', ', 'да', 'где', 'Это', 'поищу', 'ЗА', 'чуть',
+             'лишь', ', лишь,', ', уже,', 'во', 'ржи', 'аллеям', 'пошли']
+    for _ in range(5000):
+        text = ''.join(rnd.choice(words) + rnd.choice([' ', ' ', '-', ' - ', '', '  ']) for _ in range(rnd.randint(1, 10))).strip()
+        assert rules.apply(checker, text, []) == apply_sequential(checker, PARTICLE_RULES, text), text
+    # Известное расхождение: на втором проходе "-это" срабатывает на результате "-же".
+    assert rules.apply(checker, 'Ну-же-Это-это', []) == 'Ну же-Это - это'
+    assert apply_sequential(checker, PARTICLE_RULES, 'Ну-же-Это-это') == 'Ну же - Это-это'
+
+    print('All done =)')
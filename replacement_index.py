@@ -0,0 +1,146 @@
+"""
+Индекс пословных замен word_replaces (ошибочное написание => правильное).
+
+Раньше замены хранились в префиксном дереве TrieNode: по объекту и словарю на каждую букву каждого ключа,
+а поиск шел рекурсией со срезом tail[1:] на каждом шаге. ReplacementIndex хранит те же пары в одном
+словаре с интернированными ключами и в отсортированном списке этих же ключей: точный поиск - одно
+обращение к словарю, поиск по префиксу - bisect по списку.
+
+Сравнение по памяти и скорости с TrieNode: python replacement_index.py
+"""
+
+import bisect
+import sys
+
+
+class ReplacementIndex(object):
+    def __init__(self, pairs):
+        self.table = dict()
+        for bad, good in pairs:
+            # Как и в дереве, при повторе ключа побеждает последняя пара.
+            self.table[sys.intern(bad)] = good
+        self.keys = sorted(self.table)
+
+    def search(self, key):
+        """Замена для key или None (пустая строка замены тоже считается отсутствием замены)."""
+        return self.table.get(key) or None
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def __len__(self):
+        return len(self.table)
+
+    def with_prefix(self, prefix):
+        """Все пары (ключ, замена), ключ которых начинается с prefix, в порядке сортировки ключей."""
+        keys = self.keys
+        i = bisect.bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            yield keys[i], self.table[keys[i]]
+            i += 1
+
+    def has_prefix(self, prefix):
+        """Есть ли хотя бы один ключ, начинающийся с prefix."""
+        i = bisect.bisect_left(self.keys, prefix)
+        return i < len(self.keys) and self.keys[i].startswith(prefix)
+
+    def longest_prefix(self, text):
+        """Самый длинный ключ, который является префиксом text, и его замена, или (None, None)."""
+        if not text or not self.has_prefix(text[0]):
+            return None, None
+
+        for end in range(len(text), 0, -1):
+            good = self.table.get(text[:end])
+            if good is not None:
+                return text[:end], good
+        return None, None
+
+
+class TrieNode:
+    """Прежняя реализация индекса замен, оставлена для сравнения в бенчмарке."""
+    def __init__(self):
+        self.result_word = None
+        self.children = {}
+
+    def insert(self, word, result_word):
+        node = self
+        for letter in word:
+            if letter not in node.children:
+                node.children[letter] = TrieNode()
+
+            node = node.children[letter]
+
+        node.result_word = result_word
+
+    def search(self, tail):
+        if len(tail) == 0:
+            if self.result_word:
+                return self.result_word
+            else:
+                return None
+        else:
+            if tail[0] in self.children:
+                return self.children[tail[0]].search(tail[1:])
+
+            return None
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import random
+    import resource
+    import time
+
+    index = ReplacementIndex([('щас', 'сейчас'), ('ваще', 'вообще'), ('ващеее', 'вообще'), ('х*й', 'хуй'), ('щас', 'сейчас!'), ('пусто', '')])
+    assert index.search('щас') == 'сейчас!'
+    assert index.search('ваще') == 'вообще'
+    assert index.search('ващ') is None
+    assert index.search('пусто') is None
+    assert list(index.with_prefix('ва')) == [('ваще', 'вообще'), ('ващеее', 'вообще')]
+    assert index.has_prefix('х*') and not index.has_prefix('ю')
+    assert index.longest_prefix('ващее') == ('ваще', 'вообще')
+    assert index.longest_prefix('вась') == (None, None)
+
+    # Бенчмарк на синтетических заменах, по размеру как word_replaces из replaces.txt.
+    rnd = random.Random(1)
+    alphabet = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+    pairs = []
+    for _ in range(60000):
+        bad = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(3, 14)))
+        pairs.append((bad, bad[::-1]))
+    queries = [bad for bad, _ in pairs[:30000]] + [bad + 'ы' for bad, _ in pairs[:30000]]
+
+    def build_trie(pairs):
+        trie = TrieNode()
+        for bad, good in pairs:
+            trie.insert(bad, good)
+        return trie
+
+    def max_rss():
+        # ru_maxrss в Linux - в килобайтах, в macOS - в байтах.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    def measure_build(build):
+        # Память считается по приросту пикового RSS процесса, а не по tracemalloc: tracemalloc видит только
+        # запрошенные байты и не учитывает накладные расходы аллокатора на миллионы мелких объектов TrieNode.
+        # Строки ключей в обоих случаях общие с pairs, как и в спеллчекере, где word_replaces остается в памяти.
+        rss0 = max_rss()
+        t0 = time.perf_counter()
+        structure = build(pairs)
+        build_time = time.perf_counter() - t0
+        memory = max_rss() - rss0
+
+        t0 = time.perf_counter()
+        found = sum(1 for q in queries if structure.search(q) is not None)
+        lookup_time = time.perf_counter() - t0
+        return memory, build_time, lookup_time, found
+
+    for name, build in [('TrieNode', build_trie), ('ReplacementIndex', ReplacementIndex)]:
+        # Каждая структура строится в отдельном процессе, иначе пиковый RSS после первой не вырастет на второй.
+        with multiprocessing.get_context('fork').Pool(1) as pool:
+            memory, build_time, lookup_time, found = pool.apply(measure_build, (build,))
+
+        print('{:<18} memory={:7.1f} MB  build={:6.3f} s  lookup={:6.3f} us  found={}'.format(name, memory / 1e6, build_time,
+                                                                                       lookup_time / len(queries) * 1e6, found))
+
+    print('All done =)')
@@ -8,34 +8,158 @@
 23.10.2023 Добавлена обработка ëáóúόéýќў
 
 10.10.2024 Добавлена обработка замены цифры 3 на букву З
+
+Раньше для каждой пары (латинский символ, кириллический) по тексту проходили до четырех re.search/re.sub,
+то есть больше сотни проходов на вызов. Теперь текст сканируется один раз: находятся цепочки символов,
+которые могут быть заменены, и для каждой цепочки по таблицам символов воспроизводится прежний порядок
+замен (пары по очереди, сначала по левому соседу, потом по правому). Результат совпадает с прежним
+для любой строки.
 """
 
 import re
 
 
-def restore_cyrillic(text):
-    for c, c_cyr in zip('coaxpeyëόáéóýúќўόun6', 'соахреуёоаеоуикуоипб'):
-        rs = r'([абвгдеёжзийклмнопрстуфхцчшщъыьэюя ])('+c+')'
-        if re.search(rs, text, flags=re.I) is not None:
-            text = re.sub(rs, r'\1'+c_cyr, text, flags=re.I)
+CYR_CONTEXT = '[абвгдеёжзийклмнопрстуфхцчшщъыьэюя ]'
+
+# Фазы замены в прежнем порядке: (символ, замена, флаги регулярок).
+# В первой группе символ и контекст сравниваются без учета регистра, во второй - с учетом.
+PHASES = [(c, c_cyr, re.I) for c, c_cyr in zip('coaxpeyëόáéóýúќўόun6', 'соахреуёоаеоуикуоипб')]
+PHASES += [(c, c_cyr, 0) for c, c_cyr in zip('3AKHOPCTMB', 'ЗАКНОРСТМВ')]
+
+
+def build_tables():
+    """Таблицы символов, эквивалентные прежним регуляркам: re.I знает и неочевидные пары регистров (ᲀ и в)."""
+    # Все совпадения лежат в BMP, суррогаты регулярки не находят.
+    chars = ''.join(map(chr, range(0x10000)))
+
+    # Символы контекста для регулярок с re.I и без него.
+    context = {re.I: frozenset(re.findall(CYR_CONTEXT, chars, flags=re.I)),
+               0: frozenset(re.findall(CYR_CONTEXT, chars))}
+
+    # Символ => номера фаз, в которых он заменяется. Кандидатов находит одна регулярка с re.I,
+    # а каждый из них проверяется регуляркой своей фазы.
+    all_chars = '[' + ''.join(re.escape(c) for c, c_cyr, flags in PHASES) + ']'
+    char2phases = dict()
+    for ch in re.findall(all_chars, chars, flags=re.I):
+        phases = tuple(phase for phase, (c, c_cyr, flags) in enumerate(PHASES) if re.fullmatch(re.escape(c), ch, flags=flags))
+        if phases:
+            char2phases[ch] = phases
+
+    return context, char2phases
 
-        rs = r'('+c+')([абвгдеёжзийклмнопрстуфхцчшщъыьэюя ])'
-        if re.search(rs, text, flags=re.I) is not None:
-            text = re.sub(rs, c_cyr+r'\2', text, flags=re.I)
 
-    for c, c_cyr in zip('3AKHOPCTMB', 'ЗАКНОРСТМВ'):
-        rs = r'([абвгдеёжзийклмнопрстуфхцчшщъыьэюя ])('+c+')'
-        if re.search(rs, text) is not None:
-            text = re.sub(rs, r'\1'+c_cyr, text)
+CONTEXT, CHAR2PHASES = build_tables()
+rx_candidates = re.compile('[' + ''.join(re.escape(ch) for ch in sorted(CHAR2PHASES)) + ']+')
 
-        rs = r'('+c+')([абвгдеёжзийклмнопрстуфхцчшщъыьэюя ])'
-        if re.search(rs, text) is not None:
-            text = re.sub(rs, c_cyr+r'\2', text)
 
-    return text
+def restore_run(run, left, right):
+    """Замены в цепочке символов run; left и right - символы слева и справа от нее ('' на краю текста)."""
+    if len(run) == 1:
+        # Обычный случай: одиночный символ, соседи которого уже не меняются.
+        for phase in CHAR2PHASES[run]:
+            context = CONTEXT[PHASES[phase][2]]
+            if left in context or right in context:
+                return PHASES[phase][1]
+        return run
+
+    chars = [left] + list(run) + [right]
+    phases = sorted(set(phase for ch in run for phase in CHAR2PHASES[ch]))
+    for phase in phases:
+        c, c_cyr, flags = PHASES[phase]
+        context = CONTEXT[flags]
+
+        # Как в re.sub, соседей проверяем по тексту до замен текущего прохода.
+        # Сначала замены по левому соседу, ...
+        hits = [i for i in range(1, len(chars) - 1) if phase in CHAR2PHASES.get(chars[i], ()) and chars[i - 1] in context]
+        for i in hits:
+            chars[i] = c_cyr
+
+        # ... потом по правому.
+        hits = [i for i in range(1, len(chars) - 1) if phase in CHAR2PHASES.get(chars[i], ()) and chars[i + 1] in context]
+        for i in hits:
+            chars[i] = c_cyr
+
+    return ''.join(chars[1:-1])
+
+
+def restore_cyrillic(text):
+    chunks = []
+    pos = 0
+    for m in rx_candidates.finditer(text):
+        start, end = m.span()
+        left = text[start - 1] if start > 0 else ''
+        right = text[end] if end < len(text) else ''
+        chunks.append(text[pos:start])
+        chunks.append(restore_run(m.group(0), left, right))
+        pos = end
+
+    if pos == 0:
+        return text
+
+    chunks.append(text[pos:])
+    return ''.join(chunks)
+
+
+def restore_cyrillic_many(texts):
+    """restore_cyrillic для последовательности текстов; повторяющиеся тексты обрабатываются один раз."""
+    results = dict()
+    output = []
+    for text in texts:
+        text2 = results.get(text)
+        if text2 is None:
+            text2 = restore_cyrillic(text)
+            results[text] = text2
+        output.append(text2)
+    return output
 
 
 if __name__ == '__main__':
+    import random
+    import timeit
+
+    def restore_cyrillic_rx(text):
+        # Прежняя реализация, для проверки и сравнения скорости.
+        for c, c_cyr in zip('coaxpeyëόáéóýúќўόun6', 'соахреуёоаеоуикуоипб'):
+            rs = r'([абвгдеёжзийклмнопрстуфхцчшщъыьэюя ])('+c+')'
+            if re.search(rs, text, flags=re.I) is not None:
+                text = re.sub(rs, r'\1'+c_cyr, text, flags=re.I)
+
+            rs = r'('+c+')([абвгдеёжзийклмнопрстуфхцчшщъыьэюя ])'
+            if re.search(rs, text, flags=re.I) is not None:
+                text = re.sub(rs, c_cyr+r'\2', text, flags=re.I)
+
+        for c, c_cyr in zip('3AKHOPCTMB', 'ЗАКНОРСТМВ'):
+            rs = r'([абвгдеёжзийклмнопрстуфхцчшщъыьэюя ])('+c+')'
+            if re.search(rs, text) is not None:
+                text = re.sub(rs, r'\1'+c_cyr, text)
+
+            rs = r'('+c+')([абвгдеёжзийклмнопрстуфхцчшщъыьэюя ])'
+            if re.search(rs, text) is not None:
+                text = re.sub(rs, c_cyr+r'\2', text)
+
+        return text
+
+    # Таблица совпадает с тем, что находят регулярки отдельных фаз.
+    chars = ''.join(map(chr, range(0x110000)))
+    for phase, (c, c_cyr, flags) in enumerate(PHASES):
+        assert set(re.findall(re.escape(c), chars, flags=flags)) == set(ch for ch, phases in CHAR2PHASES.items() if phase in phases)
+
+    # Случайные строки из символов, которые заменяются, контекста и прочих символов.
+    rnd = random.Random(1)
+    alphabet = ''.join(CHAR2PHASES) + 'аоСЁᲀ xzk-\n'
+    for _ in range(100000):
+        s = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 8)))
+        assert restore_cyrillic(s) == restore_cyrillic_rx(s), s
+
+    samples = ['3емную', 'детu', 'поставлены рядом.', 'Чак Hоррис никогда не спит. Он ждет.', 'аco', 'аoc', 'ccа', 'аccа',
+               'Tы xочу', 'a cat', '']
+    assert restore_cyrillic_many(samples + samples) == [restore_cyrillic_rx(s) for s in samples + samples]
+
+    text = 'Чак Hоррис никогда не спит. Он ждет. Пoставлены рядoм, вдвоëм. ' * 20
+    for name, fn in [('regex', restore_cyrillic_rx), ('table', restore_cyrillic)]:
+        t = min(timeit.repeat(lambda: fn(text), number=100, repeat=5))
+        print('{:<6} {:8.1f} us per call'.format(name, t / 100 * 1e6))
+
     from generative_poetry.alphabet_sanity_checker import is_correct
 
     s = restore_cyrillic('3емную')
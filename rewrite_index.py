@@ -0,0 +1,189 @@
+"""
+Обратный индекс пословных правил fix_token: ошибочное написание => (исправление, правило).
+
+Большинство веток fix_token (шся→шься, безк→беск, чор→чёр, здел→сдел, йу→ю и т.д.) порождают одного
+кандидата и проверяют его по known_words. При сборке словаря эти переписывания применяются в обратную
+сторону к каждому известному слову: из "шоколад" получаются "щоколад", "шьоколад" и т.п. Каждый вариант,
+которого нет в словаре, прогоняется через сам fix_token, и в индекс попадает только то, что fix_token
+действительно вернул. Поэтому ответ индекса всегда совпадает с результатом каскада, а для токенов, которых
+в индексе нет, по-прежнему работает каскад (в нем есть ветки, которые нельзя обратить полностью: 0→о,
+lat→cyr, norvig, правила с проверкой по словарю нескольких кандидатов).
+
+Варианты хранятся для токенов в нижнем регистре; токен с заглавной первой буквой берется из индекса,
+только если при сборке fix_token вернул для него то же исправление с заглавной буквы (флаг CAPITALIZED).
+
+Файлы индекса:
+    rewrite_variants.sst - варианты в формате MappedStringTable, значение - номер исправления | CAPITALIZED
+    rewrite_targets.sst - строки "исправление<TAB>правило", номер строки - ее место в таблице
+"""
+
+import os
+
+from mmap_dict import MappedStringTable, write_string_table, encode_key
+
+
+VARIANTS_FILE = 'rewrite_variants.sst'
+TARGETS_FILE = 'rewrite_targets.sst'
+CAPITALIZED = 1 << 31
+
+# (правильное написание, ошибочное, максимальная позиция начала или None).
+INVERSE_REWRITES = [('ю', 'йу', None), ('ь', 'ъ', None), ('щ', 'ш', None), ('ъ', '"', None), ('ш', 'щ', None),
+                    ('безы', 'бези', 0), ('тся', 'ться', None), ('ться', 'тся', None),
+                    ('тся', 'цца', None), ('тся', 'тса', None), ('тся', 'ца', None),
+                    ('сдел', 'здел', 0), ('шь', 'щь', None), ('щ', 'щь', None), ('ъ', 'ь', None),
+                    ('бес', 'без', 0), ('без', 'бес', 0),
+                    ('ь', 'ьь', None), ('й', 'йй', None), ('ы', 'ыы', None), ('щ', 'щщ', None), ('ъ', 'ъъ', None),
+                    ('и', 'ы', None), ('шься', 'шся', None), ('шь', 'ш', None), ('жь', 'ж', None), ('чь', 'ч', None),
+                    ('ш', 'шь', None), ('ч', 'чь', None), ('ж', 'жь', None),
+                    ('чом', 'чём', None), ('чо', 'чё', None), ('объ', 'обь', 0), ('исч', 'изч', 0), ('сдав', 'здав', 0),
+                    ('сп', 'зп', None), ('шёл', 'шол', None), ('щом', 'щём', None),
+                    ('вься', 'вся', None), ('вьте', 'вте', None), ('вьтесь', 'втесь', None),
+                    ('щу', 'щю', None), ('чу', 'чю', None), ('чёр', 'чор', None), ('ща', 'щя', None), ('шк', 'щк', None),
+                    ('ча', 'чя', None), ('сб', 'зб', 0), ('чон', 'чен', None),
+                    # приставки вз/вс, из/ис, раз/рас и т.д.
+                    ('с', 'з', 5), ('з', 'с', 5)]
+INVERSE_REWRITES += [(c + c, c + c + c, None) for c in 'бвгджзклмнпрстфхцчшщ']
+
+
+def misspelled_variants(word):
+    """Варианты слова word, в которых одно из INVERSE_REWRITES применено в обратную сторону."""
+    variants = set()
+    for good, bad, max_pos in INVERSE_REWRITES:
+        i = word.find(good)
+        while i != -1 and (max_pos is None or i <= max_pos):
+            variants.add(word[:i] + bad + word[i + len(good):])
+            i = word.find(good, i + 1)
+    variants.discard(word)
+    return variants
+
+
+def Aa(s):
+    return s[0].upper() + s[1:]
+
+
+class RewriteIndex(object):
+    def __init__(self, variants, targets):
+        self.variants = variants
+        self.targets = targets
+
+    @staticmethod
+    def build(known_words, fix_token):
+        """
+        Словарь {вариант: (исправление, правило, флаги)} для слов known_words. fix_token - функция
+        исправления токена без обратного индекса и без norvig, ее ответы и записываются в индекс.
+        """
+        entries = dict()
+        for word in known_words:
+            if not word.isalpha() or word.lower() != word:
+                continue
+
+            for variant in misspelled_variants(word):
+                if variant in entries or variant in known_words:
+                    continue
+
+                fixed, rule = fix_token(variant)
+                if fixed is None or rule in ('replaces', 'norvig'):
+                    continue
+
+                flags = 0
+                if fix_token(Aa(variant)) == (Aa(fixed), rule):
+                    flags |= CAPITALIZED
+                entries[variant] = (fixed, rule, flags)
+
+        return entries
+
+    @staticmethod
+    def write(dir_path, entries):
+        targets = sorted(set(fixed + '\t' + rule for fixed, rule, flags in entries.values()), key=encode_key)
+        if len(targets) >= CAPITALIZED:
+            raise ValueError('Too many rewrite targets: {}'.format(len(targets)))
+
+        target2id = dict((target, i) for i, target in enumerate(targets))
+        write_string_table(os.path.join(dir_path, TARGETS_FILE), targets)
+        write_string_table(os.path.join(dir_path, VARIANTS_FILE), entries.keys(),
+                           dict((variant, target2id[fixed + '\t' + rule] | flags) for variant, (fixed, rule, flags) in entries.items()))
+
+    @staticmethod
+    def exists(dir_path):
+        return os.path.exists(os.path.join(dir_path, VARIANTS_FILE))
+
+    @staticmethod
+    def remove(dir_path):
+        for name in (VARIANTS_FILE, TARGETS_FILE):
+            path = os.path.join(dir_path, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def load(dir_path):
+        return RewriteIndex(MappedStringTable(os.path.join(dir_path, VARIANTS_FILE)),
+                            MappedStringTable(os.path.join(dir_path, TARGETS_FILE)))
+
+    @property
+    def paths(self):
+        return [self.variants.path, self.targets.path]
+
+    def lookup(self, token):
+        """Пара (исправленный токен, правило), как ее вернул бы fix_token, или None, если токена нет в индексе."""
+        ltoken = token.lower()
+        value = self.variants.get(ltoken)
+        if value is None:
+            return None
+
+        if token != ltoken:
+            if not (value & CAPITALIZED) or token != Aa(ltoken):
+                return None
+
+        fixed, rule = self.targets.key(value & ~CAPITALIZED).split('\t')
+        if token != ltoken:
+            fixed = Aa(fixed)
+        return fixed, rule
+
+    def __len__(self):
+        return len(self.variants)
+
+    def close(self):
+        self.variants.close()
+        self.targets.close()
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    assert {'щоколад', 'шьоколад'} <= misspelled_variants('шоколад') and 'шоколаддд' not in misspelled_variants('шоколад')
+    assert 'безискусный' in misspelled_variants('безыскусный')
+    assert 'зделать' in misspelled_variants('сделать')
+    assert 'дохожу' not in misspelled_variants('доходу') and 'расписать' not in misspelled_variants('расписать')
+
+    # Игрушечный каскад: щ→ш и ш→щ по словарю, у заглавного "Щоколад" другой ответ.
+    known_words = {'шоколад', 'тёща', 'щука'}
+
+    def fix_token(token):
+        if token.lower() in known_words:
+            return None, None
+        if token == 'Щоколад':
+            return 'ШОКОЛАД', 'caps'
+        for bad, good, rule in [('щ', 'ш', 'щ→ш'), ('ш', 'щ', 'ш→щ')]:
+            fixed = token.replace(bad, good)
+            if fixed.lower() in known_words:
+                return fixed, rule
+        return None, None
+
+    entries = RewriteIndex.build(known_words, fix_token)
+    assert entries['щоколад'] == ('шоколад', 'щ→ш', 0)
+    assert entries['тёша'] == ('тёща', 'ш→щ', CAPITALIZED)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        RewriteIndex.write(tmp_dir, entries)
+        index = RewriteIndex.load(tmp_dir)
+        assert index.lookup('щоколад') == ('шоколад', 'щ→ш')
+        assert index.lookup('Щоколад') is None
+        assert index.lookup('Тёша') == ('Тёща', 'ш→щ')
+        assert index.lookup('ТЁША') is None
+        assert index.lookup('шоколад') is None and index.lookup('кошка') is None
+        for variant in entries:
+            for token in (variant, Aa(variant)):
+                assert index.lookup(token) in (None, fix_token(token)), token
+        index.close()
+
+    print('All done =)')
@@ -1,57 +1,99 @@
 import re
 import os
-import string
 import collections
 import json
 import pickle
 import glob
+import heapq
 import traceback
 
-from spellchecker import SpellChecker
+from tokenization_utils import Tokenizer, SPECIAL_TOKENS, load_special_tokens
+from text_edits import Fixup, apply_edits
+from token_cache import LRUCache
+from fix_cache import FixCache, file_fingerprint
+from mmap_dict import MappedStringTable
+from lexicon import Lexicon
+from fuzzy_index import DeletionIndex
+from rewrite_index import RewriteIndex
+from replacement_index import ReplacementIndex
+from char_classes import is_number_or_symbol
+from token_rules import TokenRules, RuleStats, TOKEN_RULES
+from particle_rules import ParticleRules, PARTICLE_RULES
 
-from restore_cyrillic import restore_cyrillic
-from tokenization_utils import tokenize_slowly
-from emoji import EMOJI_CHARACTER
 
+CYR_SET = '[АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя]'
+LAT2CYR = {'3': 'З', 'K': 'К', 'O': 'О', 'C': 'С', 'A': 'А', 'B': 'В', 'o': 'о', 'a': 'а', 'c': 'с', 'k': 'к', 'y': 'у', '6': 'б'}
 
-def Aa(s):
-    return s[0].upper() + s[1:]
-
+# Все контексты подмены за один проход, окружение проверяется по исходному тексту:
+#   K тебе ==> К тебе           - латинская буква в начале слова перед кириллическим словом
+#   и c тобой ==> и с тобой     - однобуквенное слово после кириллического слова
+#   те6я ==> тебя               - символ между кириллическими буквами
+rx_homoglyph_char = re.compile('[KOCABoacky6]')
+rx_homoglyph = re.compile(r'\b[KOCABoacky](?=[,!]?\s' + CYR_SET + ')'
+                          r'|(?:(?<=' + CYR_SET + r'\s)|(?<=' + CYR_SET + r'[,!?.:]\s))[oacky]\b'
+                          r'|(?<=' + CYR_SET + ')[oacky6](?=' + CYR_SET + ')')
 
-class TrieNode:
-    def __init__(self):
-        self.result_word = None
-        self.children = {}
 
-    def insert(self, word, result_word):
-        node = self
-        for letter in word:
-            if letter not in node.children:
-                node.children[letter] = TrieNode()
+# Модули с правилами и их таблицами. Их исходники входят в отпечаток кэша fix(), поэтому после правки
+# правил старые записи кэша перестают находиться, как и после пересборки словарей.
+RULE_MODULES = ['spellcheck.py', 'token_rules.py', 'particle_rules.py', 'text_edits.py', 'tokenization_utils.py',
+                'char_classes.py', 'replacement_index.py', 'rewrite_index.py', 'fuzzy_index.py', 'lexicon.py']
 
-            node = node.children[letter]
 
-        node.result_word = result_word
+# Токены, которые fix_token не исправляет: теги типа <verse> и числа.
+rx_tag_or_number = re.compile(r'</?\w+>$|\d+$')
 
-    def search(self, tail):
-        if len(tail) == 0:
-            if self.result_word:
-                return self.result_word
-            else:
-                return None
-        else:
-            if tail[0] in self.children:
-                return self.children[tail[0]].search(tail[1:])
 
-            return None
+def Aa(s):
+    return s[0].upper() + s[1:]
 
 
 class PoeticSpellchecker(object):
-    def __init__(self, parser, allow_norwig_speller=False):
+    def __init__(self, parser, allow_norwig_speller=False, token_cache_size=100000, fuzzy_max_distance=1, prescreen=True):
         self.parser = parser
+        # Исправление длинных незнакомых слов по ближайшему словарному слову, см. fuzzy_index.py.
+        # fuzzy_max_distance - глубина индекса, который строит compile(), и предел расстояния при поиске.
         self.allow_norwig_speller = allow_norwig_speller
+        self.fuzzy_max_distance = fuzzy_max_distance
+        self.fuzzy_index = None
+        # Обратный индекс пословных правил (ошибочное написание => исправление), см. rewrite_index.py.
+        self.rewrite_index = None
+        # Пословные правила fix_token и счетчики их срабатываний, см. token_rules.py.
+        # Время по правилам считается, если включить self.rule_stats.timing.
+        self.token_rules = TokenRules(TOKEN_RULES)
+        self.rule_stats = RuleStats(self.token_rules.rule_ids())
+        # Правила с частицами и дефисами, см. particle_rules.py.
+        self.particle_rules = ParticleRules(PARTICLE_RULES)
+        # Предварительная проверка в fix(): тексты, в которых ни одно правило не сработает, возвращаются
+        # сразу, см. needs_fixing(). Счетчики - проверенные тексты и сколько из них оказались чистыми.
+        # Когда чистых текстов мало (например, на холодном кэше токенов), проверку выгоднее отключить.
+        self.prescreen = prescreen
+        self.prescreen_checks = 0
+        self.prescreen_clean = 0
+        # Символы, без которых не сработают правила с омоглифами, апострофом, скобками и частицами.
+        self.rx_prescreen = re.compile('|'.join([rx_homoglyph_char.pattern, '’', r'\(', self.particle_rules.rx_trigger.pattern]))
+        # Кэш результатов fix_token: токен => (исправление, правило). token_cache_size=0 отключает кэш.
+        self.token_cache = LRUCache(token_cache_size)
+        # Исправления токенов, найденные заранее по словарю корпуса (см. resolve_tokens и --vocab_first
+        # в spellcheck_corpus.py): токен => (исправление, правило). Остальные токены проверяются как обычно.
+        self.token_corrections = None
+        # Файлы словарей, их отпечаток и дисковый кэш результатов fix(), см. open_fix_cache().
+        self.fingerprint_paths = None
+        self.fingerprint = None
+        self.fix_cache = None
+        self.repl_rx_rules = None
+        self.special_tokens = SPECIAL_TOKENS
+        self.tokenizer = Tokenizer(self.special_tokens)
+
+    def compile(self, data_dir, output_dir, rewrite_index=False):
+        # rewrite_index - собрать обратный индекс пословных правил (rewrite_index.py). Он проверяет fix_token'ом
+        # варианты каждого известного слова, это десятки минут на полном словаре, поэтому по умолчанию выключен.
+        # Многословные токены для токенизатора ("кое о чём", "т. д." и т.п.) можно дополнять в файле.
+        special_tokens_path = os.path.join(data_dir, 'speller', 'dict', 'special_tokens.txt')
+        if os.path.exists(special_tokens_path):
+            self.special_tokens = load_special_tokens(special_tokens_path)
+            self.tokenizer = Tokenizer(self.special_tokens)
 
-    def compile(self, data_dir, output_dir):
         self.known_words = set()
         self.word2upos = collections.defaultdict(set)
 
@@ -207,9 +249,12 @@ class PoeticSpellchecker(object):
 
         self.word2upos["хочется"].add("ГЛАГОЛ")
 
+        # Частоты слов нужны еще и для ранжирования кандидатов в fuzzy_index.
+        word_freqs = dict()
         with open(os.path.join(data_dir, 'speller', 'dict', 'known_words.2.txt'), 'r') as rdr:
             for line in rdr:
                 freq, word = line.strip().split('\t')
+                word_freqs[word] = max(word_freqs.get(word, 0), int(freq))
                 if int(freq) >= 20 and not word.endswith('ъ') and re.search(r'цц|ьь|ъъ|чч|ыы', word) is None:
                     self.known_words.add(word)
 
@@ -228,88 +273,269 @@ class PoeticSpellchecker(object):
         with open(fp) as f:
             for sample in json.load(f):
                 if sample['fixed_text']:
-                    self.known_words.update(tokenize_slowly(sample['fixed_text']))
+                    self.known_words.update(self.tokenizer.tokenize(sample['fixed_text']))
 
         for bad_word, good_word in self.word_replaces:
             if ' ' not in good_word and good_word not in self.known_words:
                 self.known_words.add(good_word)
 
+        self.build_repl_rules()
+
+        # Список известных слов хранится отдельно от pickle, в файле, который load() отображает в память:
+        # воркеры делят одну копию через page cache и не тратят время на распаковку множества.
+        # Там же для каждого слова лежит битовая маска частей речи, а в pickle - только названия частей речи.
+        known_words_path = os.path.join(output_dir, 'known_words.sst')
+        upos_names = Lexicon.write(known_words_path, self.known_words, self.word2upos)
+        if self.allow_norwig_speller:
+            DeletionIndex.write(output_dir, dict((word, word_freqs.get(word, 0)) for word in self.known_words), max_distance=self.fuzzy_max_distance)
+        else:
+            # Индекс нужен только norvig, а его сборка для всего словаря - самая дорогая часть compile().
+            # Индекс от прошлой сборки не соответствует новым словарям, его удаляем.
+            DeletionIndex.remove(output_dir)
+
         with open(os.path.join(output_dir, 'spellcheck.pkl'), 'wb') as f:
-            pickle.dump(self.known_words, f)
-            pickle.dump(self.word2upos, f)
+            pickle.dump(None, f)  # known_words, см. known_words.sst
+            pickle.dump(upos_names, f)
             pickle.dump(self.repl_rx, f)
             pickle.dump(self.repl_rx__1, f)
             pickle.dump(self.word_replaces, f)
             #pickle.dump(self.acceptable_edits, f)
 
+            # Скомпилированные таблицы правил сохраняем вместе со словарями, чтобы загруженный
+            # экземпляр не тратил время на компиляцию регулярок.
+            pickle.dump(self.repl_rx_rules, f)
+            pickle.dump(self.repl_rx_index, f)
+            pickle.dump(self.repl_rx_unindexed, f)
+            pickle.dump(self.repl_rx__1_rules, f)
+            pickle.dump(self.special_tokens, f)
+
+        self.known_words = Lexicon(MappedStringTable(known_words_path), upos_names)
+        self.word2upos = None
+        fingerprint_paths = [os.path.join(output_dir, 'spellcheck.pkl'), known_words_path]
+        if rewrite_index:
+            self.build_rewrite_index(output_dir)
+            self.rewrite_index = RewriteIndex.load(output_dir)
+            fingerprint_paths.extend(self.rewrite_index.paths)
+        else:
+            # Индекс от прошлой сборки не соответствует новым словарям.
+            RewriteIndex.remove(output_dir)
+            self.rewrite_index = None
+        if self.allow_norwig_speller:
+            self.fuzzy_index = DeletionIndex.load(output_dir)
+            fingerprint_paths.extend(self.fuzzy_index.paths)
+        self.fingerprint_paths = fingerprint_paths
+        self.fingerprint = None
         self.post_load()
 
+    def build_rewrite_index(self, output_dir):
+        # Можно вызвать и после load(output_dir), если словари собраны без индекса; load() подхватит его в следующий раз.
+        # Варианты проверяются самим fix_token, поэтому словари и правила должны быть уже готовы,
+        # а norvig отключен: его ответы зависят от настройки allow_norwig_speller при загрузке.
+        self.repl_index = ReplacementIndex(self.word_replaces)
+        fuzzy_index, self.fuzzy_index = self.fuzzy_index, None
+        self.rewrite_index = None
+        RewriteIndex.write(output_dir, RewriteIndex.build(self.known_words, self.fix_token))
+        self.fuzzy_index = fuzzy_index
+        # Проверка вариантов не должна попадать в статистику правил.
+        self.rule_stats.clear()
+
     def load(self, data_dir):
+        known_words_path = os.path.join(data_dir, 'known_words.sst')
+        fingerprint_paths = [os.path.join(data_dir, 'spellcheck.pkl')]
         with open(os.path.join(data_dir, 'spellcheck.pkl'), 'rb') as f:
             self.known_words = pickle.load(f)
             self.word2upos = pickle.load(f)
+            if self.known_words is None:
+                fingerprint_paths.append(known_words_path)
+                if isinstance(self.word2upos, list):
+                    # Части речи лежат битовыми масками в known_words.sst, в pickle - их названия.
+                    self.known_words = Lexicon(MappedStringTable(known_words_path), self.word2upos)
+                    self.word2upos = None
+                else:
+                    self.known_words = MappedStringTable(known_words_path)
+
             self.repl_rx = pickle.load(f)
             self.repl_rx__1 = pickle.load(f)
             self.word_replaces = pickle.load(f)
             #self.acceptable_edits = pickle.load(f)
 
+            try:
+                self.repl_rx_rules = pickle.load(f)
+                self.repl_rx_index = pickle.load(f)
+                self.repl_rx_unindexed = pickle.load(f)
+                self.repl_rx__1_rules = pickle.load(f)
+            except EOFError:
+                # Файл собран старой версией compile(), без скомпилированных правил.
+                self.repl_rx_rules = None
+
+            try:
+                self.special_tokens = pickle.load(f)
+            except EOFError:
+                self.special_tokens = SPECIAL_TOKENS
+
+        self.rewrite_index = None
+        if RewriteIndex.exists(data_dir):
+            self.rewrite_index = RewriteIndex.load(data_dir)
+            fingerprint_paths.extend(self.rewrite_index.paths)
+
+        self.fuzzy_index = None
+        if self.allow_norwig_speller and DeletionIndex.exists(data_dir):
+            self.fuzzy_index = DeletionIndex.load(data_dir)
+            fingerprint_paths.extend(self.fuzzy_index.paths)
+
+        self.fingerprint_paths = fingerprint_paths
+        self.fingerprint = None
         self.post_load()
 
     def post_load(self):
-        self.repl_trie = TrieNode()
-        for bad, good in self.word_replaces:
-            self.repl_trie.insert(bad, good)
+        self.tokenizer = Tokenizer(self.special_tokens)
+
+        # Закэшированные исправления зависят от словарей, после перезагрузки они недействительны.
+        self.token_cache.clear()
+        self.token_corrections = None
+
+        self.repl_index = ReplacementIndex(self.word_replaces)
+
+        if not isinstance(self.known_words, Lexicon):
+            # Словари, собранные старыми версиями compile(): множество слов и word2upos с множествами частей речи.
+            self.known_words = Lexicon.from_sets(self.known_words, self.word2upos)
+            self.word2upos = None
+        self.verb_bit = self.known_words.verb_bit
+
+        if self.repl_rx_rules is None:
+            self.build_repl_rules()
+        elif not isinstance(self.repl_rx__1_rules, dict):
+            # В spellcheck.pkl старого формата замены с по- лежат списком регулярок.
+            self.build_repl_rx__1_rules()
+        self.build_repl_rx_prescreen()
+
+        if not self.allow_norwig_speller:
+            self.fuzzy_index = None
+        elif self.fuzzy_index is None:
+            # Словари собраны без fuzzy_deletes.bin: строим индекс в памяти, без частот слов.
+            self.fuzzy_index = DeletionIndex.from_words(dict((word, 0) for word in self.known_words), max_distance=self.fuzzy_max_distance)
+
+    def build_repl_rules(self):
+        # Тысячи фразовых замен из repl_rx нельзя прогонять через re.search по одной на каждый текст:
+        # кэш модуля re переполняется, и паттерны перекомпилируются при каждом вызове fix().
+        # Поэтому компилируем их один раз и индексируем по первому слову фразы: при проверке текста
+        # достаточно одного прохода по его словам, чтобы отобрать правила, которые могут сработать.
+        # Варианты замены с заглавной буквы (Aa) тоже готовим заранее.
+        self.repl_rx_rules = []
+        self.repl_rx_index = collections.defaultdict(list)
+        self.repl_rx_unindexed = []  # правила с настоящими регулярками, проверяются всегда
+
+        for irule, (bad, good) in enumerate(self.repl_rx):
+            rx = re.compile(r'\b'+bad+r'\b', flags=re.I | re.MULTILINE)
+            self.repl_rx_rules.append((rx, good, Aa(good)))
+
+            m = re.match(r'\w+', bad)
+            if m is not None and re.search(r'[\\()\[\]{}.*+?|^$]', bad.replace('\\-', '')) is None:
+                self.repl_rx_index[m.group(0).casefold()].append(irule)
+            else:
+                self.repl_rx_unindexed.append(irule)
+
+        self.repl_rx_index = dict(self.repl_rx_index)
+
+        self.build_repl_rx__1_rules()
+
+    def build_repl_rx__1_rules(self):
+        # Замены с префиксом по- ищутся по словарю из строчного и капитализированного написания,
+        # см. particle_rules.fix_po_replaces.
+        self.repl_rx__1_rules = dict()
+        for bad, good in self.repl_rx__1:
+            self.repl_rx__1_rules[bad] = good
+            self.repl_rx__1_rules[Aa(bad)] = Aa(good)
+
+    def build_repl_rx_prescreen(self):
+        # Для needs_fixing() правила без регулярок индексируем по двум первым словам фразы: в неизменном
+        # тексте фраза совпадет, только если эти слова идут в нем подряд. Частые первые слова ("в", "не")
+        # отбирают сотни правил, а пары слов - единицы. В fix_repl_rx так нельзя: замены порождают новые пары.
+        self.repl_rx_prescreen = collections.defaultdict(list)
+        for word, irules in self.repl_rx_index.items():
+            for irule in irules:
+                words = re.findall(r'\w+', self.repl_rx[irule][0])
+                key = (word, words[1].casefold()) if len(words) > 1 else (word,)
+                self.repl_rx_prescreen[key].append(irule)
+        self.repl_rx_prescreen = dict(self.repl_rx_prescreen)
+
+    def select_repl_rx_prescreen(self, text: str):
+        irules = set(self.repl_rx_unindexed)
+        words = [word.casefold() for word in re.findall(r'\w+', text)]
+        for i, word in enumerate(words):
+            irules.update(self.repl_rx_prescreen.get((word,), ()))
+            if i + 1 < len(words):
+                irules.update(self.repl_rx_prescreen.get((word, words[i + 1]), ()))
+        return irules
+
+    def select_repl_rx(self, text: str):
+        irules = set(self.repl_rx_unindexed)
+        for word in re.findall(r'\w+', text):
+            irules.update(self.repl_rx_index.get(word.casefold(), ()))
+        return irules
+
+    def fix_homoglyphs(self, text2, fixups):
+        """Латинские буквы и цифры, похожие на кириллические, в окружении кириллицы."""
+        if rx_homoglyph_char.search(text2) is None:
+            # В тексте нет ни одного подозрительного символа - обычный случай для кириллического текста.
+            return text2
+
+        edits = []
+        for m in rx_homoglyph.finditer(text2):
+            c = LAT2CYR[m.group(0)]
+            edits.append((m.start(), m.end(), c, 'homoglyph'))
+            fixups.append(Fixup(m.group(0), c, m.start(), m.end(), 'homoglyph'))
+        return apply_edits(text2, edits)
+
+    def fix_repl_rx(self, text2, fixups):
+        # Правила применяются в исходном порядке, каждое к результату предыдущих. Замена может
+        # породить новые слова, поэтому слова из good добавляют кандидатов среди последующих правил.
+        candidates = list(self.select_repl_rx(text2))
+        heapq.heapify(candidates)
+        seen = set(candidates)
+        while candidates:
+            irule = heapq.heappop(candidates)
+            rx, good, good_Aa = self.repl_rx_rules[irule]
+            # Позиции правок отсчитываются в тексте перед применением этого правила.
+            edits = []
+            for m in rx.finditer(text2):
+                old_str = m.group(0)
+                new_str = m.expand(good_Aa if old_str[0].upper() == old_str[0] else good)
+                fixups.append(Fixup(old_str, new_str, m.start(), m.end(), 'repl_rx'))
+                edits.append((m.start(), m.end(), new_str, 'repl_rx'))
 
-        if self.allow_norwig_speller:
-            self.norwig_spell = SpellChecker(distance=1)
-            self.norwig_spell.word_frequency.load_words(self.known_words)
-        else:
-            self.norwig_spell = None
+            if edits:
+                text2 = apply_edits(text2, edits)
+                for irule2 in self.select_repl_rx(good):
+                    if irule2 > irule and irule2 not in seen:
+                        seen.add(irule2)
+                        heapq.heappush(candidates, irule2)
 
-    emoji_pattern = re.compile("^(©|" + EMOJI_CHARACTER + ")", flags=re.UNICODE)
+        return text2
 
     def is_known_word(self, word: str, strict_yofication: bool=False) -> bool:
         lword = word.lower()
-        if lword in self.known_words or word in string.punctuation or word in "«»—–…“”":
-            return True
-
-        if not strict_yofication and 'ё' in lword and lword.replace('ё', 'е') in self.known_words:
-            return True
-
-        # числа и 70%
-        if re.match(r'^\d+%?$', word) is not None:
+        if self.known_words.is_known(lword, strict_yofication):
             return True
 
-        # римские числа
-        # VII в. н.э.
-        # ^^^
-        if re.match(r'^[MXCVI]+$', word) is not None:
-            return True
-
-        if PoeticSpellchecker.emoji_pattern.match(word) is not None:
-            return True
-
-        return False
+        # пунктуация, числа и 70%, римские числа (VII в. н.э.), эмодзи
+        return is_number_or_symbol(word)
 
     def is_verb(self, word: str) -> bool:
-        lword = word.lower()
-        if 'ГЛАГОЛ' in self.word2upos.get(lword, ''):
-            return True
-
-        if 'ё' in lword and 'ГЛАГОЛ' in self.word2upos.get(lword.replace('ё', 'е'), ''):
-            return True
-
-        return False
+        return self.known_words.is_verb(word.lower())
 
     def is_verb_only(self, word: str) -> bool:
         # мой ==> False
         # купи ==> True
         lword = word.lower()
-        uposes = self.word2upos.get(lword, '')
-        return 'ГЛАГОЛ' in uposes and len(uposes) == 1
+        return self.verb_bit != 0 and self.known_words.upos_mask(lword) == self.verb_bit
 
     def tokenize(self, text: str):
-        yield from tokenize_slowly(text)
+        yield from self.tokenizer.tokenize(text)
+
+    def tokenize_spans(self, text: str):
+        # Тройки (токен, start, end) с позициями токенов в text.
+        yield from self.tokenizer.tokenize_spans(text)
 
     def search_oov(self, text: str):
         for token in self.tokenize(text):
@@ -344,33 +570,207 @@ class PoeticSpellchecker(object):
 
         return m.group(0)
 
-    def fix(self, text):
-        fixups = []
-        text2 = text
+    def correct_token(self, token: str):
+        """То же, что fix_token, но с кэшированием результата для повторяющихся токенов."""
+        if self.token_corrections is not None:
+            result = self.token_corrections.get(token)
+            if result is not None:
+                return result
+
+        result = self.token_cache.get(token)
+        if result is None:
+            result = self.fix_token(token)
+            self.token_cache.put(token, result)
+        return result
+
+    def resolve_tokens(self, tokens):
+        """Исправления незнакомых токенов из tokens: словарь токен => (исправление, правило), как у fix_token."""
+        corrections = dict()
+        for token in tokens:
+            if token.lower() not in self.known_words:
+                corrections[token] = self.fix_token(token)
+        return corrections
+
+    def fix_token(self, token: str):
+        """Исправление одиночного токена. Возвращает пару (исправленный токен, идентификатор правила)
+        или (None, None), если токен исправлять не нужно."""
+        if re.match(r'^</?\w+>$', token):
+            # теги типа <song> и <verse> не обрабатываем
+            return None, None
+
+        if re.match(r'^\d+$', token):
+            # Числа игнорируем
+            return None, None
+
+        ltoken = token.lower()
+
+        token0 = None
+        token2 = None
+
+        repl = self.repl_index.search(ltoken)
+        if repl is not None:
+            token0 = repl
+            token2 = token0
+            if token[0].lower() != token[0]:
+                token2 = token2[0].upper() + token2[1:]
+
+            return token2, 'replaces'
+
+        if ltoken not in self.known_words:
+            if self.rewrite_index is not None:
+                # Известные ошибочные написания исправляются одним поиском, без прохода по веткам ниже.
+                fixed = self.rewrite_index.lookup(token)
+                if fixed is not None:
+                    return fixed
+
+            # Остальные пословные правила и их порядок - в таблице token_rules.TOKEN_RULES.
+            return self.token_rules.apply(self, token, ltoken, self.rule_stats)
+
+        return None, None
+
+    def open_fix_cache(self, path):
+        """
+        Подключает дисковый кэш результатов fix() в sqlite-файле path. Кэш можно открыть из нескольких
+        процессов одновременно; записи, сделанные с другой версией словарей, кода правил (RULE_MODULES)
+        или настроек norvig, не используются и удаляются только явным вызовом self.fix_cache.purge().
+        """
+        if self.fingerprint_paths is None:
+            raise RuntimeError('Dictionaries must be loaded with load() or compile() before opening the fix cache')
+
+        if self.fingerprint is None:
+            # Хэш десятков мегабайт словарей считаем только при подключении кэша, а не при каждой загрузке.
+            # Результат fix() зависит еще от кода правил и от настроек norvig, даже если файлов его индекса нет.
+            module_dir = os.path.dirname(os.path.abspath(__file__))
+            rule_paths = [os.path.join(module_dir, name) for name in RULE_MODULES]
+            self.fingerprint = '{}:norvig={}:{}'.format(file_fingerprint(*(self.fingerprint_paths + rule_paths)),
+                                                        int(self.allow_norwig_speller), self.fuzzy_max_distance)
+        self.fix_cache = FixCache(path, self.fingerprint)
+
+    def needs_fixing(self, text):
+        """
+        Быстрая проверка перед fix(): False, если fix(text) точно вернет текст без исправлений.
+        True означает, что какое-то правило может сработать, и текст надо исправлять полностью.
+        """
+        return self.screen(text)[0]
+
+    def screen(self, text):
+        """
+        То же, что needs_fixing(), но вместе с токенами: пара (надо ли исправлять, список (токен, start, end)).
+        Токены возвращаются, если фразовые правила текст не изменят, тогда fix_tokens может их не пересчитывать;
+        иначе вместо списка None.
+        """
+        self.prescreen_checks += 1
+
+        # Фразовые правила: одна регулярка по всем триггерам, а при совпадении - проверка шаблонов тех же
+        # стадий, что в fix_uncached.
+        if self.rx_prescreen.search(text) is not None:
+            if rx_homoglyph.search(text) is not None:
+                return True, None
+            if re.search(r'\w’\w|\w\(\w+\)', text) is not None:
+                return True, None
+            if self.particle_rules.may_apply(text):
+                return True, None
+
+        for irule in self.select_repl_rx_prescreen(text):
+            if self.repl_rx_rules[irule][0].search(text) is not None:
+                return True, None
+
+        # Пословные правила: каскад fix_token здесь не запускается. Знакомое слово без замены в word_replaces,
+        # тег и число fix_token не исправляет, для остальных токенов нужен готовый ответ из кэша.
+        token_spans = list(self.tokenize_spans(text))
+        for token, start, end in token_spans:
+            ltoken = token.lower()
+            if ltoken in self.known_words and self.repl_index.search(ltoken) is None:
+                continue
+            if rx_tag_or_number.match(token):
+                continue
 
-        cyr_set = '[АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя]'
-        lat2cyr = {'3': 'З', 'K': 'К', 'O': 'О', 'C': 'С', 'A': 'А', 'B': 'В', 'o': 'о', 'a': 'а', 'c': 'с', 'k': 'к', 'y': 'у', '6': 'б'}
+            result = self.token_corrections.get(token) if self.token_corrections is not None else None
+            if result is None:
+                result = self.token_cache.peek(token)
+            if result is None or result[0]:
+                return True, token_spans
 
-        m1 = re.search(r'\b([KOCABoacky])[,!]?\s'+cyr_set, text2)
-        if m1:
-            for g1, g2 in re.findall(r'\b([KOCABoacky])([,!]?\s'+cyr_set+')', text2):
-                text2 = re.sub(rf'\b({g1})({g2})', lambda x: lat2cyr[x.group(1)]+x.group(2), text2)
-                fixups.append((g1, lat2cyr[g1]))
+        self.prescreen_clean += 1
+        return False, token_spans
 
-        m2 = re.search(cyr_set + r'[,!?.:]?\s([oacky])\b', text2)
-        if m2:
-            for g1, g2 in re.findall('('+cyr_set + r'[,!?.:]?\s)([oacky])\b', text2):
-                text2 = re.sub(rf'({g1}[,!?.:]?\s)({g2})\b', lambda x: x.group(1)+lat2cyr[x.group(2)], text2)
-                fixups.append((g2, lat2cyr[g2]))
+    def prescreen_hit_rate(self):
+        """Доля текстов, которые needs_fixing() признала чистыми."""
+        return self.prescreen_clean / self.prescreen_checks if self.prescreen_checks else 0.0
 
-        # Alien char surrounded by cyrillic chars
-        # те6я  ==> тебя
-        m2 = re.search(cyr_set + r'([oacky6])' + cyr_set, text2)
-        if m2:
-            for g1, g2, g3 in re.findall('('+cyr_set + r')([oacky6])(' + cyr_set + ')', text2):
-                text2 = re.sub(rf'({g1})({g2})({g3})', lambda x: x.group(1)+lat2cyr[x.group(2)]+x.group(3), text2)
-                fixups.append((g2, lat2cyr[g2]))
+    def fix(self, text):
+        token_spans = None
+        if self.prescreen:
+            needs_fixing, token_spans = self.screen(text)
+            if not needs_fixing:
+                return text, []
+
+        if self.fix_cache is None:
+            return self.fix_uncached(text, token_spans)
+
+        result = self.fix_cache.get(text)
+        if result is None:
+            result = self.fix_uncached(text, token_spans)
+            self.fix_cache.put(text, result)
+        return result
+
+    def fix_apostrophe(self, text2, fixups):
+        # По мне, чудн’о названье это,
+        #             ^
+        if '’' not in text2:
+            return text2
+
+        edits = []
+        for m in re.finditer(r'\b\w+’\w+\b', text2):
+            token = m.group(0)
+            token2 = token.replace('’', '')
+            if self.is_known_word(token2):
+                fixups.append(Fixup(token, token2, m.start(), m.end(), 'apostrophe'))
+                edits.append((m.start(), m.end(), token2, 'apostrophe'))
+        return apply_edits(text2, edits)
+
+    def fix_rparens(self, text2, fixups):
+        # Но Любовью бе(з)конечной
+        # О чём сказать хотел(бы)вам
+        text2 = re.sub(r'\b(\w+)\((\w+)\)(\w+)(\W|$)', lambda m: self.fix_rparens3(m), text2)
 
+        # Когда есть свет, к тому(ж) тепло
+        text2 = re.sub(r'\b(\w+)\((\w+)\)(\W|$)', lambda m: self.fix_rparens2(m), text2)
+        return text2
+
+    def fix_particles(self, text2, fixups):
+        # Правила с частицами и дефисами ("-ка", "-же", "по-", "за " и т.д.) - один проход по тексту,
+        # см. particle_rules.py.
+        return self.particle_rules.apply(self, text2, fixups)
+
+    def fix_tokens(self, text2, fixups, token_spans=None):
+        # Исправления отдельных токенов собираем как правки (start, end, replacement, rule) относительно
+        # текущего текста и применяем одним проходом в конце. token_spans - уже готовая токенизация text2.
+        edits = []
+        if token_spans is None:
+            token_spans = self.tokenize_spans(text2)
+        for token, start, end in token_spans:
+            token2, rule = self.correct_token(token)
+            if token2:
+                fixups.append(Fixup(token, token2, start, end, rule))
+                edits.append((start, end, token2, rule))
+
+        return apply_edits(text2, edits)
+
+    def fix_stages(self):
+        """Стадии fix_uncached по порядку: пары (название, метод). Метод получает текст после предыдущей
+        стадии и список fixups, дописывает в него свои исправления и возвращает новый текст."""
+        return [('homoglyphs', self.fix_homoglyphs),
+                ('repl_rx', self.fix_repl_rx),
+                ('apostrophe', self.fix_apostrophe),
+                ('rparens', self.fix_rparens),
+                ('particles', self.fix_particles),
+                ('tokens', self.fix_tokens)]
+
+    def fix_uncached(self, text, token_spans=None):
+        """token_spans - токены text из screen(): если фразовые стадии текст не изменили, он не токенизируется заново."""
+        fixups = []
+        text2 = text
 
         # for bad, good in self.repl_rx_1:
         #     m = re.search(bad, text2, flags=re.I)  # | re.MULTILINE
@@ -385,773 +785,44 @@ class PoeticSpellchecker(object):
         #
         #         fixups.append((m.group(0), good2))
 
-        for bad, good in self.repl_rx:
-            m = re.search(r'\b'+bad+r'\b', text2, flags=re.I | re.MULTILINE)
-            if m is not None:
-                old_str = m.group(0)
-                if old_str[0].upper() == old_str[0]:
-                    text2 = re.sub(r'\b'+Aa(bad)+r'\b', Aa(good), text2, flags=re.I)
-                    new_str = re.sub(r'\b'+Aa(bad)+r'\b', Aa(good), old_str, flags=re.I)
-                else:
-                    text2 = re.sub(r'\b'+bad+r'\b', good, text2, flags=re.I)
-                    new_str = re.sub(r'\b' + bad + r'\b', good, old_str, flags=re.I)
-
-                fixups.append((old_str, new_str))
-
-        for bad, good in [(', лишь,', ' лишь '), (', уже,', ' уже '), (', почему-то,', ' почему-то ')]:
-            m = re.search(bad, text2, flags=re.I)
-            if m is not None:
-                text2 = re.sub(bad, good, text2)
-                text2 = re.sub(r'[ ]{2,}', ' ', text2)
-                fixups.append((m.group(0), good))
-
-        # По мне, чудн’о названье это,
-        #             ^
-        if re.search(r'(\w)’(\w)', text2):
-            m = re.search(r'\b(\w+’\w+)\b', text2)
-            if m:
-                token = m.group(1)
-                token2 = token.replace('’', '')
-                if self.is_known_word(token2):
-                    fixups.append((token, token2))
-                    text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-
-        # Там поля стоят во-ржи
-        #                ^^^^^^
-        if re.search(r'\bво\-\w+', text2, flags=re.I):
-            m = re.search(r'(во)\-(\w+)', text2, flags=re.I)
-            token12 = m.group(0)
-            token1 = m.group(1)
-            token2 = m.group(2)
-            if not self.is_known_word(token12) and self.is_known_word(token2) and not self.is_known_word((token1+token2).lower()):
-                fixups.append((token12, token1 + ' ' + token2))
-                text2 = re.sub(r'\b' + token1 + '\\-' + token2 + r'\b', token1 + ' ' + token2, text2)
-
-        # Но Любовью бе(з)конечной
-        # О чём сказать хотел(бы)вам
-        text2 = re.sub(r'\b(\w+)\((\w+)\)(\w+)(\W|$)', lambda m: self.fix_rparens3(m), text2)
-
-        # Когда есть свет, к тому(ж) тепло
-        text2 = re.sub(r'\b(\w+)\((\w+)\)(\W|$)', lambda m: self.fix_rparens2(m), text2)
-
-        # Ты дождевик одень ка.
-        #             ^^^^^^^^
-        # Другой добычи поищу - ка!
-        #               ^^^^^^^^^^
-        if re.search(r'\sка\b', text2) is not None:
-            for m in re.finditer(r'\b(\w+)\sка\b', text2):
-                word1 = m.group(1)
-                if self.is_verb(word1) or word1.lower() in ['ну', 'на']:
-                    text2 = re.sub(r'\b({})\sка\b'.format(word1), '\\1-ка', text2)
-                    fixups.append((m.group(0), f'{word1}-ка'))
-
-            for m in re.finditer(r'\b(\w+)\s\-\sка\b', text2):
-                word1 = m.group(1)
-                if self.is_verb(word1):
-                    text2 = re.sub(r'\b({})\s\-\sка\b'.format(word1), '\\1-ка', text2)
-                    fixups.append((m.group(0), f'{word1}-ка'))
-
-        # за скучаешь ==> заскучаешь
-        for m in re.finditer(r'\b(за)\s(\w+)\b', text2):
-            prepos = m.group(1)
-            word2 = m.group(2)
-            if self.is_verb_only(word2):
-                verb12 = prepos+word2
-                if self.is_known_word(verb12) and self.is_verb(verb12):
-                    text2 = re.sub(r'\b({})\s({})\b'.format(prepos, word2), verb12, text2)
-                    fixups.append((m.group(0), verb12))
-
-
-        # Знаешь-ли, такая штука - жизнь
-        # ^^^^^^^^^
-        if re.search(r'\-л[иь]\b', text2) is not None:
-            for m in re.finditer(r'\b(\w+)\-(л[иь])\b', text2):
-                word1 = m.group(1)
-                word2 = m.group(2)
-                text2 = re.sub(r'\b({})\-(л[иь])\b'.format(word1), '\\1 \\2', text2)
-                fixups.append((m.group(0), f'{word1} {word2}'))
-
-        # Мы-же ни к кому не лезли.
-        # ^^^^^
-        # Надо-ж выдумать такое - во дурак!
-        # ^^^^^^
-        if re.search(r'\-(же|ж)\b', text2) is not None:
-            for m in re.finditer(r'\b(\w+)\-(же|ж)\b', text2):
-                word1 = m.group(1)
-                if word1.lower() != 'да':  # да-же
-                    word2 = m.group(2)
-                    text2 = re.sub(r'\b({})\-(же|ж)\b'.format(word1), '\\1 \\2', text2)
-                    fixups.append((m.group(0), f'{word1} {word2}'))
-
-        # Мы-бы тоже пришли.
-        # Куда - б не пришёл, везде номер первый.
-        # Вот полетать где - бы.
-        # Он со мною везде, где-б я не был.
-        if re.search(r'\s*\-\s*(бы|б)\b', text2) is not None:
-            for m in re.finditer(r'\b(\w+)\s*\-\s*(бы|б)\b', text2):
-                word1 = m.group(1)
-                word2 = m.group(2)
-                text2 = re.sub(r'\b({})\s*\-\s*(бы|б)\b'.format(word1), '\\1 \\2', text2)
-                fixups.append((m.group(0), f'{word1} {word2}'))
-
-        # Я-б поучаствовал
-        # ^^^
-        if re.search(r'\-б\b', text2) is not None:
-            for m in re.finditer(r'\b(\w+)\-б\b', text2):
-                word1 = m.group(1)
-                text2 = re.sub(r'\b({})\-б\b'.format(word1), '\\1 б', text2)
-                fixups.append((m.group(0), f'{word1} б'))
-
-        # Что такое блогер-это смелость
-        #                 ^^^^
-        if re.search(r'\-это\b', text2) is not None:
-            for m in re.finditer(r'\b(\w+)\-это\b', text2, flags=re.I):
-                word1 = m.group(1)
-                text2 = re.sub(r'\b({})\-это\b'.format(word1), '\\1 - это', text2)
-                fixups.append((m.group(0), f'{word1} - это'))
-
-        # Кому - то повезло
-        # ^^^^^^^^^
-        if re.search(r' \-\s?то\b', text2) is not None:
-            for m in re.finditer(r'(\b|^)(\w+) \-\s?(то)(\b|$)', text2):
-                token1 = m.group(2)
-                token2 = m.group(3)
-                word12 = token1 + '-' + token2
-                if self.is_known_word(word12):
-                    text2 = re.sub(r'\b({}) \- ({})\b'.format(token1, token2), '\\1-\\2', text2)
-                    fixups.append((m.group(0), word12))
-
-        # С деревьев ветки по-срывал!
-        #                  ^^^^^^^^^
-        # Ты поёшь немного по - французски.
-        #                  ^^^^^^^^^^^^^^^
-        if re.search(r'\bпо\s?\-\s?\w', text2, flags=re.I) is not None:
-            for m in re.finditer(r'\b(по)\s?\-\s?(\w+)\b', text2, flags=re.I):
-                token1 = m.group(1)  # по
-                token2 = m.group(2)  # срывал
-                word12 = token1 + token2
-
-                if self.is_verb(word12):
-                    text2 = re.sub(r'\b({})\s?-\s?({})\b'.format(token1, token2), '\\1\\2', text2)
-                    fixups.append((m.group(0), word12))
-
-            for bad, good in self.repl_rx__1:
-                m = re.search(bad, text2, flags=re.I)  #  | re.MULTILINE
-                if m is not None:
-                    text2 = re.sub(r'\b'+bad+r'\b', good, text2)
-                    text2 = re.sub(r'\b'+Aa(bad)+r'\b', Aa(good), text2)
-                    fixups.append((m.group(0), good))
-
-            # Ты поёшь немного по - французски.
-            #                  ^^^^^^^^^^^^^^^
-            for m in re.finditer(r'\b(по) \- (\w+)\b', text2, flags=re.I):
-                token1 = m.group(1)  # по
-                token2 = m.group(2)  # французски
-                word12 = token1 + '-' + token2
-
-                if self.is_known_word(word12):
-                    text2 = re.sub(r'\b({}) - ({})\b'.format(token1, token2), '\\1-\\2', text2)
-                    fixups.append((m.group(0), word12))
-
-        # под-держать ==> поддержать
-        if re.search(r'\bпод\s?\-\s?\w', text2, flags=re.I) is not None:
-            for m in re.finditer(r'\b(под)\s?\-\s?(\w+)\b', text2, flags=re.I):
-                token1 = m.group(1)  # под
-                token2 = m.group(2)  # держать
-                word12 = token1 + token2
-
-                if self.is_verb(word12):
-                    text2 = re.sub(r'\b({})\s?-\s?({})\b'.format(token1, token2), '\\1\\2', text2)
-                    fixups.append((m.group(0), word12))
-
-        # из-под-палки
-        if re.match(r'\bиз\s?\-\s?под\s?\-\s?\w+\b', text2, flags=re.I) is not None:
-            for m in re.finditer(r'\b(из)\s?\-\s?(под)\s?\-\s?(\w+)\b', text2, flags=re.I):
-                token1 = m.group(1) # из
-                token2 = m.group(2) # под
-                token3 = m.group(3) # палки
-
-                if self.is_known_word(token3):
-                    text2 = re.sub(r'\b({})\s?\-\s?({})\s?\-\s?({})\b'.format(token1, token2, token3), '\\1-\\2 \\3', text2)
-                    fixups.append((m.group(0), token1 + '-' + token2 + ' ' + word12))
-
-        for token in self.tokenize(text2):
-            if re.match(r'^</?\w+>$', token):
-                # теги типа <song> и <verse> не обрабатываем
-                continue
-
-            if re.match(r'^\d+$', token):
-                # Числа игнорируем
-                continue
-
-            ltoken = token.lower()
-
-            token0 = None
-            token2 = None
-
-            repl = self.repl_trie.search(ltoken)
-            if repl is not None:
-                token0 = repl
-                token2 = token0
-                if token[0].lower() != token[0]:
-                    token2 = token2[0].upper() + token2[1:]
-
-                fixups.append((token, token2))
-                if token.startswith('*'):
-                    text2 = re.sub(r'(?<=\W)' + token.replace('*', '\\*') + r'\b', token2, text2)
-                else:
-                    text2 = re.sub(r'\b' + token.replace('*', '\\*') + r'\b', token2, text2)
-                continue
-
-            if ltoken not in self.known_words:
-                # п0д ==> под
-                m = re.match(r'^\w+0\w+|\w+0|0\w+$', ltoken)
-                if m:
-                    token2 = ltoken.replace('0', 'о')
-                    if token[0].lower() != token[0]:
-                        token2 = token2[0].upper() + token2[1:]
-                    fixups.append((token, token2))
-                    text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                    continue
-
-                # лa’вровый
-                # полон′или
-                m = re.match(r'^(\w+)[’′](\w+)$', ltoken)
-                if m:
-                    head = m.group(1)
-                    tail = m.group(2)
-                    token2 = head + tail
-                    if self.is_known_word(token2):
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search('ъ', token, flags=re.I):
-                    # вплотъ ==> вплоть
-                    token0 = re.sub(r'^(\w*)ъ(\w*)$', '\\1ь\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search('\wйу', token, flags=re.I):
-                    # выпускайут ==> выпускают
-                    token0 = re.sub(r'^(\w+)йу(\w*)$', '\\1ю\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search('ш', token, flags=re.I):
-                    # тёша ==> тёща
-                    token0 = re.sub(r'^(\w*)ш(\w*)$', '\\1щ\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.match('^\w+"\w+$', token):
-                    # под"езда ==> подъезда
-                    token0 = re.sub(r'^(\w+)"(\w+)$', '\\1ъ\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search('щ', token, flags=re.I):
-                    # щоколад ==> шоколад
-                    token0 = re.sub(r'^(\w*)щ(\w*)$', '\\1ш\\2', token, flags=re.I)
-                    if self.is_known_word(token0, strict_yofication=True):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search('^бези', token, flags=re.I):
-                    # безискусных ==> безыскусный
-                    token0 = re.sub(r'^(без)и(\w*)$', '\\1ы\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search(r'^\w+ться$', token, flags=re.I):
-                    # льються ==> льются
-                    token0 = re.sub(r'^(\w+)ться$', '\\1тся', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search(r'^\w+тся$', token, flags=re.I):
-                    # заниматся ==> заниматься
-                    token0 = re.sub(r'^(\w+)тся$', '\\1ться', token, flags=re.I)
-                    if self.is_known_word(token0) and self.is_verb(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                # хочецца
-                if re.search(r'^\w+цца$', token, flags=re.I):
-                    # хочецца ==> хочется
-                    token0 = re.sub(r'^(\w+)цца$', '\\1тся', token, flags=re.I)
-                    token00 = re.sub(r'^(\w+)цца$', '\\1ться', token, flags=re.I)
-                    if self.is_known_word(token0) and self.is_verb(token0) and not self.is_known_word(token00):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search(r'^\w+тса$', token, flags=re.I):
-                    # улыбаетса ==> улыбается
-                    # улыбаютса ==> улыбаются
-                    token0 = re.sub(r'^(\w+)тса$', '\\1тся', token, flags=re.I)
-                    token00 = re.sub(r'^(\w+)тса$', '\\1ться', token, flags=re.I)
-                    if self.is_known_word(token0) and self.is_verb(token0) and not self.is_known_word(token00):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search(r'^\w+а(ю|е)ца$', token, flags=re.I):
-                    # раздаюца ==> раздаются
-                    # случаеца
-                    token0 = re.sub(r'^(\w+а(ю|е))ца$', '\\1тся', token, flags=re.I)
-                    token00 = re.sub(r'^(\w+а(ю|е))ца$', '\\1ться', token, flags=re.I)
-                    if self.is_known_word(token0) and self.is_verb(token0) and not self.is_known_word(token00):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search(r'^здел\w+$', token, flags=re.I):
-                    # зделать ==> сделать
-                    token0 = re.sub(r'^здел(\w+)$', 'сдел\\1', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.search(r'^\w+щь$', token, flags=re.I):
-                    # увидищь ==> увидишь
-                    token0_1 = re.sub(r'^(\w+)щь$', '\\1шь', token, flags=re.I)
-
-                    # пожарищь ==> пожарищ
-                    # плащь ==> плащ
-                    token0_2 = re.sub(r'^(\w+)щь$', '\\1щ', token, flags=re.I)
-
-                    if self.is_known_word(token0_1) and not self.is_known_word(token0_2):
-                        # увидищь ==> увидишь
-                        token0 = token0_1
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-                    elif self.is_known_word(token0_2) and not self.is_known_word(token0_1):
-                        # пожарищь ==> пожарищ
-                        token0 = token0_2
-                        token2 = token0
-                        if self.is_known_word(token0):
-                            token2 = token0
-                            if token[0].lower() != token[0]:
-                                token2 = token2[0].upper() + token2[1:]
-                            fixups.append((token, token2))
-                            text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                            continue
-
-                if re.search(r'^\w*[бвгджзклмнпрстфхцчшщ]ь[аеёиоуыэюя]\w+$', token, flags=re.I):
-                    # изьянов ==> изъянов
-                    token0 = re.sub(r'^(\w*[бвгджзклмнпрстфхцчшщ])ь([аеёиоуыэюя]\w+)$', '\\1ъ\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                        fixups.append((token, token2))
-                        text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-                        continue
-
-                if re.match(r'^без[кпстфхц]\w+', token, flags=re.I):
-                    # безконечный ==> бесконечный
-                    # безценна ==> бесценна
-                    token0 = 'бес' + ltoken[3:]
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.match(r'^бес[бвгджзлмнр]\w+', token, flags=re.I):
-                    # безпардонный ==> беспардонный
-                    token0 = 'без' + ltoken[3:]
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'([бвгджзклмнпрстфхцчшщ])\1{2,}', token, flags=re.I):
-                    # ввверх ==> вверх
-                    # испуганнной ==> испуганной
-
-                    # НО: "Ммм" оставляем такие цепочки без изменения
-                    if len(set(token.lower())) != 1:
-                        if not self.is_known_word(token):
-                            # ввверх ==> вверх
-                            token0 = re.sub(r'([бвгджзклмнпрстфхцчшщ])(\1){2,}', r'\1\2', token, flags=re.I)
-                            if self.is_known_word(token0):
-                                token2 = token0
-                                if token[0].lower() != token[0]:
-                                    token2 = token2[0].upper() + token2[1:]
-                            else:
-                                # очччень ==> очень
-                                token0 = re.sub(r'([бвгджзклмнпрстфхцчшщ])(\1){2,}', r'\2', token, flags=re.I)
-                                if self.is_known_word(token0):
-                                    token2 = token0
-                                    if token[0].lower() != token[0]:
-                                        token2 = token2[0].upper() + token2[1:]
-
-                elif re.search(r'([ыщьъй])\1', token, flags=re.I):
-                    # Удивителььный ==> Удивительный
-                    token0 = re.sub(r'([ыщьъй])\1{1,}', r'\1', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'[жшщ]ы', token, flags=re.I):
-                    # обычнейшый ==> обычнейший
-                    token0 = re.sub(r'([жшщ])ы', r'\1и', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+[аеёиоуыя]шся$', token, flags=re.I):
-                    # боишся ==> боишься
-                    token0 = re.sub(r'^(\w+[аеёиоуыя])шся$', '\\1шься', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w{2,}[аеёио]ш$', token, flags=re.I):
-                    # сможеш ==> сможешь
-                    token0 = re.sub(r'^(\w+[аеёио])ш$', '\\1шь', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w{2,}[аеёиоуыюя]ж$', token, flags=re.I):
-                    # уничтож ==> уничтожь
-                    token0 = re.sub(r'^(\w+[аеёиоуюыя])ж$', '\\1жь', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-
-                elif re.search(r'^\w{2,}[аеёиоуюя]ч$', token, flags=re.I):
-                    # пресеч ==> пресечь
-                    token0 = token + 'ь'
-                    if self.is_known_word(token0):
-                        token2 = token0
-
-                elif re.search(r'^\w{2,}[аеёиоуыюя][шч]ь$', token, flags=re.I):
-                    # гадёнышь ==> гадёныш
-                    # скрипачь ==> скрипач
-                    token0 = token[:-1]
-                    if self.is_known_word(token0):
-                        token2 = token0
-
-                elif re.search(r'^\w{2,}чём$', token, flags=re.I):
-                    # лучём ==> лучом
-                    token0 = re.sub(r'^(\w{2,})чём$', '\\1чом', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w*[бвгджзклмнпрстфхцчшщ]ъ[аеёиоуыэюя]\w*$', token, flags=re.I):
-                    # пъедестала ==> пьедестала
-                    token0 = re.sub(r'^(\w*[бвгджзклмнпрстфхцчшщ])ъ([аеёиоуыэюя]\w*)$', '\\1ь\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w*чё\w*$', token, flags=re.I):
-                    # девчёночка ==> девчоночка
-                    token0 = re.sub(r'^(\w*)чё(\w*)$', '\\1чо\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+[бвгджзклмнпрстфхцчшщ]ъ$', token, flags=re.I):
-                    if token.lower() not in ('азъ',):
-                        # пылъ ==> пыль
-                        token0 = token[:-1] + 'ь'
-                        if self.is_known_word(token0):
-                            token2 = token0
-                            if token[0].lower() != token[0]:
-                                token2 = token2[0].upper() + token2[1:]
-                        else:
-                            # крикъ ==> крик
-                            token0 = token[:-1]
-                            if self.is_known_word(token0):
-                                token2 = token0
-                                if token[0].lower() != token[0]:
-                                    token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^обь[аеёиоуыэюя]\w+$', token, flags=re.I):
-                    # обьяснять ==> объяснять
-                    token0 = re.sub(r'^обь([аеёиоуыэюя]\w+)$', 'объ\\1', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search('[3a-zëáóúόéýќўú]', token, flags=re.I) is not None and re.search('[абвгдеёжзийклмнопрстуфхцчшщъыьэюя]', token, flags=re.I) is not None:
-                    # В слове смешана латиница и кириллица.
-                    token0 = restore_cyrillic(token)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^изч[аеёиоуыэюя]\w+$', token, flags=re.I):
-                    # изчезать ==> исчезать
-                    token0 = re.sub(r'^из(ч[аеёиоуыэюя]\w+)$', 'ис\\1', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^здав\w+$', token, flags=re.I):
-                    # здаваться ==> сдаваться
-                    token0 = re.sub(r'^з(дав\w+)$', 'с\\1', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w*зп\w+$', token, flags=re.I):
-                    # изподлобья ==> исподлобья
-                    token0 = re.sub(r'^(\w*)зп(\w+)$', '\\1сп\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+шол$', token, flags=re.I):
-                    # прошол ==> прошёл
-                    token0 = re.sub(r'^(\w+)шол$', '\\1шёл', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+щём$', token, flags=re.I):
-                    # плющём ==> плющом
-                    token0 = re.sub(r'^(\w+)щём$', '\\1щом', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+чь[кн]\w+$', token, flags=re.I):
-                    # ночькой ==> ночкой
-                    token0 = re.sub(r'^(\w+ч)ь([кн]\w+)$', '\\1\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'\w+ч[бвгджзклмнпрстфхц]\w*', token, flags=re.I):
-                    # улетучтесь ==> улетучьтесь
-                    token0 = re.sub(r'(\w+ч)([бвгджзклмнпрстфхц]\w*)', '\\1ь\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+вся$', token, flags=re.I):
-                    # слався ==> славься
-                    token0 = re.sub(r'^(\w+)вся$', '\\1вься', token, flags=re.I)
-                    if self.is_known_word(token0) and self.is_verb(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+вте$', token, flags=re.I):
-                    # представте ==> представьте
-                    token0 = re.sub(r'^(\w+)вте$', '\\1вьте', token, flags=re.I)
-                    if self.is_known_word(token0) and self.is_verb(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+втесь$', token, flags=re.I):
-                    # представтесь ==> представьтесь
-                    token0 = re.sub(r'^(\w+)втесь$', '\\1вьтесь', token, flags=re.I)
-                    if self.is_known_word(token0) and self.is_verb(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'щю', token, flags=re.I):
-                    # грущю ==> грущу
-                    token0 = re.sub(r'^(\w*)щю(\w*)$', '\\1щу\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search('чю', token, flags=re.I):
-                    # канючю ==> канючу
-                    token0 = re.sub('чю', 'чу', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search('чь[бвгджзклмнпрстфх]', token, flags=re.I):
-                    # мечьтах ==> мечтах
-                    token0 = re.sub('чь([бвгджзклмнпрстфх])', 'ч\\1', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search('чор', token, flags=re.I):
-                    # чорный ==> чёрный
-                    token0 = re.sub('чор', 'чёр', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search('щя', token, flags=re.I):
-                    # обращяя ==> обращая
-                    token0 = re.sub('щя', 'ща', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search('щк', token, flags=re.I):
-                    # зайчищки ==> зайчишки
-                    token0 = re.sub('щк', 'шк', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search('чя', token, flags=re.I):
-                    # мелочях ==> мелочах
-                    token0 = re.sub('чя', 'ча', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search('[щч]ь[н]', token, flags=re.I):
-                    # мощьный ==> мощный
-                    token0 = re.sub('([щч])ь([н])', '\\1\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.match('^зб\w+$', token, flags=re.I):
-                    # збудутся ==> сбудутся
-                    token0 = 'с'+token[1:]
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+жь$', token, flags=re.I):
-                    # грабёжь ==> грабёж
-                    token0 = re.sub(r'^(\w+ж)ь$', '\\1', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^\w+чен\w+$', token, flags=re.I):
-                    # рученками ==> ручонками
-                    token0 = re.sub(r'^(\w+)че(н\w+)$', '\\1чо\\2', token, flags=re.I)
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^(воз|вз|из|низ|раз|без|чрез|через)([кптхчцшщфс]\w+)$', token, flags=re.I):
-                    # безсмертие ==> бессмертие
-                    m = re.match(r'^(воз|вз|из|низ|раз|без|чрез|через)([кптхчцшщфс]\w+)$', token, flags=re.I)
-                    prefix = m.group(1).replace('з', 'с')
-                    token0 = prefix + m.group(2)
-                    #print('DEBUG@2494 token={} token0={}'.format(token, token0))
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif re.search(r'^(вос|вс|ис|нис|рас|бес|чрес|черес)([бвгджз]\w+)$', token, flags=re.I):
-                    # всдыхая ==> вздыхая
-                    m = re.match(r'^(вос|вс|ис|нис|рас|бес|чрес|черес)([бвгджз]\w+)$', token, flags=re.I)
-                    prefix = m.group(1).replace('с', 'з')
-                    token0 = prefix + m.group(2)
-                    #print('DEBUG@2508 token={} token0={}'.format(token, token0))
-                    if self.is_known_word(token0):
-                        token2 = token0
-                        if token[0].lower() != token[0]:
-                            token2 = token2[0].upper() + token2[1:]
-                elif self.norwig_spell is not None and len(token) >= 7 and re.match(r'^\w+$', token):
-                    # Пробуем заменить длинное слово по словарю
-                    token3 = self.norwig_spell.correction(token.lower())
-                    if token3:
-                        if token[0].lower() != token[0]:
-                            token3 = token3[0].upper() + token3[1:]
-                        if token3 != token:
-                            token2 = token3
-
-                if token2:
-                    fixups.append((token, token2))
-                    text2 = re.sub(r'\b' + token + r'\b', token2, text2)
-
-            if False:
-                # Подлежащее отделено от сказуемого запятой
-                # А я, хочу встречать рассветы.
-                for text3, left, sbj_str in re.findall(r'[.?!^]\n((.*)\b(я|ты|мы|вы), .+[.?!])', text2, flags=re.I):
-                    bad_str = text3
-                    new_str = text3.replace(sbj_str + ',', sbj_str)
-                    parsing = self.parser.parse_text(text3)[0]
-
-                    sbj = None
+        for stage, fix_stage in self.fix_stages():
+            if stage == 'tokens' and token_spans is not None and text2 == text:
+                text2 = self.fix_tokens(text2, fixups, token_spans)
+            else:
+                text2 = fix_stage(text2, fixups)
+
+        if False:
+            # Подлежащее отделено от сказуемого запятой
+            # А я, хочу встречать рассветы.
+            for text3, left, sbj_str in re.findall(r'[.?!^]\n((.*)\b(я|ты|мы|вы), .+[.?!])', text2, flags=re.I):
+                bad_str = text3
+                new_str = text3.replace(sbj_str + ',', sbj_str)
+                parsing = self.parser.parse_text(text3)[0]
+
+                sbj = None
+                for t in parsing:
+                    if t.form == sbj_str:
+                        sbj = t
+                        break
+
+                # слева от подлежащего есть глагол?
+                if sbj:
+                    bad_case = False
                     for t in parsing:
-                        if t.form == sbj_str:
-                            sbj = t
+                        if t.upos == 'VERB' and t.get_attr('VerbForm') in ['Inf', 'Fin'] and int(t.id) < int(sbj.id):
+                            bad_case = True
+                            break
+                        elif t.form == sbj_str:
                             break
 
-                    # слева от подлежащего есть глагол?
-                    if sbj:
-                        bad_case = False
+                    if not bad_case:
+                        # Справа от подлежащего есть глагольное сказуемое?
                         for t in parsing:
-                            if t.upos == 'VERB' and t.get_attr('VerbForm') in ['Inf', 'Fin'] and int(t.id) < int(sbj.id):
-                                bad_case = True
+                            if t.upos == 'VERB' and t.get_attr('VerbForm') == 'Fin' and t.deprel == 'root' and sbj.head == t.id:
+                                # Можем удалить запятую после подлежащего
+                                fixups.append((bad_str, new_str))
+                                text2 = re.sub(bad_str, new_str, text2)
                                 break
-                            elif t.form == sbj_str:
-                                break
-
-                        if not bad_case:
-                            # Справа от подлежащего есть глагольное сказуемое?
-                            for t in parsing:
-                                if t.upos == 'VERB' and t.get_attr('VerbForm') == 'Fin' and t.deprel == 'root' and sbj.head == t.id:
-                                    # Можем удалить запятую после подлежащего
-                                    fixups.append((bad_str, new_str))
-                                    text2 = re.sub(bad_str, new_str, text2)
-                                    break
 
         return text2, fixups
 
@@ -1174,6 +845,21 @@ if __name__ == '__main__':
     assert(new_text=='заскучаешь')
     print(new_text)
 
+    # Числа не должны превращаться в слова правилом 0→о
+    for text in ['70% VII', '100%', 'В 1990г.']:
+        assert(schecker.fix(text)[0] == text)
+    assert(schecker.fix('п0д окном')[0] == 'под окном')
+
+    # Фразовые замены: регистр первой буквы выбирается для каждого совпадения отдельно
+    fixups = []
+    assert(schecker.fix_repl_rx('Однокласники и однокласницы', fixups) == 'Одноклассники и одноклассницы')
+    assert([(fixup.start, fixup.rule) for fixup in fixups] == [(0, 'repl_rx'), (15, 'repl_rx')])
+
+    # Апостроф убирается во всех словах, а не только в первом найденном
+    fixups = []
+    assert(schecker.fix_apostrophe('П’од мостом и п’од окном', fixups) == 'Под мостом и под окном')
+    assert(fixups == [('П’од', 'Под'), ('п’од', 'под')] and fixups[1].start == 14)
+
     r = schecker.is_known_word('ещё')
     assert(r is True)
 
@@ -0,0 +1,177 @@
+"""
+Клиент для spellcheck_server.py и нагрузочный тест.
+
+    from spellcheck_client import SpellcheckClient
+
+    client = SpellcheckClient(port=8090)  # или SpellcheckClient(unix_socket='/tmp/spellcheck.sock')
+    fixed_text, fixups = client.fix('Вмести в себя все от кровенья мира')
+
+Нагрузочный тест: --concurrency потоков, у каждого свое соединение, отправляют тексты из --input
+(по одному на строку, без --input - встроенные примеры) в течение --duration секунд. В конце выводятся
+число запросов в секунду, перцентили задержки на стороне клиента, число отказов 503 и /metrics сервера:
+
+    python spellcheck_client.py --port 8090 --concurrency 32 --duration 30 --input corpus.txt
+"""
+
+import argparse
+import http.client
+import json
+import socket
+import sys
+import threading
+import time
+
+from latency_stats import percentiles_ms
+
+
+SAMPLE_TEXTS = ['Вмести в себя все от кровенья мира',
+                'Ты дождевик одень ка.',
+                'Кому - то повезло, а мне нет.',
+                'Мы-же ни к кому не лезли.',
+                'за скучаешь',
+                'В лесу родилась ёлочка, в лесу она росла.',
+                'Зимой и летом стройная, зелёная была.',
+                'Чак Hоррис никогда не спит. Он ждет.',
+                ]
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ServiceUnavailable(Exception):
+    """Очередь сервера заполнена (503), запрос можно повторить позже."""
+    pass
+
+
+class SpellcheckClient(object):
+    """Одно keep-alive соединение с сервером; объект не рассчитан на использование из нескольких потоков."""
+    def __init__(self, host='127.0.0.1', port=8090, unix_socket=None, timeout=60.0):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+        self.connection = None
+
+    def connect(self):
+        if self.unix_socket:
+            return UnixHTTPConnection(self.unix_socket, self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, payload=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json; charset=utf-8'} if body is not None else {}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self.connect()
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # Сервер закрыл keep-alive соединение - переподключаемся один раз.
+                self.close()
+                if attempt == 1:
+                    raise
+
+        if response.status == 503:
+            raise ServiceUnavailable(data.decode('utf-8'))
+        if response.status != 200:
+            raise RuntimeError('{} {}: {}'.format(response.status, response.reason, data.decode('utf-8')))
+        return json.loads(data)
+
+    def fix(self, text):
+        """Пара (исправленный текст, fixups), как у PoeticSpellchecker.fix()."""
+        result = self.request('POST', '/fix', {'text': text})
+        return result['fixed_text'], result['fixups']
+
+    def fix_many(self, texts):
+        """Список пар (исправленный текст, fixups); для текстов, на которых сервер упал, вместо пары - None."""
+        return [(result['fixed_text'], result['fixups']) if 'error' not in result else None
+                for result in self.request('POST', '/fix', {'texts': texts})['results']]
+
+    def metrics(self):
+        return self.request('GET', '/metrics')
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def load_test(make_client, texts, concurrency, duration):
+    """Словарь с числом запросов, отказов, ошибок и задержками в миллисекундах."""
+    latencies = []
+    counters = {'requests': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(iworker):
+        client = make_client()
+        my_latencies = []
+        my_counters = dict.fromkeys(counters, 0)
+        i = iworker
+        while time.perf_counter() < stop_at:
+            text = texts[i % len(texts)]
+            i += concurrency
+            started = time.perf_counter()
+            try:
+                client.fix(text)
+                my_latencies.append(time.perf_counter() - started)
+                my_counters['requests'] += 1
+            except ServiceUnavailable:
+                my_counters['rejected'] += 1
+                time.sleep(0.01)
+            except Exception:
+                my_counters['errors'] += 1
+        client.close()
+
+        with lock:
+            latencies.extend(my_latencies)
+            for name, value in my_counters.items():
+                counters[name] += value
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    report = dict(counters)
+    report['requests_per_s'] = round(counters['requests'] / elapsed, 1)
+    report['latency_ms'] = percentiles_ms(latencies)
+    return report
+
+
+if __name__ == '__main__':
+    proggy = argparse.ArgumentParser(description='Load test for spellcheck_server.py')
+    proggy.add_argument('--host', type=str, default='127.0.0.1')
+    proggy.add_argument('--port', type=int, default=8090)
+    proggy.add_argument('--unix_socket', type=str, default=None)
+    proggy.add_argument('--input', type=str, default=None, help='text file with one text per line')
+    proggy.add_argument('--concurrency', type=int, default=16, help='number of client threads, each with its own connection')
+    proggy.add_argument('--duration', type=float, default=10.0, help='seconds')
+    args = proggy.parse_args()
+
+    if args.input:
+        with open(args.input, encoding='utf-8') as rdr:
+            texts = [line.rstrip('\n') for line in rdr if line.strip()]
+    else:
+        texts = SAMPLE_TEXTS
+
+    make_client = lambda: SpellcheckClient(args.host, args.port, args.unix_socket)
+    report = load_test(make_client, texts, args.concurrency, args.duration)
+    report['server'] = make_client().metrics()
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
@@ -0,0 +1,326 @@
+"""
+Исправление большого корпуса текстов в несколько процессов.
+
+Входной файл - либо обычный текст (одна запись на строку), либо JSONL с текстом в поле --text_field.
+Записи раздаются пулу процессов, в каждом из которых один раз загружается PoeticSpellchecker.
+Результат пишется в JSONL: для каждой записи исходные поля плюс fixed_text и fixups
+(список [было, стало, start, end, правило]), либо, с --output_format text, только исправленный текст.
+
+Пример:
+    python spellcheck_corpus.py --input corpus.jsonl --output fixed.jsonl --data_dir ./data --workers 8
+
+Скорость обработки (записей в секунду и MB/s) периодически выводится в stderr.
+
+С --vocab_first файл читается дважды. Первый проход собирает словарь токенов корпуса с частотами,
+и каждый уникальный незнакомый токен исправляется один раз (пословные правила fix_token, параллельно
+в пуле процессов). Найденные исправления один раз записываются в отображаемые в память таблицы во временном
+каталоге, и процессы второго прохода открывают их по пути, а не получают копию словаря. Второй проход исправляет записи как обычно, но токены из этого словаря уже не проходят
+через пословные правила, поэтому их стоимость зависит от размера словаря, а не корпуса. Фразовые правила
+по-прежнему работают для каждой записи, результат не отличается от обычного режима.
+
+С --fix_cache результаты fix() сохраняются в sqlite-файле и переиспользуются при следующих прогонах.
+Записи, сделанные со старыми словарями, удаляются из него только с --purge_fix_cache.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from mmap_dict import MappedStringTable, write_string_table, encode_key
+from spellcheck import PoeticSpellchecker
+
+
+schecker = None
+
+
+class MappedCorrections(object):
+    """
+    Исправления токенов из первого прохода --vocab_first в файлах MappedStringTable.
+    tokens.sst - разобранные токены, значение 0 для токенов без исправления, иначе 1 + номер строки в targets.sst;
+    targets.sst - строки "исправление<TAB>правило".
+    get() ведет себя как get у словаря токен => (исправление, правило).
+    """
+    TOKENS_FILE = 'tokens.sst'
+    TARGETS_FILE = 'targets.sst'
+
+    def __init__(self, dir_path):
+        self.tokens = MappedStringTable(os.path.join(dir_path, MappedCorrections.TOKENS_FILE))
+        self.targets = MappedStringTable(os.path.join(dir_path, MappedCorrections.TARGETS_FILE))
+
+    @staticmethod
+    def write(dir_path, corrections):
+        targets = sorted(set(token2 + '\t' + rule for token2, rule in corrections.values() if token2), key=encode_key)
+        target2id = dict((target, i) for i, target in enumerate(targets))
+        write_string_table(os.path.join(dir_path, MappedCorrections.TARGETS_FILE), targets)
+        write_string_table(os.path.join(dir_path, MappedCorrections.TOKENS_FILE), corrections.keys(),
+                           dict((token, 1 + target2id[token2 + '\t' + rule]) for token, (token2, rule) in corrections.items() if token2))
+
+    def get(self, token, default=None):
+        value = self.tokens.get(token)
+        if value is None:
+            return default
+        if value == 0:
+            return None, None
+        token2, rule = self.targets.key(value - 1).split('\t')
+        return token2, rule
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def close(self):
+        self.tokens.close()
+        self.targets.close()
+
+
+def init_worker(data_dir, models_dir, fix_cache_path, token_cache_size, prescreen=True, corrections_dir=None):
+    # Словари загружаются один раз на процесс, а не на каждую запись.
+    global schecker
+
+    parser = None
+    if models_dir:
+        from udpipe_parser import UdpipeParser
+        parser = UdpipeParser()
+        parser.load(models_dir)
+
+    schecker = PoeticSpellchecker(parser, token_cache_size=token_cache_size, prescreen=prescreen)
+    schecker.load(data_dir)
+    if fix_cache_path:
+        schecker.open_fix_cache(fix_cache_path)
+    if corrections_dir:
+        schecker.token_corrections = MappedCorrections(corrections_dir)
+
+
+def purge_fix_cache(data_dir, fix_cache_path):
+    """Удаляет из кэша fix() записи, сделанные не с текущими словарями из data_dir."""
+    checker = PoeticSpellchecker(None)
+    checker.load(data_dir)
+    checker.open_fix_cache(fix_cache_path)
+    deleted = checker.fix_cache.purge()
+    checker.fix_cache.close()
+    print('Fix cache: {} stale entries deleted'.format(deleted), file=sys.stderr, flush=True)
+
+
+def serialize_fixups(fixups):
+    return [(fixup[0], fixup[1], getattr(fixup, 'start', None), getattr(fixup, 'end', None), getattr(fixup, 'rule', None))
+            for fixup in fixups]
+
+
+def process_record(item):
+    index, record, text = item
+    prescreen_clean = schecker.prescreen_clean
+    fixed_text, fixups = schecker.fix(text)
+    # Последний элемент - 1, если текст вернулся сразу после предварительной проверки.
+    return index, record, fixed_text, serialize_fixups(fixups), len(text.encode('utf-8')), schecker.prescreen_clean - prescreen_clean
+
+
+def count_tokens(texts):
+    return collections.Counter(token for text in texts for token in schecker.tokenize(text))
+
+
+def resolve_tokens(tokens):
+    return schecker.resolve_tokens(tokens)
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def build_token_corrections(args, input_format, init_args, corrections_dir):
+    """
+    Первый проход --vocab_first: словарь токенов корпуса и исправления уникальных незнакомых токенов.
+    Исправления записываются в corrections_dir в формате MappedCorrections.
+    """
+    started = time.time()
+    with open(args.input, encoding='utf-8') as input_stream:
+        texts = (text for index, record, text in read_records(input_stream, input_format, args.text_field))
+
+        if args.workers <= 1:
+            init_worker(*init_args)
+            pool = None
+            imap = map
+        else:
+            pool = multiprocessing.Pool(args.workers, initializer=init_worker, initargs=init_args)
+            imap = pool.imap_unordered
+
+        try:
+            vocab = collections.Counter()
+            for counts in imap(count_tokens, batched(texts, args.chunksize)):
+                vocab.update(counts)
+
+            # Частые токены вперед, чтобы при разбиении на пачки нагрузка распределялась ровнее.
+            token_corrections = dict()
+            for corrections in imap(resolve_tokens, batched((token for token, count in vocab.most_common()), args.vocab_chunksize)):
+                token_corrections.update(corrections)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    MappedCorrections.write(corrections_dir, token_corrections)
+    nfixed = sum(1 for token2, rule in token_corrections.values() if token2)
+    print('Vocabulary: {} tokens, {} unique, {} unknown resolved, {} corrected in {:.1f} s'.format(sum(vocab.values()), len(vocab),
+                                                                                              len(token_corrections), nfixed,
+                                                                                              time.time() - started),
+          file=sys.stderr, flush=True)
+
+
+def read_records(input_stream, input_format, text_field):
+    """Выдает тройки (номер записи, запись, текст для исправления)."""
+    for index, line in enumerate(input_stream):
+        line = line.rstrip('\n')
+        if input_format == 'jsonl':
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield index, record, record[text_field]
+        else:
+            yield index, {'text': line}, line
+
+
+def format_result(result, output_format, ordered):
+    index, record, fixed_text, fixups = result[:4]
+    if output_format == 'text':
+        return fixed_text
+
+    out = dict(record)
+    if not ordered:
+        # При неупорядоченном выводе номер записи позволяет восстановить исходный порядок.
+        out['index'] = index
+    out['fixed_text'] = fixed_text
+    out['fixups'] = fixups
+    return json.dumps(out, ensure_ascii=False)
+
+
+class Throughput(object):
+    """
+    Счетчики обработанных записей и байтов с периодическим выводом скорости в stderr.
+    С prescreen выводится еще доля записей, которые needs_fixing() признала чистыми.
+    """
+    def __init__(self, report_every, prescreen=False):
+        self.report_every = report_every
+        self.prescreen = prescreen
+        self.started = time.time()
+        self.last_report = self.started
+        self.records = 0
+        self.nbytes = 0
+        self.prescreen_clean = 0
+
+    def update(self, nbytes, prescreen_clean=0):
+        self.records += 1
+        self.nbytes += nbytes
+        self.prescreen_clean += prescreen_clean
+        now = time.time()
+        if now - self.last_report >= self.report_every:
+            self.last_report = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.time() - self.started, 1e-9)
+        prescreen = ''
+        if self.prescreen:
+            prescreen = ', prescreen hit rate {:.1%}'.format(self.prescreen_clean / self.records if self.records else 0.0)
+        print('{}{} records, {:.1f} MB in {:.1f} s: {:.1f} records/s, {:.2f} MB/s{}'.format('Done: ' if final else '',
+                                                                                        self.records, self.nbytes / 1e6, elapsed,
+                                                                                        self.records / elapsed, self.nbytes / 1e6 / elapsed,
+                                                                                        prescreen),
+              file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    proggy = argparse.ArgumentParser(description='Spellcheck a text or JSONL corpus with a pool of worker processes')
+    proggy.add_argument('--input', type=str, default='-', help='input file, "-" for stdin')
+    proggy.add_argument('--output', type=str, default='-', help='output file, "-" for stdout')
+    proggy.add_argument('--input_format', choices=['auto', 'text', 'jsonl'], default='auto', help='"auto" selects jsonl for *.jsonl files')
+    proggy.add_argument('--output_format', choices=['jsonl', 'text'], default='jsonl')
+    proggy.add_argument('--text_field', type=str, default='text', help='field with the text in JSONL records')
+    proggy.add_argument('--data_dir', type=str, default='./data', help='directory with spellcheck.pkl')
+    proggy.add_argument('--models_dir', type=str, default=None, help='directory with UDPipe models; the parser is not loaded if omitted')
+    proggy.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    proggy.add_argument('--chunksize', type=int, default=64, help='records sent to a worker at once')
+    proggy.add_argument('--unordered', action='store_true', help='write results as soon as they are ready, with the record index')
+    proggy.add_argument('--fix_cache', type=str, default=None, help='sqlite file for the persistent cache of fix() results')
+    proggy.add_argument('--purge_fix_cache', action='store_true', help='delete entries made with other dictionaries from --fix_cache before processing')
+    proggy.add_argument('--token_cache_size', type=int, default=100000)
+    proggy.add_argument('--no_prescreen', action='store_true', help='do not run the needs_fixing() check before fix(); faster when few texts are clean')
+    proggy.add_argument('--report_every', type=float, default=10.0, help='seconds between throughput reports')
+    proggy.add_argument('--vocab_first', action='store_true', help='resolve unique unknown tokens of the whole input once, then fix the records')
+    proggy.add_argument('--vocab_chunksize', type=int, default=2000, help='unique tokens sent to a worker at once in --vocab_first mode')
+    args = proggy.parse_args()
+
+    input_format = args.input_format
+    if input_format == 'auto':
+        input_format = 'jsonl' if args.input.endswith('.jsonl') else 'text'
+
+    if args.output_format == 'text' and args.unordered:
+        proggy.error('--unordered requires --output_format jsonl, plain text output has no record indices')
+
+    if args.vocab_first and args.input == '-':
+        proggy.error('--vocab_first reads the input twice and requires --input file')
+
+    if args.purge_fix_cache and not args.fix_cache:
+        proggy.error('--purge_fix_cache requires --fix_cache')
+
+    input_stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    output_stream = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+
+    if args.purge_fix_cache:
+        purge_fix_cache(args.data_dir, args.fix_cache)
+
+    init_args = (args.data_dir, args.models_dir, args.fix_cache, args.token_cache_size, not args.no_prescreen)
+    corrections_dir = None
+    if args.vocab_first:
+        # Процессам второго прохода передается только путь к таблицам исправлений, сами таблицы
+        # отображаются в память и делятся между процессами через page cache.
+        corrections_dir = tempfile.mkdtemp(prefix='spellcheck_vocab_')
+        try:
+            build_token_corrections(args, input_format, init_args, corrections_dir)
+        except BaseException:
+            shutil.rmtree(corrections_dir, ignore_errors=True)
+            raise
+        init_args += (corrections_dir,)
+
+    throughput = Throughput(args.report_every, prescreen=not args.no_prescreen)
+    records = read_records(input_stream, input_format, args.text_field)
+
+    if args.workers <= 1:
+        # Без пула удобнее отлаживать.
+        init_worker(*init_args)
+        results = map(process_record, records)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker, initargs=init_args)
+        if args.unordered:
+            results = pool.imap_unordered(process_record, records, chunksize=args.chunksize)
+        else:
+            results = pool.imap(process_record, records, chunksize=args.chunksize)
+
+    try:
+        for result in results:
+            output_stream.write(format_result(result, args.output_format, not args.unordered))
+            output_stream.write('\n')
+            throughput.update(result[4], result[5])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if corrections_dir is not None:
+            shutil.rmtree(corrections_dir, ignore_errors=True)
+
+    throughput.report(final=True)
+
+    if output_stream is not sys.stdout:
+        output_stream.close()
+    if input_stream is not sys.stdin:
+        input_stream.close()
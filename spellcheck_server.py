@@ -0,0 +1,406 @@
+"""
+Спеллчекер как локальный сервис: пул процессов с загруженными словарями и asyncio-сервер перед ними.
+
+Клиенты не платят за load() при каждом запуске: словари загружаются один раз в каждом процессе пула
+при старте сервера. Запросы принимаются по HTTP на TCP-порту или на unix-сокете, складываются в очередь
+и собираются в пачки: пачка уходит в свободный процесс, когда в ней набралось --batch_size текстов или
+с первого запроса в ней прошло --batch_window_ms миллисекунд. Пока все процессы заняты, новые пачки
+не отправляются и запросы копятся в очереди; если в очереди уже --max_queue запросов, сервер сразу
+отвечает 503, и клиент может повторить запрос позже. Если процесс пула погиб (например, его убил OOM killer),
+запросы из незавершенных пачек получают 500, а пул пересоздается.
+
+Запуск:
+    python spellcheck_server.py --data_dir ./data --port 8090 --workers 8
+    python spellcheck_server.py --data_dir ./data --unix_socket /tmp/spellcheck.sock
+
+Методы:
+    POST /fix       {"text": "..."} => {"fixed_text": "...", "fixups": [[было, стало, start, end, правило], ...]}
+                    {"texts": ["...", ...]} => {"results": [{"fixed_text": ..., "fixups": ...}, ...]}
+                    если на каком-то тексте fix() упал, вместо его результата - {"error": "..."},
+                    а запрос с одним текстом получает 500
+    GET /metrics    счетчики запросов, размер очереди и пачек, перцентили задержки, доля текстов,
+                    которые вернула сразу предварительная проверка (prescreen_hit_rate), число пересозданий пула
+    GET /health     {"status": "ok"}
+
+Клиент и нагрузочный тест - spellcheck_client.py.
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import spellcheck_corpus
+from spellcheck_corpus import init_worker, serialize_fixups
+from latency_stats import percentiles_ms
+
+
+def fix_batch(texts):
+    # Выполняется в процессе пула, словари загружены в spellcheck_corpus.init_worker.
+    # Ошибка на одном тексте не должна ронять остальные запросы пачки, поэтому для каждого текста
+    # возвращается тройка (исправленный текст, fixups, None) или (None, None, сообщение об ошибке).
+    # Вместе с результатами - сколько текстов пачки вернула сразу предварительная проверка.
+    prescreen_clean = spellcheck_corpus.schecker.prescreen_clean
+    results = []
+    for text in texts:
+        try:
+            fixed_text, fixups = spellcheck_corpus.schecker.fix(text)
+            results.append((fixed_text, serialize_fixups(fixups), None))
+        except Exception as ex:
+            results.append((None, None, '{}: {}'.format(type(ex).__name__, ex)))
+    return results, spellcheck_corpus.schecker.prescreen_clean - prescreen_clean
+
+
+def warmup(delay):
+    # Задача выполняется только после init_worker, пауза не дает одному процессу забрать все задачи прогрева.
+    time.sleep(delay)
+    return os.getpid()
+
+
+def make_pool(nworkers, init_args):
+    return concurrent.futures.ProcessPoolExecutor(nworkers, initializer=init_worker, initargs=init_args)
+
+
+def warmup_pool(pool, nworkers):
+    """Ждет, пока каждый из nworkers процессов пула загрузит словари."""
+    pids = set()
+    while len(pids) < nworkers:
+        pids.update(pool.map(warmup, [0.05] * nworkers))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Metrics(object):
+    """Счетчики сервера и задержки последних запросов (секунды от приема до готового ответа)."""
+    def __init__(self, window=10000):
+        self.started = time.time()
+        self.requests = 0
+        self.texts = 0
+        self.rejected = 0
+        self.errors = 0
+        self.pool_restarts = 0
+        self.prescreen_clean = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.queue_waits = collections.deque(maxlen=window)
+
+    def report(self, queue_depth, inflight):
+        latencies = sorted(self.latencies)
+        queue_waits = sorted(self.queue_waits)
+        return {'uptime_s': round(time.time() - self.started, 3),
+                'requests': self.requests,
+                'texts': self.texts,
+                'rejected': self.rejected,
+                'errors': self.errors,
+                'pool_restarts': self.pool_restarts,
+                'prescreen_hit_rate': round(self.prescreen_clean / self.batched_texts, 4) if self.batched_texts else 0.0,
+                'batches': self.batches,
+                'mean_batch_size': round(self.batched_texts / self.batches, 2) if self.batches else 0.0,
+                'queue_depth': queue_depth,
+                'inflight_batches': inflight,
+                'latency_ms': percentiles_ms(latencies),
+                'queue_wait_ms': percentiles_ms(queue_waits, [('p50', 50), ('p99', 99)]),
+                }
+
+
+class BatchingDispatcher(object):
+    """
+    Очередь запросов и сборка пачек для пула процессов.
+    pool_factory() создает новый пул, если в текущем погиб процесс и пул стал непригоден (BrokenProcessPool).
+    """
+    def __init__(self, pool, pool_factory, nworkers, batch_size, batch_window, max_queue, metrics):
+        self.pool = pool
+        self.pool_factory = pool_factory
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.metrics = metrics
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        # Не больше одной пачки на процесс: остальные запросы ждут в очереди и попадут в следующие пачки.
+        self.slots = asyncio.Semaphore(nworkers)
+        self.inflight = 0
+        self.task = None
+        # Ссылки на задачи выполняющихся пачек, чтобы их не собрал сборщик мусора.
+        self.batch_tasks = set()
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, texts):
+        """
+        Результаты fix() для texts: список троек (исправленный текст, fixups, ошибка), см. fix_batch.
+        Если очередь полна - QueueFull.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((texts, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise QueueFull()
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()
+            items = [await self.queue.get()]
+            ntexts = len(items[0][0])
+
+            # Добираем запросы в пачку, пока она не заполнится или не истечет окно с момента первого запроса.
+            # Под нагрузкой цикл событий может вернуться сюда уже после окна, поэтому сначала забираем
+            # все, что уже лежит в очереди, и только потом ждем новых запросов.
+            deadline = loop.time() + self.batch_window
+            while ntexts < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                items.append(item)
+                ntexts += len(item[0])
+
+            self.dispatch(loop, items, ntexts)
+
+    def dispatch(self, loop, items, ntexts):
+        texts = [text for item_texts, future, enqueued in items for text in item_texts]
+        now = time.perf_counter()
+        for item_texts, future, enqueued in items:
+            self.metrics.queue_waits.append(now - enqueued)
+
+        self.metrics.batches += 1
+        self.metrics.batched_texts += ntexts
+        self.inflight += 1
+
+        task = loop.create_task(self.execute(loop, items, texts))
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+
+    async def execute(self, loop, items, texts):
+        pool = self.pool
+        try:
+            results, prescreen_clean = await loop.run_in_executor(pool, fix_batch, texts)
+        except concurrent.futures.process.BrokenProcessPool as ex:
+            # Все незавершенные пачки этого пула получают ту же ошибку, пересоздает пул только первая.
+            if self.pool is pool:
+                self.restart_pool()
+            self.complete(items, None, ex)
+        except Exception as ex:
+            self.complete(items, None, ex)
+        else:
+            self.complete(items, results, None, prescreen_clean)
+
+    def restart_pool(self):
+        print('Worker process died, restarting the pool', file=sys.stderr, flush=True)
+        self.metrics.pool_restarts += 1
+        self.pool.shutdown(wait=False)
+        self.pool = self.pool_factory()
+
+    def complete(self, items, results, error, prescreen_clean=0):
+        # Ошибки отдельных текстов уже лежат в results, error - только если пачка не выполнилась целиком
+        # (например, процесс пула упал или результат не удалось передать).
+        self.inflight -= 1
+        self.slots.release()
+        self.metrics.prescreen_clean += prescreen_clean
+
+        pos = 0
+        for item_texts, future, enqueued in items:
+            if future.done():
+                # Клиент отключился и запрос отменен.
+                pos += len(item_texts)
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[pos: pos + len(item_texts)])
+            pos += len(item_texts)
+
+
+class SpellcheckServer(object):
+    def __init__(self, dispatcher, metrics, max_body):
+        self.dispatcher = dispatcher
+        self.metrics = metrics
+        self.max_body = max_body
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                if isinstance(body, int):
+                    # Вместо тела - код ошибки разбора запроса.
+                    error = 'request body is too large' if body == 413 else 'malformed request'
+                    await self.send(writer, body, {'error': error}, keep_alive=False)
+                    break
+
+                status, payload = await self.route(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self.send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """Кортеж (метод, путь, заголовки, тело) или None, если клиент закрыл соединение."""
+        headers = dict()
+        try:
+            line = await reader.readline()
+            if not line:
+                return None
+
+            parts = line.decode('latin-1').split()
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = header.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+        except (ValueError, asyncio.LimitOverrunError):
+            # Строка запроса или заголовка длиннее лимита StreamReader (64 KiB).
+            return None, None, headers, 400
+
+        if len(parts) != 3:
+            return None, None, headers, 400
+
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            return parts[0], parts[1], headers, 400
+        if length < 0:
+            return parts[0], parts[1], headers, 400
+        if length > self.max_body:
+            return parts[0], parts[1], headers, 413
+
+        body = await reader.readexactly(length) if length else b''
+        return parts[0], parts[1], headers, body
+
+    async def route(self, method, path, body):
+        path = path.split('?', 1)[0]
+        if path == '/metrics' and method == 'GET':
+            return 200, self.metrics.report(self.dispatcher.queue.qsize(), self.dispatcher.inflight)
+        elif path == '/health' and method == 'GET':
+            return 200, {'status': 'ok'}
+        elif path == '/fix' and method == 'POST':
+            return await self.fix(body)
+        else:
+            return 404, {'error': 'not found'}
+
+    async def fix(self, body):
+        started = time.perf_counter()
+        try:
+            request = json.loads(body)
+            texts = request['texts'] if 'texts' in request else [request['text']]
+            if not all(isinstance(text, str) for text in texts):
+                raise ValueError(texts)
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'expected {"text": "..."} or {"texts": ["...", ...]}'}
+
+        self.metrics.requests += 1
+        self.metrics.texts += len(texts)
+        try:
+            results = await self.dispatcher.submit(texts)
+        except QueueFull:
+            self.metrics.rejected += 1
+            return 503, {'error': 'queue is full, retry later'}
+        except Exception as ex:
+            self.metrics.errors += 1
+            return 500, {'error': str(ex)}
+
+        self.metrics.latencies.append(time.perf_counter() - started)
+
+        items = []
+        for fixed_text, fixups, error in results:
+            if error is None:
+                items.append({'fixed_text': fixed_text, 'fixups': fixups})
+            else:
+                self.metrics.errors += 1
+                items.append({'error': error})
+
+        if 'texts' in request:
+            return 200, {'results': items}
+        if 'error' in items[0]:
+            return 500, items[0]
+        return 200, items[0]
+
+    async def send(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+                  500: 'Internal Server Error', 503: 'Service Unavailable'}[status]
+        head = ['HTTP/1.1 {} {}'.format(status, reason),
+                'Content-Type: application/json; charset=utf-8',
+                'Content-Length: {}'.format(len(body)),
+                'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+        if status == 503:
+            head.append('Retry-After: 1')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(args, pool, pool_factory):
+    metrics = Metrics()
+    dispatcher = BatchingDispatcher(pool, pool_factory, args.workers, args.batch_size, args.batch_window_ms / 1000.0, args.max_queue, metrics)
+    dispatcher.start()
+    server = SpellcheckServer(dispatcher, metrics, args.max_body)
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        listener = await asyncio.start_unix_server(server.handle_connection, path=args.unix_socket)
+        address = args.unix_socket
+    else:
+        listener = await asyncio.start_server(server.handle_connection, host=args.host, port=args.port)
+        address = '{}:{}'.format(args.host, args.port)
+
+    print('Listening on {} with {} workers'.format(address, args.workers), file=sys.stderr, flush=True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        dispatcher.pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+    proggy = argparse.ArgumentParser(description='Spellchecking service with a pool of preloaded workers')
+    proggy.add_argument('--host', type=str, default='127.0.0.1')
+    proggy.add_argument('--port', type=int, default=8090)
+    proggy.add_argument('--unix_socket', type=str, default=None, help='listen on a unix socket instead of the TCP port')
+    proggy.add_argument('--data_dir', type=str, default='./data', help='directory with spellcheck.pkl')
+    proggy.add_argument('--models_dir', type=str, default=None, help='directory with UDPipe models; the parser is not loaded if omitted')
+    proggy.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    proggy.add_argument('--batch_size', type=int, default=32, help='maximum number of texts in a batch')
+    proggy.add_argument('--batch_window_ms', type=float, default=5.0, help='how long a batch waits for more requests')
+    proggy.add_argument('--max_queue', type=int, default=1000, help='queued requests above this limit are rejected with 503')
+    proggy.add_argument('--max_body', type=int, default=1 << 20, help='maximum request size in bytes')
+    proggy.add_argument('--fix_cache', type=str, default=None, help='sqlite file for the persistent cache of fix() results')
+    proggy.add_argument('--token_cache_size', type=int, default=100000)
+    proggy.add_argument('--no_prescreen', action='store_true', help='do not run the needs_fixing() check before fix()')
+    args = proggy.parse_args()
+
+    init_args = (args.data_dir, args.models_dir, args.fix_cache, args.token_cache_size, not args.no_prescreen)
+    pool = make_pool(args.workers, init_args)
+
+    # Процессы пула загружают словари параллельно; принимать запросы начинаем, когда готовы все.
+    started = time.time()
+    warmup_pool(pool, args.workers)
+    print('Dictionaries loaded in {:.1f} s'.format(time.time() - started), file=sys.stderr, flush=True)
+
+    try:
+        asyncio.run(serve(args, pool, lambda: make_pool(args.workers, init_args)))
+    except KeyboardInterrupt:
+        pass
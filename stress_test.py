@@ -0,0 +1,170 @@
+"""
+Проверка токенизатора и спеллчекера на патологических входных данных.
+
+Кусок base64, строка из 50 тысяч букв или тысячи одинаковых "слово-ли" подряд не должны
+приводить к квадратичному (или хуже) времени работы регулярок. Скрипт прогоняет такие тексты
+разной длины и проверяет, что время на символ не превышает заданной границы и не растет с длиной текста.
+
+Только токенизатор:
+    python stress_test.py
+
+Токенизатор и fix() со словарями из ./data:
+    python stress_test.py --data_dir ./data
+"""
+
+import argparse
+import base64
+import random
+import sys
+import time
+
+from tokenization_utils import tokenize_fast
+
+
+# Генераторы текстов длиной около n символов.
+PATHOLOGICAL_INPUTS = {
+    'cyrillic_run': lambda n: 'а' * n,
+    'latin_run': lambda n: 'a' * n,
+    'digits_run': lambda n: '1' * n + 'а',
+    'word_run_with_tail': lambda n: 'бьа' * (n // 3) + '*',
+    'ch_consonant_run': lambda n: 'аач' + 'б' * n + '1',
+    'base64': lambda n: base64.b64encode(random.Random(n).randbytes(n * 3 // 4)).decode(),
+    'spaces': lambda n: 'а' + ' ' * n + 'б',
+    'hyphens': lambda n: 'аб-' * (n // 3),
+    'slashes': lambda n: 'а/' * (n // 2) + '*',
+    'pipes': lambda n: 'а|' * (n // 2),
+    'quotes': lambda n: "'" * n,
+    'parens': lambda n: 'а(а)' * (n // 4),
+    'dots': lambda n: 'т.' * (n // 2),
+    'newlines': lambda n: '.\n' * (n // 2),
+    'homoglyphs': lambda n: 'аaб' * (n // 3),
+    'latin_words': lambda n: 'a ' * (n // 2),
+    'particle_ka': lambda n: 'а ка ' * (n // 5),
+    'particle_li': lambda n: 'а-ли ' * (n // 5),
+    'particle_by': lambda n: 'а' + ' ' * n + '-б',
+    'particle_to': lambda n: 'а - то ' * (n // 6),
+    'po_hyphen': lambda n: 'по - ' * (n // 5),
+    'special_tokens': lambda n: 'кое ' * (n // 4),
+}
+
+FUZZ_ALPHABET = list("абвгдкоеячтсмшщъьaoc6-. ,|/'!?\n*’") + ['кое о чём', 'т. д.', 'по-', 'ка', 'ли', 'бы', '🤣']
+
+
+def fuzz_text(rnd: random.Random, n: int, block_size: int = 1000) -> str:
+    # Случайный блок повторяется до нужной длины: так состав текста не зависит от длины,
+    # и время на символ для разных длин можно сравнивать.
+    chunks = []
+    size = 0
+    while size < block_size:
+        chunk = rnd.choice(FUZZ_ALPHABET) * rnd.choice([1, 1, 1, 50, 500])
+        chunks.append(chunk)
+        size += len(chunk)
+    block = ''.join(chunks)[:block_size]
+    return (block * (n // block_size + 1))[:n]
+
+
+def measure(func, text: str, repeats: int) -> float:
+    best = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func(text)
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def check(name: str, func, gen, sizes, max_us_per_char: float, max_growth: float, repeats: int):
+    """
+    Замеряет время func на текстах из gen для всех длин из sizes. Возвращает список нарушений:
+    время на символ для самой длинной строки больше max_us_per_char или выросло больше чем в max_growth
+    раз по сравнению с самой короткой строкой.
+    """
+    timings = []
+    for n in sizes:
+        text = gen(n)
+        timings.append((len(text), measure(func, text, repeats)))
+
+    us_per_char = [elapsed * 1e6 / max(1, n) for n, elapsed in timings]
+    print('{:<30} {}'.format(name, '  '.join('{:>7} chars {:8.2f} us/char'.format(n, u) for (n, _), u in zip(timings, us_per_char))))
+
+    errors = []
+    if us_per_char[-1] > max_us_per_char:
+        errors.append('{}: {:.2f} us/char > {:.2f}'.format(name, us_per_char[-1], max_us_per_char))
+    # Слишком короткие замеры (меньше миллисекунды) для сравнения не годятся, там одни шумы.
+    if timings[0][1] >= 1e-3 and us_per_char[-1] / us_per_char[0] > max_growth:
+        errors.append('{}: time per char grew x{:.1f} from {} to {} chars'.format(name, us_per_char[-1] / us_per_char[0], timings[0][0], timings[-1][0]))
+    return errors
+
+
+# Обычный текст без ошибок для проверки быстрого пути fix() через needs_fixing().
+CLEAN_SENTENCES = ['В лесу родилась ёлочка, в лесу она росла.', 'Зимой и летом стройная, зелёная была.',
+                   'Он открыл окно, и в комнату ворвался холодный ветер.', 'Книга лежала на столе.',
+                   'Дети играли во дворе, пока взрослые готовили ужин.', 'Она всегда говорила, что лучшее впереди.']
+
+
+def check_prescreen(schecker, repeats: int):
+    """На чистом тексте fix() с предварительной проверкой должен быть быстрее полного fix_uncached()."""
+    # Знаки препинания попадают в кэш токенов при первом исправлении, как при обработке корпуса.
+    for sentence in CLEAN_SENTENCES:
+        schecker.fix(sentence)
+    clean = [sentence for sentence in CLEAN_SENTENCES if not schecker.needs_fixing(sentence)]
+    text = ' '.join(clean) * (2000 // max(1, len(' '.join(clean))) + 1)
+    if not clean or schecker.needs_fixing(text):
+        print('prescreen: no clean text for these dictionaries, skipped')
+        return []
+
+    t_fix = measure(schecker.fix, text, repeats)
+    t_full = measure(schecker.fix_uncached, text, repeats)
+    print('{:<30} {:>7} chars  fix {:8.2f} us/char  fix_uncached {:8.2f} us/char'.format('prescreen', len(text), t_fix * 1e6 / len(text), t_full * 1e6 / len(text)))
+    if t_fix >= t_full:
+        return ['prescreen: fix() on clean text is not faster than fix_uncached(): {:.2f} ms >= {:.2f} ms'.format(t_fix * 1e3, t_full * 1e3)]
+    return []
+
+
+if __name__ == '__main__':
+    proggy = argparse.ArgumentParser(description='Stress test of the tokenizer and spellchecker on pathological inputs')
+    proggy.add_argument('--data_dir', type=str, default=None, help='directory with spellcheck.pkl; if omitted, only the tokenizer is tested')
+    proggy.add_argument('--sizes', type=str, default='2000,8000,32000', help='comma-separated text lengths')
+    proggy.add_argument('--fuzz', type=int, default=20, help='number of random fuzz texts')
+    proggy.add_argument('--seed', type=int, default=1)
+    proggy.add_argument('--repeats', type=int, default=3)
+    proggy.add_argument('--tokenizer_us_per_char', type=float, default=5.0)
+    proggy.add_argument('--fix_us_per_char', type=float, default=200.0)
+    proggy.add_argument('--max_growth', type=float, default=3.0)
+    args = proggy.parse_args()
+
+    sizes = [int(n) for n in args.sizes.split(',')]
+    rnd = random.Random(args.seed)
+    fuzz_seeds = [rnd.randrange(1 << 30) for _ in range(args.fuzz)]
+
+    inputs = list(PATHOLOGICAL_INPUTS.items())
+    for seed in fuzz_seeds:
+        inputs.append(('fuzz_{}'.format(seed), lambda n, seed=seed: fuzz_text(random.Random(seed), n)))
+
+    tested = [('tokenize', lambda text: list(tokenize_fast(text)), args.tokenizer_us_per_char)]
+
+    if args.data_dir:
+        from spellcheck import PoeticSpellchecker
+
+        schecker = PoeticSpellchecker(None)
+        schecker.load(args.data_dir)
+        tested.append(('fix', schecker.fix, args.fix_us_per_char))
+
+    errors = []
+    if args.data_dir:
+        print('\n=== prescreen ===')
+        errors.extend(check_prescreen(schecker, args.repeats))
+
+    for func_name, func, max_us_per_char in tested:
+        print('\n=== {} ==='.format(func_name))
+        for name, gen in inputs:
+            errors.extend(check(func_name + ':' + name, func, gen, sizes, max_us_per_char, args.max_growth, args.repeats))
+
+    if errors:
+        print('\nFAILED:')
+        for error in errors:
+            print(error)
+        sys.exit(1)
+
+    print('\nAll done =)')
@@ -0,0 +1,61 @@
+"""
+Правки текста в виде интервалов.
+
+Вместо того, чтобы для каждого исправления гонять re.sub по всему тексту, стадии спеллчекера
+собирают правки (start, end, replacement, rule) относительно исходной строки и применяют их
+одним проходом.
+"""
+
+
+class Fixup(tuple):
+    """
+    Элемент списка fixups: пара (было, стало), как и раньше, плюс позиция правки в тексте
+    и идентификатор сработавшего правила. Позиции отсчитываются в тексте, который обрабатывала
+    стадия, выдавшая правку (у repl_rx - в тексте перед применением правила); для стадий,
+    работающих через re.sub, они равны None.
+    """
+    def __new__(cls, old, new, start=None, end=None, rule=None):
+        fixup = tuple.__new__(cls, (old, new))
+        fixup.start = start
+        fixup.end = end
+        fixup.rule = rule
+        return fixup
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+
+def apply_edits(text: str, edits) -> str:
+    """Применяет непересекающиеся правки (start, end, replacement, rule) к тексту за один проход."""
+    if not edits:
+        return text
+
+    chunks = []
+    pos = 0
+    for start, end, replacement, rule in sorted(edits, key=lambda edit: edit[0]):
+        if start < pos:
+            # Правка накрывается предыдущей, пропускаем.
+            continue
+
+        chunks.append(text[pos:start])
+        chunks.append(replacement)
+        pos = end
+
+    chunks.append(text[pos:])
+    return ''.join(chunks)
+
+
+if __name__ == '__main__':
+    s = apply_edits('мы-же пришли ка', [(13, 15, 'ка!', 'x'), (0, 5, 'мы же', 'y')])
+    assert s == 'мы же пришли ка!'
+
+    f = Fixup('Tы', 'Ты', 0, 2, 'replaces')
+    assert f == ('Tы', 'Ты')
+    old, new = f
+    assert (old, new, f.start, f.rule) == ('Tы', 'Ты', 0, 'replaces')
+
+    import pickle
+    f2 = pickle.loads(pickle.dumps(f))
+    assert f2 == f and f2.end == 2
+
+    print('All done =)')
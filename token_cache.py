@@ -0,0 +1,89 @@
+"""
+Ограниченный LRU-кэш для исправлений отдельных токенов.
+
+Частоты слов в корпусах распределены по Ципфу, поэтому одни и те же OOV-токены встречаются
+миллионы раз, а каскад правил в PoeticSpellchecker.fix_token зависит только от строки токена
+и загруженных словарей. Кэш хранит для токена результат каскада (исправление, правило) и считает
+попадания, промахи и вытеснения. Доступ защищен блокировкой, так что один кэш можно использовать
+из нескольких потоков.
+"""
+
+import collections
+import threading
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.data.get(key, self)
+            if value is self:
+                self.misses += 1
+                return default
+
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Значение без учета в счетчиках и без изменения порядка вытеснения."""
+        with self.lock:
+            return self.data.get(key, default)
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'size': len(self.data),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / total if total else 0.0}
+
+
+if __name__ == '__main__':
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)  # вытесняет 'b', к которому обращались раньше всего
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert (None, None) == cache.get('x', (None, None))
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (2, 2, 1, 2), stats
+
+    disabled = LRUCache(maxsize=0)
+    disabled.put('a', 1)
+    assert disabled.get('a') is None and len(disabled) == 0
+
+    print('All done =)')
@@ -0,0 +1,485 @@
+"""
+Таблица пословных правил исправления для PoeticSpellchecker.fix_token.
+
+Каждое правило - это условие (gate), проверка кандидата (apply) и, если условие привязано к началу или
+концу слова, множества возможных первых и последних букв токена. Правила перечислены в порядке приоритета,
+как раньше шли ветки каскада в fix_token:
+    - независимые правила: если кандидат не прошел проверку, пробуется следующее правило;
+    - правила с exclusive=True (бывшая цепочка elif): первое правило, условие которого выполнилось,
+      решает судьбу токена, и следующие правила уже не пробуются.
+
+TokenRules.apply() не проверяет условия заведомо неподходящих правил: список правил для пары
+(первая буква, последняя буква) строится один раз и кэшируется. Так токен "заниматся" проверяется
+только правилами, которые могут сработать на слове, оканчивающемся на "я", и правилами без привязки.
+
+RuleStats считает для каждого правила проверки условия, срабатывания условия и исправления,
+а при включенном timing еще и время, потраченное на правило.
+"""
+
+import re
+import time
+
+from restore_cyrillic import restore_cyrillic
+
+
+# Только для этих символов первая и последняя буква токена надежно определяют, какие правила могут
+# сработать: для прочих символов (лигатуры, редкие варианты букв) re.I знает дополнительные соответствия
+# между регистрами, поэтому для них пробуются все правила.
+KEY_CHARS = frozenset('абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz0123456789')
+
+KNOWN = 'known'
+KNOWN_STRICT = 'known_strict'
+KNOWN_VERB = 'known_verb'
+KNOWN_VERB_NO_ALT = 'known_verb_no_alt'
+
+
+def Aa(s):
+    return s[0].upper() + s[1:]
+
+
+class Gate(object):
+    """Условие правила: регулярка, которая ищется (или сопоставляется с началом) в токене."""
+    def __init__(self, pattern, flags=re.I, method='search', lower=False):
+        rx = re.compile(pattern, flags)
+        self.test = rx.match if method == 'match' else rx.search
+        self.lower = lower
+
+    def __call__(self, schecker, token, ltoken):
+        return self.test(ltoken if self.lower else token)
+
+
+class Sub(object):
+    """Кандидат получается заменой по регулярке, проверяется по словарю и получает заглавную букву токена."""
+    def __init__(self, pattern, repl, check=KNOWN, alt_repl=None, capitalize=True, flags=re.I):
+        self.rx = re.compile(pattern, flags)
+        self.repl = repl
+        self.check = check
+        self.alt_repl = alt_repl
+        self.capitalize = capitalize
+
+    def __call__(self, schecker, token, ltoken, m):
+        token0 = self.rx.sub(self.repl, token)
+        if self.check == KNOWN_STRICT:
+            ok = schecker.is_known_word(token0, strict_yofication=True)
+        else:
+            ok = schecker.is_known_word(token0)
+            if ok and self.check in (KNOWN_VERB, KNOWN_VERB_NO_ALT):
+                ok = schecker.is_verb(token0)
+            if ok and self.check == KNOWN_VERB_NO_ALT:
+                ok = not schecker.is_known_word(self.rx.sub(self.alt_repl, token))
+
+        if not ok:
+            return None
+        if self.capitalize and token[0].lower() != token[0]:
+            return Aa(token0)
+        return token0
+
+
+class TokenRule(object):
+    def __init__(self, rule_id, gate, apply, first_chars=None, last_chars=None, exclusive=False, fallback=None):
+        self.rule_id = rule_id
+        self.gate = gate
+        self.apply = apply
+        # fallback(schecker, token, ltoken, m) - ответ по умолчанию, если условие выполнилось, а проверка нет:
+        # он возвращается, когда токен не исправило ни одно из следующих правил.
+        self.fallback = fallback
+        self.first_chars = frozenset(first_chars) if first_chars else None
+        self.last_chars = frozenset(last_chars) if last_chars else None
+        self.exclusive = exclusive
+
+    def may_apply(self, first, last):
+        return ((first is None or self.first_chars is None or first in self.first_chars)
+                and (last is None or self.last_chars is None or last in self.last_chars))
+
+
+class RuleStats(object):
+    """Счетчики по правилам: checks - проверки условия, matches - условие выполнилось, hits - токен исправлен."""
+    def __init__(self, rule_ids, timing=False):
+        self.rule_ids = list(rule_ids)
+        self.timing = timing
+        self.clear()
+
+    def clear(self):
+        n = len(self.rule_ids)
+        self.checks = [0] * n
+        self.matches = [0] * n
+        self.hits = [0] * n
+        self.seconds = [0.0] * n
+
+    def report(self):
+        """Строки (правило, проверки, срабатывания условия, исправления, секунды) в порядке правил."""
+        return list(zip(self.rule_ids, self.checks, self.matches, self.hits, self.seconds))
+
+
+class TokenRules(object):
+    def __init__(self, rules):
+        self.rules = rules
+        self.candidates_by_key = dict()
+
+    def rule_ids(self):
+        return [rule.rule_id for rule in self.rules]
+
+    def candidates(self, token):
+        """Номера правил, условие которых может выполниться для токена, в порядке приоритета."""
+        first = token[0].lower()
+        if first not in KEY_CHARS:
+            first = None
+        last = token[-1].lower()
+        if last not in KEY_CHARS:
+            last = None
+
+        key = (first, last)
+        candidates = self.candidates_by_key.get(key)
+        if candidates is None:
+            candidates = tuple(i for i, rule in enumerate(self.rules) if rule.may_apply(first, last))
+            self.candidates_by_key[key] = candidates
+        return candidates
+
+    def apply(self, schecker, token, ltoken, stats=None):
+        """Пара (исправленный токен, правило) или (None, None)."""
+        rules = self.rules
+        default = None
+        for i in self.candidates(token):
+            rule = rules[i]
+            if stats is not None:
+                stats.checks[i] += 1
+                if stats.timing:
+                    t0 = time.perf_counter()
+
+            m = rule.gate(schecker, token, ltoken)
+            token2 = None
+            if m:
+                token2 = rule.apply(schecker, token, ltoken, m)
+
+            if stats is not None:
+                if stats.timing:
+                    stats.seconds[i] += time.perf_counter() - t0
+                if m:
+                    stats.matches[i] += 1
+                    if token2:
+                        stats.hits[i] += 1
+
+            if token2:
+                return token2, rule.rule_id
+            if m:
+                if default is None and rule.fallback is not None:
+                    default = rule.fallback(schecker, token, ltoken, m)
+                if rule.exclusive:
+                    return (default, rule.rule_id) if default else (None, None)
+
+        return (default, None) if default else (None, None)
+
+
+# ---------------------------------------------------------------------------------------------
+# Правила, которые не укладываются в Sub.
+
+def fix_digit_zero(schecker, token, ltoken, m):
+    # п0д ==> под
+    token2 = ltoken.replace('0', 'о')
+    if token[0].lower() != token[0]:
+        token2 = Aa(token2)
+    return token2
+
+
+def join_apostrophe(schecker, token, ltoken, m):
+    return m.group(1) + m.group(2)
+
+
+def fix_apostrophe(schecker, token, ltoken, m):
+    # лa’вровый
+    # полон′или
+    token2 = join_apostrophe(schecker, token, ltoken, m)
+    if schecker.is_known_word(token2):
+        return token2
+    return None
+
+
+rx_shch_soft = re.compile(r'^(\w+)щь$', re.I)
+
+
+def fix_shch_soft_to_sh(schecker, token, ltoken, m):
+    # увидищь ==> увидишь
+    token0_1 = rx_shch_soft.sub('\\1шь', token)
+    # пожарищь ==> пожарищ
+    token0_2 = rx_shch_soft.sub('\\1щ', token)
+    if schecker.is_known_word(token0_1) and not schecker.is_known_word(token0_2):
+        return Aa(token0_1) if token[0].lower() != token[0] else token0_1
+    return None
+
+
+def fix_shch_soft_to_shch(schecker, token, ltoken, m):
+    # плащь ==> плащ
+    token0_1 = rx_shch_soft.sub('\\1шь', token)
+    token0_2 = rx_shch_soft.sub('\\1щ', token)
+    if schecker.is_known_word(token0_2) and not schecker.is_known_word(token0_1):
+        return Aa(token0_2) if token[0].lower() != token[0] else token0_2
+    return None
+
+
+def prefix_replacer(prefix):
+    def fix(schecker, token, ltoken, m):
+        # безконечный ==> бесконечный
+        # безпардонный ==> беспардонный
+        token0 = prefix + ltoken[3:]
+        if schecker.is_known_word(token0):
+            return Aa(token0) if token[0].lower() != token[0] else token0
+        return None
+    return fix
+
+
+rx_triple = re.compile(r'([бвгджзклмнпрстфхцчшщ])(\1){2,}', re.I)
+
+
+def fix_triple_consonant(schecker, token, ltoken, m):
+    # НО: "Ммм" оставляем такие цепочки без изменения
+    if len(set(token.lower())) == 1 or schecker.is_known_word(token):
+        return None
+
+    # ввверх ==> вверх
+    token0 = rx_triple.sub(r'\1\2', token)
+    if not schecker.is_known_word(token0):
+        # очччень ==> очень
+        token0 = rx_triple.sub(r'\2', token)
+        if not schecker.is_known_word(token0):
+            return None
+
+    return Aa(token0) if token[0].lower() != token[0] else token0
+
+
+def fix_add_soft_sign(schecker, token, ltoken, m):
+    # пресеч ==> пресечь
+    token0 = token + 'ь'
+    return token0 if schecker.is_known_word(token0) else None
+
+
+def fix_drop_soft_sign(schecker, token, ltoken, m):
+    # гадёнышь ==> гадёныш
+    # скрипачь ==> скрипач
+    token0 = token[:-1]
+    return token0 if schecker.is_known_word(token0) else None
+
+
+def fix_final_hard_sign(schecker, token, ltoken, m):
+    if token.lower() in ('азъ',):
+        return None
+
+    # пылъ ==> пыль
+    token0 = token[:-1] + 'ь'
+    if not schecker.is_known_word(token0):
+        # крикъ ==> крик
+        token0 = token[:-1]
+        if not schecker.is_known_word(token0):
+            return None
+
+    return Aa(token0) if token[0].lower() != token[0] else token0
+
+
+def fix_zb(schecker, token, ltoken, m):
+    # збудутся ==> сбудутся
+    token0 = 'с' + token[1:]
+    if schecker.is_known_word(token0):
+        return Aa(token0) if token[0].lower() != token[0] else token0
+    return None
+
+
+rx_latin = re.compile('[3a-zëáóúόéýќўú]', re.I)
+rx_cyrillic = re.compile('[абвгдеёжзийклмнопрстуфхцчшщъыьэюя]', re.I)
+
+
+def mixed_latin_cyrillic(schecker, token, ltoken):
+    return rx_latin.search(token) is not None and rx_cyrillic.search(token) is not None
+
+
+def fix_mixed_latin_cyrillic(schecker, token, ltoken, m):
+    # В слове смешана латиница и кириллица.
+    token0 = restore_cyrillic(token)
+    if schecker.is_known_word(token0):
+        return Aa(token0) if token[0].lower() != token[0] else token0
+    return None
+
+
+def prefix_voicing(old, new):
+    def fix(schecker, token, ltoken, m):
+        # безсмертие ==> бессмертие
+        # всдыхая ==> вздыхая
+        token0 = m.group(1).replace(old, new) + m.group(2)
+        if schecker.is_known_word(token0):
+            return Aa(token0) if token[0].lower() != token[0] else token0
+        return None
+    return fix
+
+
+rx_word = re.compile(r'^\w+$')
+
+
+def long_word_for_fuzzy_index(schecker, token, ltoken):
+    return schecker.fuzzy_index is not None and len(token) >= 7 and rx_word.match(token)
+
+
+def fix_by_fuzzy_index(schecker, token, ltoken, m):
+    # Пробуем заменить длинное слово по словарю
+    token3 = schecker.fuzzy_index.correction(token.lower(), schecker.fuzzy_max_distance)
+    if token3:
+        if token[0].lower() != token[0]:
+            token3 = Aa(token3)
+        if token3 != token:
+            return token3
+    return None
+
+
+TOKEN_RULES = [
+    # Только кириллические буквы и нули: числа вроде 100%, 1990г, 10мм не трогаем.
+    TokenRule('0→о', Gate(r'^(?=[а-яё0]*[а-яё])[а-яё0]*0[а-яё0]*$', flags=0, method='match', lower=True), fix_digit_zero),
+    # Ударение снимается и у незнакомого слова, если его не исправило другое правило.
+    TokenRule('’', Gate(r'^(\w+)[’′](\w+)$', flags=0, method='match', lower=True), fix_apostrophe, fallback=join_apostrophe),
+    # вплотъ ==> вплоть
+    TokenRule('ъ→ь', Gate('ъ'), Sub(r'^(?=\w+$)(\w*)ъ(\w*)$', '\\1ь\\2')),
+    # выпускайут ==> выпускают
+    TokenRule('йу→ю', Gate(r'\wйу'), Sub(r'^(?=\w+$)(\w+)йу(\w*)$', '\\1ю\\2')),
+    # тёша ==> тёща
+    TokenRule('ш→щ', Gate('ш'), Sub(r'^(?=\w+$)(\w*)ш(\w*)$', '\\1щ\\2')),
+    # под"езда ==> подъезда
+    TokenRule('"→ъ', Gate(r'^\w+"\w+$', flags=0, method='match'), Sub(r'^(\w+)"(\w+)$', '\\1ъ\\2')),
+    # щоколад ==> шоколад
+    TokenRule('щ→ш', Gate('щ'), Sub(r'^(?=\w+$)(\w*)щ(\w*)$', '\\1ш\\2', check=KNOWN_STRICT)),
+    # безискусных ==> безыскусный
+    TokenRule('бези→безы', Gate('^бези'), Sub(r'^(без)и(\w*)$', '\\1ы\\2'), first_chars='б'),
+    # льються ==> льются
+    TokenRule('ться→тся', Gate(r'^\w+ться$'), Sub(r'^(\w+)ться$', '\\1тся'), last_chars='я'),
+    # заниматся ==> заниматься
+    TokenRule('тся→ться', Gate(r'^\w+тся$'), Sub(r'^(\w+)тся$', '\\1ться', check=KNOWN_VERB), last_chars='я'),
+    # хочецца ==> хочется
+    TokenRule('цца→тся', Gate(r'^\w+цца$'), Sub(r'^(\w+)цца$', '\\1тся', check=KNOWN_VERB_NO_ALT, alt_repl='\\1ться'), last_chars='а'),
+    # улыбаетса ==> улыбается
+    # улыбаютса ==> улыбаются
+    TokenRule('тса→тся', Gate(r'^\w+тса$'), Sub(r'^(\w+)тса$', '\\1тся', check=KNOWN_VERB_NO_ALT, alt_repl='\\1ться'), last_chars='а'),
+    # раздаюца ==> раздаются
+    # случаеца
+    TokenRule('ца→тся', Gate(r'^\w+а(ю|е)ца$'), Sub(r'^(\w+а(ю|е))ца$', '\\1тся', check=KNOWN_VERB_NO_ALT, alt_repl='\\1ться'), last_chars='а'),
+    # зделать ==> сделать
+    TokenRule('здел→сдел', Gate(r'^здел\w+$'), Sub(r'^здел(\w+)$', 'сдел\\1'), first_chars='з'),
+    TokenRule('щь→шь', Gate(r'^\w+щь$'), fix_shch_soft_to_sh, last_chars='ь'),
+    TokenRule('щь→щ', Gate(r'^\w+щь$'), fix_shch_soft_to_shch, last_chars='ь'),
+    # изьянов ==> изъянов
+    TokenRule('ь→ъ', Gate(r'^(?=\w+$)\w*[бвгджзклмнпрстфхцчшщ]ь[аеёиоуыэюя]\w+$'),
+              Sub(r'^(?=\w+$)(\w*[бвгджзклмнпрстфхцчшщ])ь([аеёиоуыэюя]\w+)$', '\\1ъ\\2')),
+
+    # Дальше бывшая цепочка elif: первое правило с выполненным условием решает судьбу токена.
+    TokenRule('безк→беск', Gate(r'^без[кпстфхц]\w+', method='match'), prefix_replacer('бес'), first_chars='б', exclusive=True),
+    TokenRule('бесб→безб', Gate(r'^бес[бвгджзлмнр]\w+', method='match'), prefix_replacer('без'), first_chars='б', exclusive=True),
+    # ввверх ==> вверх
+    # испуганнной ==> испуганной
+    TokenRule('ввв→вв', Gate(r'([бвгджзклмнпрстфхцчшщ])\1{2,}'), fix_triple_consonant, exclusive=True),
+    # Удивителььный ==> Удивительный
+    TokenRule('ьь→ь', Gate(r'([ыщьъй])\1'), Sub(r'([ыщьъй])\1{1,}', r'\1'), exclusive=True),
+    # обычнейшый ==> обычнейший
+    TokenRule('жы→жи', Gate(r'[жшщ]ы'), Sub(r'([жшщ])ы', r'\1и'), exclusive=True),
+    # боишся ==> боишься
+    TokenRule('шся→шься', Gate(r'^\w+[аеёиоуыя]шся$'), Sub(r'^(\w+[аеёиоуыя])шся$', '\\1шься'), last_chars='я', exclusive=True),
+    # сможеш ==> сможешь
+    TokenRule('ш$→шь', Gate(r'^\w{2,}[аеёио]ш$'), Sub(r'^(\w+[аеёио])ш$', '\\1шь'), last_chars='ш', exclusive=True),
+    # уничтож ==> уничтожь
+    TokenRule('ж$→жь', Gate(r'^\w{2,}[аеёиоуыюя]ж$'), Sub(r'^(\w+[аеёиоуюыя])ж$', '\\1жь'), last_chars='ж', exclusive=True),
+    TokenRule('ч$→чь', Gate(r'^\w{2,}[аеёиоуюя]ч$'), fix_add_soft_sign, last_chars='ч', exclusive=True),
+    TokenRule('шь$→ш', Gate(r'^\w{2,}[аеёиоуыюя][шч]ь$'), fix_drop_soft_sign, last_chars='ь', exclusive=True),
+    # лучём ==> лучом
+    TokenRule('чём→чом', Gate(r'^\w{2,}чём$'), Sub(r'^(\w{2,})чём$', '\\1чом'), last_chars='м', exclusive=True),
+    # пъедестала ==> пьедестала
+    TokenRule('съе→сье', Gate(r'^(?=\w+$)\w*[бвгджзклмнпрстфхцчшщ]ъ[аеёиоуыэюя]\w*$'),
+              Sub(r'^(?=\w+$)(\w*[бвгджзклмнпрстфхцчшщ])ъ([аеёиоуыэюя]\w*)$', '\\1ь\\2'), exclusive=True),
+    # девчёночка ==> девчоночка
+    TokenRule('чё→чо', Gate(r'^(?=\w+$)\w*чё\w*$'), Sub(r'^(?=\w+$)(\w*)чё(\w*)$', '\\1чо\\2'), exclusive=True),
+    TokenRule('ъ$→ь', Gate(r'^\w+[бвгджзклмнпрстфхцчшщ]ъ$'), fix_final_hard_sign, last_chars='ъ', exclusive=True),
+    # обьяснять ==> объяснять
+    TokenRule('обь→объ', Gate(r'^обь[аеёиоуыэюя]\w+$'), Sub(r'^обь([аеёиоуыэюя]\w+)$', 'объ\\1'), first_chars='о', exclusive=True),
+    TokenRule('lat→cyr', mixed_latin_cyrillic, fix_mixed_latin_cyrillic, exclusive=True),
+    # изчезать ==> исчезать
+    TokenRule('изч→исч', Gate(r'^изч[аеёиоуыэюя]\w+$'), Sub(r'^из(ч[аеёиоуыэюя]\w+)$', 'ис\\1'), first_chars='и', exclusive=True),
+    # здаваться ==> сдаваться
+    TokenRule('здав→сдав', Gate(r'^здав\w+$'), Sub(r'^з(дав\w+)$', 'с\\1'), first_chars='з', exclusive=True),
+    # изподлобья ==> исподлобья
+    TokenRule('зп→сп', Gate(r'^(?=\w+$)\w*зп\w+$'), Sub(r'^(?=\w+$)(\w*)зп(\w+)$', '\\1сп\\2'), exclusive=True),
+    # прошол ==> прошёл
+    TokenRule('шол→шёл', Gate(r'^\w+шол$'), Sub(r'^(\w+)шол$', '\\1шёл'), last_chars='л', exclusive=True),
+    # плющём ==> плющом
+    TokenRule('щём→щом', Gate(r'^\w+щём$'), Sub(r'^(\w+)щём$', '\\1щом'), last_chars='м', exclusive=True),
+    # ночькой ==> ночкой
+    TokenRule('чьк→чк', Gate(r'^(?=\w+$)\w+чь[кн]\w+$'), Sub(r'^(?=\w+$)(\w+ч)ь([кн]\w+)$', '\\1\\2'), exclusive=True),
+    # улетучтесь ==> улетучьтесь
+    TokenRule('чт→чьт', Gate(r'\wч[бвгджзклмнпрстфхц]'), Sub(r'(?<!\w)(\w+ч)([бвгджзклмнпрстфхц]\w*)', '\\1ь\\2'), exclusive=True),
+    # слався ==> славься
+    TokenRule('вся→вься', Gate(r'^\w+вся$'), Sub(r'^(\w+)вся$', '\\1вься', check=KNOWN_VERB), last_chars='я', exclusive=True),
+    # представте ==> представьте
+    TokenRule('вте→вьте', Gate(r'^\w+вте$'), Sub(r'^(\w+)вте$', '\\1вьте', check=KNOWN_VERB), last_chars='е', exclusive=True),
+    # представтесь ==> представьтесь
+    TokenRule('втесь→вьтесь', Gate(r'^\w+втесь$'), Sub(r'^(\w+)втесь$', '\\1вьтесь', check=KNOWN_VERB), last_chars='ь', exclusive=True),
+    # грущю ==> грущу
+    TokenRule('щю→щу', Gate('щю'), Sub(r'^(?=\w+$)(\w*)щю(\w*)$', '\\1щу\\2'), exclusive=True),
+    # канючю ==> канючу
+    TokenRule('чю→чу', Gate('чю'), Sub('чю', 'чу'), exclusive=True),
+    # мечьтах ==> мечтах
+    TokenRule('чьб→чб', Gate('чь[бвгджзклмнпрстфх]'), Sub('чь([бвгджзклмнпрстфх])', 'ч\\1'), exclusive=True),
+    # чорный ==> чёрный
+    TokenRule('чор→чёр', Gate('чор'), Sub('чор', 'чёр'), exclusive=True),
+    # обращяя ==> обращая
+    TokenRule('щя→ща', Gate('щя'), Sub('щя', 'ща'), exclusive=True),
+    # зайчищки ==> зайчишки
+    TokenRule('щк→шк', Gate('щк'), Sub('щк', 'шк'), exclusive=True),
+    # мелочях ==> мелочах
+    TokenRule('чя→ча', Gate('чя'), Sub('чя', 'ча'), exclusive=True),
+    # мощьный ==> мощный
+    TokenRule('щьн→щн', Gate('[щч]ь[н]'), Sub('([щч])ь([н])', '\\1\\2'), exclusive=True),
+    # збудутся ==> сбудутся
+    TokenRule('зб→сб', Gate(r'^зб\w+$', method='match'), fix_zb, first_chars='з', exclusive=True),
+    # грабёжь ==> грабёж
+    TokenRule('жь→ж', Gate(r'^\w+жь$'), Sub(r'^(\w+ж)ь$', '\\1'), last_chars='ь', exclusive=True),
+    # рученками ==> ручонками
+    TokenRule('чен→чон', Gate(r'^(?=\w+$)\w+чен\w+$'), Sub(r'^(?=\w+$)(\w+)че(н\w+)$', '\\1чо\\2'), exclusive=True),
+    TokenRule('вз→вс', Gate(r'^(воз|вз|из|низ|раз|без|чрез|через)([кптхчцшщфс]\w+)$'), prefix_voicing('з', 'с'),
+              first_chars='винрбч', exclusive=True),
+    TokenRule('вс→вз', Gate(r'^(вос|вс|ис|нис|рас|бес|чрес|черес)([бвгджз]\w+)$'), prefix_voicing('с', 'з'),
+              first_chars='винрбч', exclusive=True),
+    TokenRule('norvig', long_word_for_fuzzy_index, fix_by_fuzzy_index, exclusive=True),
+]
+
+
+if __name__ == '__main__':
+    rules = TokenRules(TOKEN_RULES)
+    ids = rules.rule_ids()
+    assert len(ids) == len(set(ids))
+
+    candidates = [ids[i] for i in rules.candidates('пытатся')]
+    assert 'тся→ться' in candidates and 'шол→шёл' not in candidates and 'здел→сдел' not in candidates
+    assert 'ъ→ь' in candidates and 'lat→cyr' in candidates
+    candidates = [ids[i] for i in rules.candidates('Зделал')]
+    assert 'здел→сдел' in candidates and 'шол→шёл' in candidates and 'тся→ться' not in candidates
+    # Для редких символов индекс не используется: при re.I буква ᲀ совпадает с "в".
+    assert 'вз→вс' in [ids[i] for i in rules.candidates('ᲀзял')]
+
+    class Checker(object):
+        known_words = {'сделать', 'заниматься', 'вверх'}
+        fuzzy_index = None
+
+        def is_known_word(self, word, strict_yofication=False):
+            return word.lower() in self.known_words
+
+        def is_verb(self, word):
+            return word.lower() == 'заниматься'
+
+    checker = Checker()
+    stats = RuleStats(ids, timing=True)
+    for token, expected in [('зделать', ('сделать', 'здел→сдел')), ('Зделать', ('Сделать', 'здел→сдел')),
+                            ('заниматся', ('заниматься', 'тся→ться')), ('Ввверх', ('Вверх', 'ввв→вв')),
+                            ('ммм', (None, None)), ('полон′или', ('полонили', None))]:
+        assert rules.apply(checker, token, token.lower(), stats) == expected, token
+
+    # Ноль меняется на "о" только в словах из кириллицы, числа с единицами измерения остаются как есть.
+    for token, expected in [('п0д', ('под', '0→о')), ('П0Д0', ('Подо', '0→о')), ('70%', (None, None)),
+                            ('100%', (None, None)), ('1990г', (None, None)), ('10мм', (None, None)), ('d0g', (None, None))]:
+        assert rules.apply(checker, token, token.lower()) == expected, token
+
+    report = dict((row[0], row[1:]) for row in stats.report())
+    assert report['здел→сдел'][:3] == (2, 2, 2) and report['ввв→вв'][2] == 1 and report['шол→шёл'][0] == 0
+    assert report['тся→ться'][3] > 0.0
+
+    print('All done =)')
@@ -44,7 +44,7 @@ def tokenize_slowly(text: str):
             for t2 in t.replace('/', ' / ').split(' '):
                 if t2:
                     yield decoding.get(t2, t2)
-        elif re.match(r'(\w+|){1,}\w+', t):
+        elif re.match(r'\w', t):
             # дедушка|человеки
             for t2 in t.replace('|', ' | ').split(' '):
                 if t2:
@@ -57,70 +57,215 @@ def tokenize_slowly(text: str):
             yield decoding.get(t, t)
 
 
-if __name__ == '__main__':
-    tx = list(tokenize_slowly("'''Де́мон''' - название нечистой силы"))
-    print(tx)
-
-    # Прогулка по музею-заповеднику В. Д. Поленова.
-
-    tx = list(tokenize_slowly("Бесоёбит)"))
-    assert (tx == ["Бесоёбит", ")"])
-
-    tx = list(tokenize_slowly("А-ля клавир"))
-    assert (tx == ["А-ля", "клавир"])
-
-    tx = list(tokenize_slowly("по-кавказски"))
-    assert (tx == ["по-кавказски"])
-
-    tx = list(tokenize_slowly("поставил жизнь ва-банк"))
-    assert (tx == ["поставил", "жизнь", "ва-банк"])
-
-    # 'гадости' шепчет
-    tx = list(tokenize_slowly("'гадости' шепчет"))
-    assert (tx == ["'", "гадости", "'", "шепчет"])
-
-    tx = list(tokenize_slowly('дедушка|человеки'))
-    assert (tx == ['дедушка', '|', 'человеки'])
-
-    tx = list(tokenize_slowly('финансовую/военную'))
-    assert (tx == ['финансовую', '/', 'военную'])
-
-    tx = list(tokenize_slowly('до н.э.!'))
-    assert '|'.join(tx) == 'до|н.э.|!'
-
-    tx = list(tokenize_slowly('Японию🤣'))
-    assert '|'.join(tx) == 'Японию|🤣'
+# Специальные многословные токены, которые не надо резать по дефисам и пробелам,
+# и сокращения с точками (после них граница слова не требуется).
+# Строки без обратного слэша - это литералы, они раскладываются в префиксное дерево.
+# Строки с обратным слэшем - регулярные выражения для токенов с переменным хвостом.
+# Список можно дополнить из файла, см. load_special_tokens().
+SPECIAL_TOKENS = ['а-ля', 'тет-а-тет', 'ва-банк', r'рок-н-рол\w*', r'Нью-Йорк\w*', 'Улан-Удэ', 'давным-давно',
+                  'кое у кого', 'кое о чем', 'кое о чём', 'кое о ком', 'кое на что', 'кое на кого', 'кое с чем',
+                  'кое с кем', 'кое в кого', 'кое во что', 'кое к чему', 'кое к кому', 'кое-чем', 'кое-что',
+                  'кое-как', 'кое-куда', 'кое-где', 'кое-кто', 'рок-н-ролл', r'по-\w{4,}', 'как-то', 'где-то',
+                  'когда-то', 'зачем-то', 'почему-то', 'откуда-то', 'точь-в-точь',
+                  r'т\.\s?д\.', r'т\.\s?к\.', r'т\.\s?п\.', r'т\.\s?е\.', r'н\.\s?э\.', r'н\.\s?п\.']
+
+DELIMITERS = '.,!?\\-;:()–—⸺«»″”“„"…+'
+
+WORD_RUN = r'[^\W' + EMOJI_CHARACTER[1:-1] + r']+'
+CHUNK_CHAR = r'[^\s' + DELIMITERS + EMOJI_CHARACTER[1:-1] + r']'
+
+NOT_CHUNK_RX = re.compile(r'[\s' + DELIMITERS + r']|' + EMOJI_CHARACTER)
+SLASHED_RX = re.compile(r'(?:\w+/)+\w+')
+QUOTED_RX = re.compile(r"'\w+'")
+
+
+def load_special_tokens(path: str) -> typing.List[str]:
+    """Читает список специальных токенов из файла: одна запись на строку, # - комментарий."""
+    special_tokens = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                special_tokens.append(line)
+    return special_tokens
+
+
+def token_boundary(token: str) -> str:
+    # После сокращения с точкой граница слова не нужна, после остальных токенов - обязательна.
+    return '' if token.endswith('.') else r'\b'
+
+
+def trie_regex(node: dict) -> str:
+    # Дерево {буква: поддерево}, ключ None - конец литерала с условием границы.
+    # Продолжения перебираются раньше конца, так что из двух литералов с общим префиксом
+    # выигрывает более длинный, а регулярка на каждой позиции проверяет не больше одной ветки на букву.
+    alts = [re.escape(c) + trie_regex(child) for c, child in sorted(node.items(), key=lambda kv: kv[0] or '') if c is not None]
+    if None in node:
+        alts.append(node[None])
+    if len(alts) == 1:
+        return alts[0]
+    return '(?:' + '|'.join(alts) + ')'
+
+
+def special_regex(special_tokens: typing.Iterable[str]) -> str:
+    trie = dict()
+    patterns = []
+    for token in special_tokens:
+        if '\\' in token:
+            patterns.append('(?:' + token + ')' + token_boundary(token))
+        else:
+            node = trie
+            for c in token.lower():
+                node = node.setdefault(c, dict())
+            node[None] = token_boundary(token)
+
+    alts = patterns
+    if trie:
+        alts = [trie_regex(trie)] + patterns
+    return r'(?i:' + '|'.join(alts) + r')'
+
+
+class Tokenizer(object):
+    """
+    Токенизатор с заданным списком специальных токенов.
+
+    Весь текст режется одним проходом finditer на пробелы, разделители и куски текста между ними (chunk).
+    Специальные токены распознаются в этом же проходе по префиксному дереву, скомпилированному
+    в регулярку, без подстановки заглушек в текст.
+    """
+    def __init__(self, special_tokens: typing.Iterable[str] = SPECIAL_TOKENS):
+        self.special_tokens = list(special_tokens)
+        special = special_regex(self.special_tokens)
+
+        # Специальный токен может начинаться только на границе слова, поэтому внутри куска пробуем его
+        # лишь перед очередным словом: "кое о чём", "как-то|мир".
+        self.token_rx = re.compile(r'(?P<space>\s+)'
+                                   r'|(?P<delimiter>[' + DELIMITERS + r']|' + EMOJI_CHARACTER + r')'
+                                   r'|(?P<chunk>(?:\b' + special + r'|' + WORD_RUN + r'|' + CHUNK_CHAR + r')+)')
+        self.special_rx = re.compile(r'\b' + special)
+
+    def split_chunk(self, t: str, start: int):
+        # Специальные токены внутри куска заменяем на одну букву, чтобы проверять форму куска так,
+        # как если бы специальный токен был одним словом.
+        shape = self.special_rx.sub('x', t) if NOT_CHUNK_RX.search(t) else t
+
+        if '/' in shape and SLASHED_RX.fullmatch(shape):
+            # финансовую/военную  ==> разрезаем на 2 токена: финансовую военную
+            for t2 in re.split('(/)', t):
+                if t2:
+                    yield t2, start, start + len(t2)
+                start += len(t2)
+        elif shape[0].isalnum() or shape[0] == '_':
+            # дедушка|человеки
+            if '|' in t:
+                for t2 in re.split(r'(\|)', t):
+                    if t2:
+                        yield t2, start, start + len(t2)
+                    start += len(t2)
+            else:
+                yield t, start, start + len(t)
+        elif shape[0] == "'" and QUOTED_RX.match(shape):
+            end = start + len(t)
+            yield t[0], start, start + 1
+            yield t[1:-1], start + 1, end - 1
+            yield t[-1], end - 1, end
+        else:
+            yield t, start, start + len(t)
 
-    tx = list(tokenize_slowly('Давай-ка, спроси кое о чём меня-то'))
-    assert '|'.join(tx) == 'Давай|-|ка|,|спроси|кое о чём|меня|-|то'
+    def tokenize_spans(self, text: str):
+        for m in self.token_rx.finditer(text):
+            kind = m.lastgroup
+            if kind == 'chunk':
+                yield from self.split_chunk(m.group(), m.start())
+            elif kind != 'space':
+                yield m.group(), m.start(), m.end()
 
-    tx = list(tokenize_slowly('и т.д. и т.п.?'))
-    assert '|'.join(tx) == 'и|т.д.|и|т.п.|?'
+    def tokenize(self, text: str):
+        for token, start, end in self.tokenize_spans(text):
+            yield token
 
-    tx = list(tokenize_slowly('кошка ловит мышей.'))
-    assert '|'.join(tx) == 'кошка|ловит|мышей|.'
 
-    tx = list(tokenize_slowly('т.д.'))
-    assert( tx == ['т.д.'])
+default_tokenizer = Tokenizer()
 
-    tx = list(tokenize_slowly('т.к.'))
-    assert( tx == ['т.к.'])
 
-    tx = list(tokenize_slowly('кое-что'))
-    assert( tx == ['кое-что'])
+def tokenize_spans(text: str):
+    """
+    Токенизация с позициями: выдает тройки (токен, start, end), причем text[start:end] == токен.
+    Многословные специальные токены вроде "кое о чём" и "т. д." выдаются одним токеном со своим интервалом.
+    Время работы линейно по длине текста.
+    """
+    yield from default_tokenizer.tokenize_spans(text)
 
-    tx = list(tokenize_slowly('т.п.'))
-    assert( tx == ['т.п.'])
 
-    tx = list(tokenize_slowly('кое-как'))
-    assert( tx == ['кое-как'])
+def tokenize_fast(text: str):
+    """То же, что tokenize_slowly, но за один проход по тексту и без подстановки заглушек token{i}."""
+    yield from default_tokenizer.tokenize(text)
 
-    tx = list(tokenize_slowly('Все как-то просто и по-детски'))
-    assert (tx == ['Все', 'как-то', 'просто', 'и', 'по-детски'])
 
-    tx = list(tokenize_slowly('Тет-а-тет я с луной.'))
-    assert (tx == ['Тет-а-тет', 'я', 'с', 'луной', '.'])
+if __name__ == '__main__':
+    tx = list(tokenize_slowly("'''Де́мон''' - название нечистой силы"))
+    print(tx)
 
-    tx = list(tokenize_slowly('Про жизнь в Нью-Йорке'))
-    assert (tx == ['Про', 'жизнь', 'в', 'Нью-Йорке'])
+    # Прогулка по музею-заповеднику В. Д. Поленова.
 
+    cases = [("Бесоёбит)", ["Бесоёбит", ")"]),
+             ("А-ля клавир", ["А-ля", "клавир"]),
+             ("по-кавказски", ["по-кавказски"]),
+             ("поставил жизнь ва-банк", ["поставил", "жизнь", "ва-банк"]),
+             # 'гадости' шепчет
+             ("'гадости' шепчет", ["'", "гадости", "'", "шепчет"]),
+             ('дедушка|человеки', ['дедушка', '|', 'человеки']),
+             ('финансовую/военную', ['финансовую', '/', 'военную']),
+             ('до н.э.!', 'до|н.э.|!'.split('|')),
+             ('Японию🤣', 'Японию|🤣'.split('|')),
+             ('Давай-ка, спроси кое о чём меня-то', 'Давай|-|ка|,|спроси|кое о чём|меня|-|то'.split('|')),
+             ('и т.д. и т.п.?', 'и|т.д.|и|т.п.|?'.split('|')),
+             ('кошка ловит мышей.', 'кошка|ловит|мышей|.'.split('|')),
+             ('т.д.', ['т.д.']),
+             ('т.к.', ['т.к.']),
+             ('кое-что', ['кое-что']),
+             ('т.п.', ['т.п.']),
+             ('кое-как', ['кое-как']),
+             ('Все как-то просто и по-детски', ['Все', 'как-то', 'просто', 'и', 'по-детски']),
+             ('Тет-а-тет я с луной.', ['Тет-а-тет', 'я', 'с', 'луной', '.']),
+             ('Про жизнь в Нью-Йорке', ['Про', 'жизнь', 'в', 'Нью-Йорке']),
+             ]
+
+    for tokenizer in (tokenize_slowly, tokenize_fast):
+        for text, expected in cases:
+            tx = list(tokenizer(text))
+            assert tx == expected, (tokenizer.__name__, text, tx)
+
+    # Быстрый токенизатор должен выдавать то же, что и медленный.
+    texts = [text for text, _ in cases]
+    texts.extend(["'''Де́мон''' - название нечистой силы",
+                  'Кое с кем я т. д. и т. п., а кое-где   и  кое-куда\tпо-хорошему…',
+                  'Бывает так — «рок-н-роллы» и Улан-Удэ, точь-в-точь как в Нью-Йорке!',
+                  'A Б 3емля, 70% и VII в. н. э. ©2024 🤣🤣 ну+ну а/б/в дедушка||человеки',
+                  'как-тоже кое-какой где-то-там почему-то, откуда-то; зачем-то: когда-то?',
+                  '  Давным-давно\n\nв   тридесятом (царстве) "жил" ″царь″ „да“ ⸺ был – вот',
+                  "ТЕТ-А-ТЕТ, Кое О Чём, По-Русски 'x' 'по' _под_черк х*й п*здец",
+                  ''])
+    for text in texts:
+        assert list(tokenize_fast(text)) == list(tokenize_slowly(text)), text
+
+        for token, start, end in tokenize_spans(text):
+            assert text[start:end] == token, (text, token, start, end)
+
+    tx = list(tokenize_spans('Спроси кое о чём, и т. д.'))
+    assert tx == [('Спроси', 0, 6), ('кое о чём', 7, 16), (',', 16, 17), ('и', 18, 19), ('т. д.', 20, 25)]
+
+    # Заглушки token{i} в tokenize_slowly путаются с таким же текстом во входной строке.
+    tx = list(tokenize_fast('token0 кое-как'))
+    assert tx == ['token0', 'кое-как'], tx
+
+    # Список специальных токенов можно расширять.
+    tokenizer = Tokenizer(SPECIAL_TOKENS + ['из-за', 'из-под', r'г\.\s?г\.'])
+    tx = list(tokenizer.tokenize('Из-за леса, из-под гор, в 1990-2000 г. г. кое-как'))
+    assert tx == ['Из-за', 'леса', ',', 'из-под', 'гор', ',', 'в', '1990', '-', '2000', 'г. г.', 'кое-как'], tx
+    assert list(tokenize_fast('из-за')) == ['из', '-', 'за']
+
+    tx = list(tokenize_spans("'гадости' финансовую/военную"))
+    assert tx == [("'", 0, 1), ('гадости', 1, 8), ("'", 8, 9), ('финансовую', 10, 20), ('/', 20, 21), ('военную', 21, 28)]
+
+    print('All done =)')